@@ -1,16 +1,21 @@
 import time
 import threading
+from contextlib import nullcontext
 from filesystem.mobile_fs import FileSystem
+from filesystem.quota import QuotaExceededError
 from memory.memory_manager import MemoryManager
 from process.pcb import PCB
 from process.scheduler import Scheduler
 from concurrency.shared_resources import shared_photo_queue, queue_condition
 
 class CameraTask(threading.Thread):
-    def __init__(self, fs: FileSystem, log_fn=None):
+    def __init__(self, fs: FileSystem, log_fn=None, directory="/", owner=None):
         super().__init__(daemon=True)
         self.fs = fs
         self.log_fn = log_fn
+        self.directory = directory
+        # Photos are charged to this user's quota, if given.
+        self.owner = owner
         self.counter = 1
         self.running = True
 
@@ -18,7 +23,15 @@ class CameraTask(threading.Thread):
         while self.running:
             time.sleep(2)
             filename = f"photo_{self.counter}.jpg"
-            self.fs.create_file(filename, "image-data")
+            try:
+                with self.fs.as_user(self.owner) if self.owner else nullcontext():
+                    self.fs.create_file(f"{self.directory.rstrip('/')}/{filename}", "image-data")
+            except QuotaExceededError as e:
+                msg = f"[CameraTask] {filename} not saved: {e.strerror}"
+                print(msg)
+                if self.log_fn:
+                    self.log_fn(msg)
+                continue
 
             with queue_condition:
                 shared_photo_queue.put(filename)
@@ -0,0 +1,226 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUPolicy:
+    def __init__(self, entries):
+        self.order = OrderedDict()
+
+    def insert(self, key):
+        self.order[key] = None
+
+    def access(self, key):
+        self.order.move_to_end(key)
+
+    def victim(self):
+        return self.order.popitem(last=False)[0]
+
+    def remove(self, key):
+        self.order.pop(key, None)
+
+    def clear(self):
+        self.order.clear()
+
+
+class ClockPolicy:
+    """CLOCK: a FIFO ring where referenced entries get a second chance."""
+
+    def __init__(self, entries):
+        self.ring = OrderedDict()
+
+    def insert(self, key):
+        self.ring[key] = False
+
+    def access(self, key):
+        self.ring[key] = True
+
+    def victim(self):
+        while True:
+            key, referenced = self.ring.popitem(last=False)
+            if not referenced:
+                return key
+            self.ring[key] = False
+
+    def remove(self, key):
+        self.ring.pop(key, None)
+
+    def clear(self):
+        self.ring.clear()
+
+
+class TwoQPolicy:
+    """2Q: new blocks enter a FIFO (A1in) and only move to the LRU (Am)
+    when they are requested again after falling out into the ghost list."""
+
+    def __init__(self, entries):
+        self.ghost_limit = max(1, entries // 2)
+        self.a1in = OrderedDict()
+        self.a1out = OrderedDict()
+        self.am = OrderedDict()
+
+    def insert(self, key):
+        if key in self.a1out:
+            del self.a1out[key]
+            self.am[key] = None
+        else:
+            self.a1in[key] = None
+
+    def access(self, key):
+        if key in self.am:
+            self.am.move_to_end(key)
+
+    def victim(self):
+        resident = len(self.a1in) + len(self.am)
+        if self.a1in and (len(self.a1in) > resident // 4 or not self.am):
+            key = self.a1in.popitem(last=False)[0]
+            self.a1out[key] = None
+            if len(self.a1out) > self.ghost_limit:
+                self.a1out.popitem(last=False)
+            return key
+        return self.am.popitem(last=False)[0]
+
+    def remove(self, key):
+        self.a1in.pop(key, None)
+        self.am.pop(key, None)
+
+    def clear(self):
+        self.a1in.clear()
+        self.a1out.clear()
+        self.am.clear()
+
+
+class ARCPolicy:
+    """Adaptive Replacement Cache (Megiddo & Modha), sized in entries."""
+
+    def __init__(self, entries):
+        self.c = max(1, entries)
+        self.p = 0
+        self.t1 = OrderedDict()
+        self.t2 = OrderedDict()
+        self.b1 = OrderedDict()
+        self.b2 = OrderedDict()
+
+    def insert(self, key):
+        if key in self.b1:
+            self.p = min(self.c, self.p + max(len(self.b2) // len(self.b1), 1))
+            del self.b1[key]
+            self.t2[key] = None
+        elif key in self.b2:
+            self.p = max(0, self.p - max(len(self.b1) // len(self.b2), 1))
+            del self.b2[key]
+            self.t2[key] = None
+        else:
+            self.t1[key] = None
+        while len(self.b1) + len(self.t1) > self.c and self.b1:
+            self.b1.popitem(last=False)
+        while len(self.t1) + len(self.t2) + len(self.b1) + len(self.b2) > 2 * self.c and self.b2:
+            self.b2.popitem(last=False)
+
+    def access(self, key):
+        if key in self.t1:
+            del self.t1[key]
+            self.t2[key] = None
+        else:
+            self.t2.move_to_end(key)
+
+    def victim(self):
+        if self.t1 and (len(self.t1) > self.p or not self.t2):
+            key = self.t1.popitem(last=False)[0]
+            self.b1[key] = None
+        else:
+            key = self.t2.popitem(last=False)[0]
+            self.b2[key] = None
+        return key
+
+    def remove(self, key):
+        self.t1.pop(key, None)
+        self.t2.pop(key, None)
+
+    def clear(self):
+        for lst in (self.t1, self.t2, self.b1, self.b2):
+            lst.clear()
+        self.p = 0
+
+
+POLICIES = {
+    "lru": LRUPolicy,
+    "clock": ClockPolicy,
+    "2q": TwoQPolicy,
+    "arc": ARCPolicy,
+}
+
+
+class BlockCache:
+    """Thread-safe block cache bounded by total bytes, with a pluggable
+    eviction policy."""
+
+    def __init__(self, capacity=10 * 512, policy="lru", block_size=512):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown cache policy '{policy}'.")
+        self.capacity = capacity
+        self.policy_name = policy
+        self.policy = POLICIES[policy](max(1, capacity // block_size))
+        self._data = {}
+        self._lock = threading.Lock()
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, block_id):
+        with self._lock:
+            data = self._data.get(block_id)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.policy.access(block_id)
+            return data
+
+    def put(self, block_id, data):
+        with self._lock:
+            old = self._data.get(block_id)
+            if old is not None:
+                self.used -= len(old)
+                self.policy.access(block_id)
+            else:
+                self.policy.insert(block_id)
+            self._data[block_id] = data
+            self.used += len(data)
+            while self.used > self.capacity and self._data:
+                victim = self.policy.victim()
+                self.used -= len(self._data.pop(victim))
+                self.evictions += 1
+
+    def invalidate(self, block_id):
+        with self._lock:
+            data = self._data.pop(block_id, None)
+            if data is not None:
+                self.used -= len(data)
+                self.policy.remove(block_id)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.policy.clear()
+            self.used = 0
+
+    def __contains__(self, block_id):
+        return block_id in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "policy": self.policy_name,
+                "entries": len(self._data),
+                "used": self.used,
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,85 @@
+import bz2
+import lzma
+import threading
+import time
+import zlib
+
+CODECS = {
+    "zlib": (zlib.compress, zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+    "bz2": (bz2.compress, bz2.decompress),
+}
+
+
+class Compressor:
+    """Per-block compression stage for BlockStorage.
+
+    A block is kept compressed only if that saves at least ``min_saving``
+    of its size; anything else (JPEGs, mp3s, already-compressed data) is
+    stored raw. Within one ``store()`` call, after ``SKIP_AFTER``
+    incompressible blocks in a row only every ``PROBE_INTERVAL``-th block
+    is tried, so large media files cost little CPU.
+    """
+
+    SKIP_AFTER = 2
+    PROBE_INTERVAL = 8
+
+    def __init__(self, codec="zlib", min_saving=0.125):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown compression codec '{codec}'.")
+        self.codec = codec
+        self._compress, self._decompress = CODECS[codec]
+        self.min_saving = min_saving
+        self._lock = threading.Lock()
+        self.compressed = 0
+        self.incompressible = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compress_seconds = 0.0
+        self.decompress_seconds = 0.0
+
+    def should_try(self, misses, index):
+        if misses < self.SKIP_AFTER or index % self.PROBE_INTERVAL == 0:
+            return True
+        with self._lock:
+            self.skipped += 1
+        return False
+
+    def compress(self, block):
+        """Return the compressed block, or None if it is not worth it."""
+        start = time.perf_counter()
+        data = self._compress(bytes(block))
+        elapsed = time.perf_counter() - start
+        worth_it = len(data) <= len(block) * (1 - self.min_saving)
+        with self._lock:
+            self.compress_seconds += elapsed
+            if worth_it:
+                self.compressed += 1
+                self.bytes_in += len(block)
+                self.bytes_out += len(data)
+            else:
+                self.incompressible += 1
+        return data if worth_it else None
+
+    def decompress(self, data):
+        start = time.perf_counter()
+        block = self._decompress(data)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.decompress_seconds += elapsed
+        return block
+
+    def stats(self):
+        with self._lock:
+            return {
+                "codec": self.codec,
+                "compressed_blocks": self.compressed,
+                "incompressible_blocks": self.incompressible,
+                "skipped_blocks": self.skipped,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "compression_ratio": self.bytes_in / self.bytes_out if self.bytes_out else 1.0,
+                "compress_seconds": self.compress_seconds,
+                "decompress_seconds": self.decompress_seconds,
+            }
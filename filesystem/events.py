@@ -0,0 +1,144 @@
+import posixpath
+import queue
+import threading
+from collections import OrderedDict, namedtuple
+
+CREATED = "created"
+MODIFIED = "modified"
+DELETED = "deleted"
+MOVED = "moved"
+DIR_CHANGED = "dir_changed"
+
+# ``src`` is the old path of a MOVED event and None otherwise.
+Event = namedtuple("Event", "kind path src", defaults=(None,))
+
+# (pending kind, new kind) -> kind of the coalesced event; None drops both.
+_MERGED = {
+    (CREATED, DELETED): None,
+    (MODIFIED, DELETED): DELETED,
+    (DELETED, CREATED): MODIFIED,
+    (DELETED, MODIFIED): MODIFIED,
+}
+
+
+class Subscription:
+    """Coalescing event queue of one subscriber.
+
+    Pending events are keyed by path, so a burst of changes to one entry
+    is delivered once: repeated modifications collapse, a modification
+    after a creation stays a creation, a deletion cancels a pending
+    creation and a re-creation after a deletion becomes a modification.
+    ``get`` and ``drain`` may be called from any thread.
+    """
+
+    def __init__(self, bus, path):
+        self.bus = bus
+        self.path = path
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self.received = 0
+        self.coalesced = 0
+
+    def wants(self, event):
+        """True for events on the watched path or anything below it, and
+        for the deletion or move of one of its ancestors."""
+        root = self.path
+        for path in (event.path, event.src):
+            if path is None:
+                continue
+            if root == "/" or path == root or path.startswith(root + "/"):
+                return True
+            if event.kind in (DELETED, MOVED) and root.startswith(path + "/"):
+                return True
+        return False
+
+    def put(self, event):
+        if event.kind == MOVED:
+            key = (MOVED, event.src, event.path)
+        elif event.kind == DIR_CHANGED:
+            key = (DIR_CHANGED, event.path)
+        else:
+            key = event.path
+        with self._cond:
+            self.received += 1
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = event
+            else:
+                self.coalesced += 1
+                kind = _MERGED.get((pending.kind, event.kind), pending.kind)
+                if kind is None:
+                    del self._pending[key]
+                else:
+                    self._pending[key] = pending._replace(kind=kind)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Next event, waiting up to ``timeout`` seconds (forever if None);
+        raises queue.Empty if none arrives."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._pending, timeout):
+                raise queue.Empty
+            return self._pending.popitem(last=False)[1]
+
+    def drain(self):
+        """All pending events, without waiting."""
+        with self._cond:
+            events = list(self._pending.values())
+            self._pending.clear()
+            return events
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class EventBus:
+    """Publishes filesystem change events to subscriptions.
+
+    Publishing costs nothing while nobody is subscribed. CREATED, DELETED
+    and MOVED events also raise DIR_CHANGED for the directories whose
+    listing changed.
+    """
+
+    def __init__(self):
+        self._subscriptions = ()
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, path="/"):
+        subscription = Subscription(self, path)
+        with self._lock:
+            self._subscriptions += (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions = tuple(s for s in self._subscriptions if s is not subscription)
+
+    def publish(self, kind, path, src=None):
+        subscriptions = self._subscriptions
+        if not subscriptions:
+            return
+        events = [Event(kind, path, src)]
+        if kind in (CREATED, DELETED, MOVED):
+            events.append(Event(DIR_CHANGED, posixpath.dirname(path)))
+        if kind == MOVED and posixpath.dirname(src) != posixpath.dirname(path):
+            events.append(Event(DIR_CHANGED, posixpath.dirname(src)))
+        with self._lock:
+            self.published += 1
+        for subscription in subscriptions:
+            for event in events:
+                if subscription.wants(event):
+                    subscription.put(event)
+
+    def stats(self):
+        subscriptions = self._subscriptions
+        return {
+            "subscriptions": len(subscriptions),
+            "published": self.published,
+            "pending": sum(len(s) for s in subscriptions),
+            "coalesced": sum(s.coalesced for s in subscriptions),
+        }
@@ -0,0 +1,222 @@
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import MutableMapping
+from itertools import chain
+from operator import itemgetter
+
+MAGIC = b"MOBFSIMG"
+VERSION = 1
+
+# magic, version, block size, dedup, codec, root inode, inode count,
+# block count, inode table offset, block index offset, block data offset
+SUPERBLOCK = struct.Struct('<8sHHB8sqqqqqq')
+# ino, kind, flags, owner, parent, size, ctime, name length, block count,
+# secret length; followed by the name, the block ids and the secret
+INODE_RECORD = struct.Struct('<qBBiqqdHIH')
+DIGEST_SIZE = 32
+NO_DIGEST = bytes(DIGEST_SIZE)
+
+
+def write_image(table, storage, root_ino, path, block_size):
+    """Stream the inodes and referenced blocks of ``table`` and ``storage``
+    into a single image file at ``path``.
+
+    The block index is columnar (ids, offsets, lengths, raw sizes,
+    reference counts and, for dedup storage only, digests; each a packed
+    array) so a mount reads it with a few ``frombytes`` calls. The caller
+    must keep both structures unchanged while this runs.
+    """
+    live = [ino for ino in range(1, len(table.kind)) if table.is_live(ino)]
+    counts = Counter(chain.from_iterable(table.block_lists[ino] or () for ino in live))
+    block_ids = array('q', sorted(counts))
+    refcounts = array('I', (counts[bid] for bid in block_ids))
+    lengths = array('I', (len(storage._stored(bid)) for bid in block_ids))
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(bytes(SUPERBLOCK.size))
+        inode_offset = f.tell()
+        for ino in live:
+            name = table.names[ino].encode()
+            blocks = table.block_lists[ino]
+            blocks = blocks.tobytes() if blocks is not None else b''
+            secret = table.secrets.get(ino, b'')
+            f.write(INODE_RECORD.pack(ino, table.kind[ino], table.flags[ino], table.owner[ino], table.parent[ino],
+                                      table.size[ino], table.ctime[ino], len(name), len(blocks) // 8, len(secret)))
+            f.write(name + blocks + secret)
+        index_offset = f.tell()
+        entry_size = 8 + 8 + 4 + 4 + 4 + (DIGEST_SIZE if storage.dedup else 0)
+        data_offset = index_offset + len(block_ids) * entry_size
+        offsets = array('q', [0]) * len(block_ids)
+        position = data_offset
+        for i, length in enumerate(lengths):
+            offsets[i] = position
+            position += length
+        raw_sizes = array('i', (storage.raw_sizes.get(bid, -1) for bid in block_ids))
+        f.write(block_ids.tobytes())
+        f.write(offsets.tobytes())
+        f.write(lengths.tobytes())
+        f.write(raw_sizes.tobytes())
+        f.write(refcounts.tobytes())
+        if storage.dedup:
+            for bid in block_ids:
+                f.write(storage.block_digests.get(bid) or NO_DIGEST)
+        for bid in block_ids:
+            f.write(storage._stored(bid))
+        f.seek(0)
+        codec = storage.compressor.codec.encode() if storage.compressor is not None else b''
+        f.write(SUPERBLOCK.pack(MAGIC, VERSION, block_size, storage.dedup, codec, root_ino, len(live), len(block_ids),
+                                inode_offset, index_offset, data_offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Image:
+    """Read-only view of an image file.
+
+    Opening one reads only the superblock and the block index; block
+    contents stay in the memory-mapped file until they are touched.
+    ``copy_blocks`` tells ``BlockStorage.restore_image`` to copy them into
+    the backend instead.
+    """
+
+    def __init__(self, path, copy_blocks=False):
+        self.path = path
+        self.copy_blocks = copy_blocks
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        (magic, version, self.block_size, dedup, codec, self.root, self.inode_count, count,
+         self.inode_offset, index_offset, self.data_offset) = SUPERBLOCK.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"'{path}' is not a filesystem image.")
+        self.dedup = bool(dedup)
+        self.codec = codec.rstrip(b'\0').decode() or None
+        columns = []
+        position = index_offset
+        for typecode in ('q', 'q', 'I', 'i', 'I'):
+            column = array(typecode)
+            column.frombytes(self._view[position:position + count * column.itemsize])
+            columns.append(column)
+            position += count * column.itemsize
+        self.block_ids, self.offsets, self.lengths, self.raw_sizes, self.refcounts = columns
+        self._digest_offset = position
+
+    def _find(self, block_id):
+        i = bisect_left(self.block_ids, block_id)
+        if i == len(self.block_ids) or self.block_ids[i] != block_id:
+            raise KeyError(block_id)
+        return i
+
+    def block(self, block_id):
+        return self.block_at(self._find(block_id))
+
+    def block_at(self, i):
+        start = self.offsets[i]
+        return self._view[start:start + self.lengths[i]]
+
+    def digests(self):
+        """``{block_id: digest}`` for the blocks that have one; empty for
+        images written without dedup, which store no digests."""
+        if not self.dedup:
+            return {}
+        start = self._digest_offset
+        column = self._view[start:start + len(self.block_ids) * DIGEST_SIZE]
+        digests = dict(zip(self.block_ids, map(itemgetter(0), struct.iter_unpack(f'{DIGEST_SIZE}s', column))))
+        if NO_DIGEST in digests.values():
+            digests = {bid: digest for bid, digest in digests.items() if digest != NO_DIGEST}
+        return digests
+
+    def records(self):
+        """Yield one ``InodeTable.record()`` tuple per inode."""
+        position = self.inode_offset
+        for _ in range(self.inode_count):
+            ino, kind, flags, owner, parent, size, ctime, name_len, block_count, secret_len = \
+                INODE_RECORD.unpack_from(self._map, position)
+            position += INODE_RECORD.size
+            name = bytes(self._view[position:position + name_len]).decode()
+            position += name_len
+            blocks = bytes(self._view[position:position + 8 * block_count]) if block_count else None
+            position += 8 * block_count
+            secret = bytes(self._view[position:position + secret_len]) or None
+            position += secret_len
+            yield ("inode", ino, kind, flags, parent, name, size, ctime, blocks, secret, owner)
+
+    def __len__(self):
+        return len(self.block_ids)
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+
+class ImageBackend(MutableMapping):
+    """Block backend over a mounted Image.
+
+    Blocks of the image are read from it on first access. The image itself
+    is never modified: new blocks go to ``overlay`` (a dict unless another
+    backend is given) and deleted image blocks are only hidden. New block
+    ids are always above those of the image, so the two never overlap.
+    """
+
+    slow = True
+    persistent = False
+
+    def __init__(self, image, overlay=None):
+        self.image = image
+        self.overlay = overlay if overlay is not None else {}
+        self._hidden = set()
+
+    def __getitem__(self, block_id):
+        if block_id in self.overlay:
+            return self.overlay[block_id]
+        if block_id in self._hidden:
+            raise KeyError(block_id)
+        return self.image.block(block_id)
+
+    def __setitem__(self, block_id, data):
+        self.overlay[block_id] = data
+
+    def __delitem__(self, block_id):
+        if block_id in self.overlay:
+            del self.overlay[block_id]
+        elif block_id in self._hidden:
+            raise KeyError(block_id)
+        else:
+            self.image._find(block_id)
+            self._hidden.add(block_id)
+
+    def __contains__(self, block_id):
+        if block_id in self.overlay:
+            return True
+        if block_id in self._hidden:
+            return False
+        try:
+            self.image._find(block_id)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        yield from self.overlay
+        for block_id in self.image.block_ids:
+            if block_id not in self._hidden:
+                yield block_id
+
+    def __len__(self):
+        return len(self.overlay) + len(self.image) - len(self._hidden)
+
+    def flush(self):
+        if hasattr(self.overlay, 'flush'):
+            self.overlay.flush()
+
+    def close(self):
+        if hasattr(self.overlay, 'close'):
+            self.overlay.close()
+        self.image.close()
@@ -0,0 +1,279 @@
+import sys
+import threading
+import time
+from array import array
+
+FREE = 0
+FILE = 1
+DIRECTORY = 2
+
+FLAG_ENCRYPTED = 0x01
+
+
+class InodeTable:
+    """Struct-of-arrays inode table.
+
+    Fixed-size metadata (kind, flags, parent, size, creation time) lives in
+    typed arrays indexed by inode number. Block lists are ``array('q')`` of
+    integer block IDs, and only directories carry entry dicts. Inode 0 is
+    reserved as "no inode". Encrypted files keep their salt and key
+    verifier in ``secrets``. ``keys`` holds the session keys of files
+    that have been unlocked; those are never journaled.
+
+    With a ``journal``, every change to an inode is logged as a full
+    ``record()`` of it (or a ``("free", ino)`` record), so replaying the
+    last record per inode rebuilds the table.
+
+    An optional ``index`` (a NameIndex) is kept in step with the names of
+    every inode except the root.
+
+    ``tree_bytes``, ``tree_blocks``, ``tree_files`` and ``tree_dirs`` hold
+    recursive totals: a file counts its own size and block references as
+    of its last ``log()``, and a directory adds up itself and everything
+    below it. Each change is applied along the ancestor path, so reading
+    the totals of any directory is O(1).
+
+    Every inode has an ``owner`` (a user id, 0 for the system). With
+    ``quotas`` set, each owner's byte and inode usage is charged the same
+    way.
+    """
+
+    def __init__(self, storage=None, cache=None, readahead=None, journal=None, index=None):
+        self.storage = storage
+        self.cache = cache
+        self.readahead = readahead
+        self.journal = journal
+        self.index = index
+        self.kind = array('B', [FREE])
+        self.flags = array('B', [0])
+        self.parent = array('q', [0])
+        self.owner = array('i', [0])
+        self.size = array('q', [0])
+        self.ctime = array('d', [0.0])
+        self.tree_bytes = array('q', [0])
+        self.tree_blocks = array('q', [0])
+        self.tree_files = array('q', [0])
+        self.tree_dirs = array('q', [0])
+        self.names = [None]
+        self.block_lists = [None]
+        self.files = {}
+        self.subdirs = {}
+        self.secrets = {}
+        self.keys = {}
+        self.key_cache = None
+        self.quotas = None
+        self.cache_plaintext = False
+        self._free = []
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def alloc(self, kind, name, parent=0, owner=0):
+        with self._lock:
+            return self._alloc(kind, name, parent, owner)
+
+    def _alloc(self, kind, name, parent, owner):
+        if self._free:
+            ino = self._free.pop()
+            self.kind[ino] = kind
+            self.flags[ino] = 0
+            self.parent[ino] = parent
+            self.owner[ino] = owner
+            self.size[ino] = 0
+            self.ctime[ino] = time.time()
+            self.names[ino] = name
+        else:
+            ino = len(self.kind)
+            self.kind.append(kind)
+            self.flags.append(0)
+            self.parent.append(parent)
+            self.owner.append(owner)
+            self.size.append(0)
+            self.ctime.append(time.time())
+            for totals in (self.tree_bytes, self.tree_blocks, self.tree_files, self.tree_dirs):
+                totals.append(0)
+            self.names.append(name)
+            self.block_lists.append(None)
+        if kind == DIRECTORY:
+            self.files[ino] = {}
+            self.subdirs[ino] = {}
+        self._add_to_tree(ino, 0, 0, kind == FILE, kind == DIRECTORY)
+        if self.quotas is not None:
+            self.quotas.charge(owner, 0, 1)
+        self.count += 1
+        if self.index is not None and parent:
+            self.index.add(ino, name)
+        return ino
+
+    def free(self, ino):
+        with self._lock:
+            if self.quotas is not None:
+                self.quotas.charge(self.owner[ino], -self.tree_bytes[ino] if self.kind[ino] == FILE else 0, -1)
+            self._add_to_tree(ino, -self.tree_bytes[ino], -self.tree_blocks[ino],
+                              -self.tree_files[ino], -self.tree_dirs[ino])
+            self.kind[ino] = FREE
+            self.size[ino] = 0
+            self.names[ino] = None
+            self.block_lists[ino] = None
+            self.files.pop(ino, None)
+            self.subdirs.pop(ino, None)
+            self.secrets.pop(ino, None)
+            self.keys.pop(ino, None)
+            self._free.append(ino)
+            self.count -= 1
+        if self.index is not None:
+            self.index.remove(ino)
+        if self.journal is not None:
+            self.journal.log(("free", ino))
+
+    def move(self, ino, parent, name):
+        """Detach ``ino`` from its directory and enter it in ``parent``
+        as ``name``."""
+        entries = self.subdirs if self.kind[ino] == DIRECTORY else self.files
+        del entries[self.parent[ino]][self.names[ino]]
+        entries[parent][name] = ino
+        with self._lock:
+            totals = (self.tree_bytes[ino], self.tree_blocks[ino], self.tree_files[ino], self.tree_dirs[ino])
+            self._add_to_tree(self.parent[ino], *(-value for value in totals))
+            self._add_to_tree(parent, *totals)
+            self.parent[ino] = parent
+        self.names[ino] = name
+        if self.index is not None:
+            self.index.remove(ino)
+            self.index.add(ino, name)
+        self.log(ino)
+
+    def is_live(self, ino):
+        return 0 < ino < len(self.kind) and self.kind[ino] != FREE
+
+    def set_flag(self, ino, flag, on=True):
+        if on:
+            self.flags[ino] |= flag
+        else:
+            self.flags[ino] &= ~flag & 0xFF
+        self.log(ino)
+
+    def has_flag(self, ino, flag):
+        return bool(self.flags[ino] & flag)
+
+    def record(self, ino):
+        blocks = self.block_lists[ino]
+        return ("inode", ino, self.kind[ino], self.flags[ino], self.parent[ino], self.names[ino],
+                self.size[ino], self.ctime[ino], None if blocks is None else blocks.tobytes(),
+                self.secrets.get(ino), self.owner[ino])
+
+    def _add_to_tree(self, ino, size, blocks, files, dirs):
+        """Add the deltas to ``ino`` and all its ancestors. Called with
+        ``_lock`` held."""
+        while ino:
+            self.tree_bytes[ino] += size
+            self.tree_blocks[ino] += blocks
+            self.tree_files[ino] += files
+            self.tree_dirs[ino] += dirs
+            ino = self.parent[ino]
+
+    def totals(self, ino):
+        return {
+            "bytes": self.tree_bytes[ino],
+            "blocks": self.tree_blocks[ino],
+            "files": self.tree_files[ino],
+            "dirs": self.tree_dirs[ino],
+        }
+
+    def log(self, ino):
+        """Account for a change to ``ino`` and journal it."""
+        if self.kind[ino] == FILE:
+            blocks = self.block_lists[ino]
+            with self._lock:
+                grown = self.size[ino] - self.tree_bytes[ino]
+                if grown and self.quotas is not None:
+                    self.quotas.charge(self.owner[ino], grown, 0)
+                self._add_to_tree(ino, grown, (len(blocks) if blocks else 0) - self.tree_blocks[ino], 0, 0)
+        if self.journal is not None:
+            self.journal.log(self.record(ino))
+
+    def snapshot(self):
+        return {ino: self.record(ino) for ino in range(1, len(self.kind)) if self.kind[ino] != FREE}
+
+    def restore(self, records):
+        """Rebuild the table from the latest ``record()`` of each live inode."""
+        slots = max(records) + 1
+        self.kind = array('B', bytes(slots))
+        self.flags = array('B', bytes(slots))
+        self.parent = array('q', bytes(8 * slots))
+        self.owner = array('i', bytes(4 * slots))
+        self.size = array('q', bytes(8 * slots))
+        self.ctime = array('d', bytes(8 * slots))
+        self.tree_bytes = array('q', bytes(8 * slots))
+        self.tree_blocks = array('q', bytes(8 * slots))
+        self.tree_files = array('q', bytes(8 * slots))
+        self.tree_dirs = array('q', bytes(8 * slots))
+        self.names = [None] * slots
+        self.block_lists = [None] * slots
+        self.files.clear()
+        self.subdirs.clear()
+        self.secrets.clear()
+        self.keys.clear()
+        for ino, record in records.items():
+            _, _, kind, flags, parent, name, size, ctime, blocks, secret = record[:10]
+            # Records written before owners were tracked belong to the system.
+            self.owner[ino] = record[10] if len(record) > 10 else 0
+            self.kind[ino] = kind
+            self.flags[ino] = flags
+            self.parent[ino] = parent
+            self.size[ino] = size
+            self.ctime[ino] = ctime
+            self.names[ino] = name
+            if blocks is not None:
+                self.block_lists[ino] = array('q')
+                self.block_lists[ino].frombytes(blocks)
+            if secret is not None:
+                self.secrets[ino] = secret
+            if kind == DIRECTORY:
+                self.files[ino] = {}
+                self.subdirs[ino] = {}
+        for ino in records:
+            parent = self.parent[ino]
+            if parent in self.subdirs:
+                entries = self.subdirs if self.kind[ino] == DIRECTORY else self.files
+                entries[parent][self.names[ino]] = ino
+        if self.quotas is not None:
+            self.quotas.usage.clear()
+        for ino in records:
+            if self.kind[ino] == FILE:
+                blocks = self.block_lists[ino]
+                self._add_to_tree(ino, self.size[ino], len(blocks) if blocks else 0, 1, 0)
+            else:
+                self._add_to_tree(ino, 0, 0, 0, 1)
+            if self.quotas is not None:
+                self.quotas.charge(self.owner[ino], self.size[ino] if self.kind[ino] == FILE else 0, 1)
+        if self.index is not None:
+            self.index.clear()
+            for ino in records:
+                if self.parent[ino]:
+                    self.index.add(ino, self.names[ino])
+        self._free = [ino for ino in range(slots - 1, 0, -1) if self.kind[ino] == FREE]
+        self.count = len(records)
+
+    def __len__(self):
+        return self.count
+
+    def stats(self):
+        """Size of the table. ``fixed_bytes_per_inode`` counts only the
+        typed arrays; ``table_bytes`` also walks every name, block list,
+        directory entry dict and secret, so ``bytes_per_inode`` is the real
+        average cost of an inode."""
+        fixed = sum(a.itemsize for a in (self.kind, self.flags, self.parent, self.owner, self.size, self.ctime, self.tree_bytes,
+                                         self.tree_blocks, self.tree_files, self.tree_dirs))
+        slots = len(self.kind)
+        objects = sum(sys.getsizeof(obj) for objs in (self.names, self.block_lists) for obj in objs if obj is not None)
+        for entries in (self.files, self.subdirs, self.secrets):
+            objects += sys.getsizeof(entries) + sum(map(sys.getsizeof, entries.values()))
+        table = slots * fixed + sys.getsizeof(self.names) + sys.getsizeof(self.block_lists) + objects
+        return {
+            "inodes": self.count,
+            "slots": slots,
+            "free_slots": len(self._free),
+            "fixed_bytes_per_inode": fixed,
+            "table_bytes": table,
+            "bytes_per_inode": table / self.count if self.count else 0.0,
+        }
@@ -0,0 +1,179 @@
+import os
+import pickle
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+
+# payload length, crc32 of payload, log sequence number
+ENTRY_HEADER = struct.Struct('<IIQ')
+
+
+class _Transaction:
+    __slots__ = ("records", "deferred")
+
+    def __init__(self):
+        self.records = []
+        self.deferred = []
+
+
+class Journal:
+    """Append-only write-ahead log with group commit.
+
+    Each entry is one transaction: a list of records that is replayed
+    entirely or not at all. ``commit()`` makes everything appended so far
+    durable; concurrent committers share a single fsync (the first one in
+    writes and syncs the whole pending batch while the rest wait), and
+    ``commit_delay`` lets the leader wait a little for more entries.
+    Callbacks registered with ``defer()`` run once the entry they belong
+    to is durable; outside a transaction that is the latest entry, and
+    they run at once if it already is. ``checkpoint()`` writes a snapshot to ``<path>.ckpt``
+    and empties the log, so replay only covers entries since then.
+    """
+
+    def __init__(self, path, commit_delay=0.0):
+        self.path = path
+        self.checkpoint_path = path + ".ckpt"
+        self.commit_delay = commit_delay
+        self._file = open(path, 'ab')
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._buffer = []
+        self._deferred = []
+        self._committing = False
+        self.lsn = 0
+        self.durable_lsn = 0
+        self.size = os.path.getsize(path)
+        self.entries = 0
+        self.commits = 0
+        self.checkpoints = 0
+
+    @contextmanager
+    def transaction(self):
+        if getattr(self._local, "txn", None) is not None:
+            yield
+            return
+        txn = self._local.txn = _Transaction()
+        try:
+            yield
+        finally:
+            self._local.txn = None
+            if txn.records or txn.deferred:
+                self._append(txn.records, txn.deferred)
+
+    def log(self, record):
+        txn = getattr(self._local, "txn", None)
+        if txn is not None:
+            txn.records.append(record)
+        else:
+            self._append([record], [])
+
+    def defer(self, fn, *args):
+        txn = getattr(self._local, "txn", None)
+        if txn is not None:
+            txn.deferred.append((fn, args))
+            return
+        with self._cond:
+            if self.durable_lsn < self.lsn:
+                self._deferred.append((self.lsn, [(fn, args)]))
+                return
+        fn(*args)
+
+    def _append(self, records, deferred):
+        payload = pickle.dumps(records, pickle.HIGHEST_PROTOCOL) if records else None
+        with self._cond:
+            if payload is not None:
+                self.lsn += 1
+                self._buffer.append(ENTRY_HEADER.pack(len(payload), zlib.crc32(payload), self.lsn) + payload)
+                self.size += ENTRY_HEADER.size + len(payload)
+                self.entries += 1
+            if deferred:
+                self._deferred.append((self.lsn, deferred))
+
+    def commit(self):
+        with self._cond:
+            target = self.lsn
+            while self.durable_lsn < target:
+                if self._committing:
+                    self._cond.wait()
+                    continue
+                self._committing = True
+                if self.commit_delay:
+                    self._cond.wait(self.commit_delay)
+                batch, self._buffer = self._buffer, []
+                upto = self.lsn
+                self._cond.release()
+                try:
+                    self._file.write(b''.join(batch))
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                finally:
+                    self._cond.acquire()
+                    self._committing = False
+                    self._cond.notify_all()
+                self.durable_lsn = upto
+                self.commits += 1
+            ready = [item for item in self._deferred if item[0] <= self.durable_lsn]
+            if ready:
+                self._deferred = [item for item in self._deferred if item[0] > self.durable_lsn]
+        for _, deferred in ready:
+            for fn, args in deferred:
+                fn(*args)
+
+    def replay(self, after=0):
+        """Return ``(lsn, records)`` for every intact entry newer than
+        ``after``. A torn or corrupt tail is cut off."""
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        entries = []
+        pos = 0
+        while pos + ENTRY_HEADER.size <= len(data):
+            length, crc, lsn = ENTRY_HEADER.unpack_from(data, pos)
+            payload = data[pos + ENTRY_HEADER.size:pos + ENTRY_HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            pos += ENTRY_HEADER.size + length
+            self.lsn = max(self.lsn, lsn)
+            if lsn > after:
+                entries.append((lsn, pickle.loads(payload)))
+        if pos < len(data):
+            self._file.truncate(pos)
+        self.lsn = self.durable_lsn = max(self.lsn, after)
+        self.size = pos
+        return entries
+
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return 0, None
+        with open(self.checkpoint_path, 'rb') as f:
+            return pickle.load(f)
+
+    def checkpoint(self, state):
+        self.commit()
+        with self._cond:
+            tmp = self.checkpoint_path + ".tmp"
+            with open(tmp, 'wb') as f:
+                pickle.dump((self.lsn, state), f, pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.checkpoint_path)
+            self._file.truncate(0)
+            os.fsync(self._file.fileno())
+            self.size = 0
+            self.checkpoints += 1
+
+    def close(self):
+        self.commit()
+        self._file.close()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "lsn": self.lsn,
+                "durable_lsn": self.durable_lsn,
+                "bytes": self.size,
+                "entries": self.entries,
+                "commits": self.commits,
+                "entries_per_commit": self.entries / self.commits if self.commits else 0.0,
+                "checkpoints": self.checkpoints,
+            }
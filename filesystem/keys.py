@@ -0,0 +1,153 @@
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+SALT_SIZE = 16
+VERIFIER_SIZE = 16
+KDF_ITERATIONS = 100_000
+
+
+def derive_key(password, salt, iterations=KDF_ITERATIONS):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+
+
+def make_verifier(key):
+    """Short tag that proves knowledge of ``key`` without revealing it."""
+    return hmac.new(key, b"key verifier", hashlib.sha256).digest()[:VERIFIER_SIZE]
+
+
+class KeyCache:
+    """Bounded, time-expiring cache of password-derived keys.
+
+    Entries are keyed by salt and a hash of the password, kept for ``ttl``
+    seconds and evicted least recently used beyond ``capacity``, so
+    reopening an encrypted file does not repeat the key derivation.
+
+    It also holds the session key of every unlocked file under the same
+    bounds; ``sessions`` is a mapping view of them by inode number. When
+    a session ends, by expiry, eviction or deletion, ``on_evict`` is
+    called with the inode number outside the cache's lock.
+    """
+
+    def __init__(self, capacity=32, ttl=300.0, on_evict=None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.sessions = SessionKeys(self)
+
+    def derive(self, password, salt):
+        ident = (salt, hashlib.sha256(password.encode()).digest())
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(ident)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(ident)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        key = derive_key(password, salt)
+        with self._lock:
+            self._entries[ident] = (key, now + self.ttl)
+            self._entries.move_to_end(ident)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return key
+
+    def _expired(self, now):
+        """Pop the sessions past their expiry; they are the oldest, as
+        every session lives for the same ``ttl``."""
+        ended = []
+        while self._sessions:
+            ino, (_, expires) = next(iter(self._sessions.items()))
+            if expires > now:
+                break
+            del self._sessions[ino]
+            ended.append(ino)
+        return ended
+
+    def _ended(self, inos):
+        if self.on_evict is not None:
+            for ino in inos:
+                self.on_evict(ino)
+
+    def session(self, ino):
+        """Session key of ``ino``, or None if it is locked or expired."""
+        with self._lock:
+            ended = self._expired(time.monotonic())
+            entry = self._sessions.get(ino)
+        self._ended(ended)
+        return None if entry is None else entry[0]
+
+    def unlock(self, ino, key):
+        now = time.monotonic()
+        with self._lock:
+            ended = self._expired(now)
+            self._sessions.pop(ino, None)
+            self._sessions[ino] = (key, now + self.ttl)
+            while len(self._sessions) > self.capacity:
+                ended.append(self._sessions.popitem(last=False)[0])
+        self._ended(ended)
+
+    def lock(self, ino):
+        """End the session of ``ino``; returns whether it had one."""
+        with self._lock:
+            ended = self._expired(time.monotonic())
+            found = self._sessions.pop(ino, None) is not None
+        self._ended(ended + [ino] if found else ended)
+        return found
+
+    def unlocked(self):
+        with self._lock:
+            ended = self._expired(time.monotonic())
+            inos = list(self._sessions)
+        self._ended(ended)
+        return inos
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "sessions": len(self._sessions),
+                "capacity": self.capacity,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class SessionKeys(MutableMapping):
+    """Inode number -> session key view of a KeyCache."""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def __getitem__(self, ino):
+        key = self.cache.session(ino)
+        if key is None:
+            raise KeyError(ino)
+        return key
+
+    def __setitem__(self, ino, key):
+        self.cache.unlock(ino, key)
+
+    def __delitem__(self, ino):
+        if not self.cache.lock(ino):
+            raise KeyError(ino)
+
+    def __iter__(self):
+        return iter(self.cache.unlocked())
+
+    def __len__(self):
+        return len(self.cache.unlocked())
@@ -0,0 +1,88 @@
+import threading
+from contextlib import contextmanager
+
+
+class RWLock:
+    """Writer-preferring reader/writer lock. Not reentrant."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class LockManager:
+    """Striped reader/writer locks for directory and file inodes.
+
+    Lock ordering: every operation names all the inodes it needs up front
+    and takes them in one ``hold()`` call, which maps them onto stripes and
+    acquires the stripes in ascending index order (a stripe needed for
+    writing by any inode is taken exclusively). Nothing acquires a second
+    ``hold()`` while holding one, so there is no lock-order cycle. Path
+    lookups go through the path index and take no locks at all.
+    """
+
+    def __init__(self, stripes=64):
+        self.stripes = [RWLock() for _ in range(stripes)]
+
+    def _stripe(self, ino):
+        return ino % len(self.stripes)
+
+    @contextmanager
+    def hold(self, reads=(), writes=()):
+        modes = {}
+        for ino in reads:
+            modes.setdefault(self._stripe(ino), False)
+        for ino in writes:
+            modes[self._stripe(ino)] = True
+        acquired = []
+        try:
+            for index in sorted(modes):
+                lock = self.stripes[index]
+                if modes[index]:
+                    lock.acquire_write()
+                else:
+                    lock.acquire_read()
+                acquired.append((lock, modes[index]))
+            yield
+        finally:
+            for lock, exclusive in reversed(acquired):
+                if exclusive:
+                    lock.release_write()
+                else:
+                    lock.release_read()
+
+    def reading(self, *inos):
+        return self.hold(reads=inos)
+
+    def writing(self, *inos):
+        return self.hold(writes=inos)
+
+    def exclusive(self):
+        return self.hold(writes=range(len(self.stripes)))
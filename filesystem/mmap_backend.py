@@ -0,0 +1,99 @@
+import errno
+import mmap
+import os
+import struct
+from collections.abc import MutableMapping
+
+# flags, length, block id
+INDEX_RECORD = struct.Struct('<BHq')
+SLOT_USED = 0x01
+
+
+class MmapBackend(MutableMapping):
+    """Block backend that keeps blocks in a preallocated, memory-mapped file.
+
+    Blocks live in fixed-size slots of ``<path>``; ``<path>.idx`` holds one
+    index record per slot so the mapping survives a restart. Reads return
+    ``memoryview`` slices of the mapping without copying.
+    """
+
+    slow = True
+    persistent = True
+
+    def __init__(self, path, capacity, block_size=512):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.capacity = capacity
+        self.block_size = block_size
+        self._data_file = self._open_preallocated(path, capacity * block_size)
+        self._index_file = self._open_preallocated(self.index_path, capacity * INDEX_RECORD.size)
+        self._data = mmap.mmap(self._data_file.fileno(), capacity * block_size)
+        self._index = mmap.mmap(self._index_file.fileno(), capacity * INDEX_RECORD.size)
+        self._view = memoryview(self._data)
+        self._slots = {}
+        self._lengths = {}
+        self._free = []
+        self._load_index()
+
+    @staticmethod
+    def _open_preallocated(path, size):
+        f = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        if os.fstat(f.fileno()).st_size < size:
+            f.truncate(size)
+        return f
+
+    def _load_index(self):
+        for slot in reversed(range(self.capacity)):
+            flags, length, block_id = INDEX_RECORD.unpack_from(self._index, slot * INDEX_RECORD.size)
+            if flags & SLOT_USED:
+                self._slots[block_id] = slot
+                self._lengths[block_id] = length
+            else:
+                self._free.append(slot)
+
+    def __getitem__(self, block_id):
+        slot = self._slots[block_id]
+        start = slot * self.block_size
+        return self._view[start:start + self._lengths[block_id]]
+
+    def __setitem__(self, block_id, data):
+        if len(data) > self.block_size:
+            raise ValueError(f"Block larger than {self.block_size} bytes.")
+        slot = self._slots.get(block_id)
+        if slot is None:
+            if not self._free:
+                raise OSError(errno.ENOSPC, "Block file is full.", self.path)
+            slot = self._free.pop()
+        start = slot * self.block_size
+        self._data[start:start + len(data)] = data
+        INDEX_RECORD.pack_into(self._index, slot * INDEX_RECORD.size,
+                               SLOT_USED, len(data), block_id)
+        self._slots[block_id] = slot
+        self._lengths[block_id] = len(data)
+
+    def __delitem__(self, block_id):
+        slot = self._slots.pop(block_id)
+        del self._lengths[block_id]
+        INDEX_RECORD.pack_into(self._index, slot * INDEX_RECORD.size, 0, 0, 0)
+        self._free.append(slot)
+
+    def __contains__(self, block_id):
+        return block_id in self._slots
+
+    def __iter__(self):
+        return iter(self._slots)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def flush(self):
+        self._data.flush()
+        self._index.flush()
+
+    def close(self):
+        self.flush()
+        self._view.release()
+        self._data.close()
+        self._index.close()
+        self._data_file.close()
+        self._index_file.close()
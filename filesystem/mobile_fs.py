@@ -1,154 +1,1143 @@
 import time
+import sys
 import threading
-import uuid
-from collections import OrderedDict
+import hashlib
+import hmac
+import struct
 from cryptography.fernet import Fernet
-from .user import UserManager, PermissionManager, EncryptedFile
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from .user import UserManager, PermissionManager
+from .cache import BlockCache
+from .compression import Compressor
+from .readahead import ReadAhead
+from .writeback import WriteBackFlusher
+from .locks import LockManager
+from .journal import Journal
+from .keys import KeyCache, SALT_SIZE, derive_key, make_verifier
+from .name_index import NameIndex
+from .events import EventBus, CREATED, MODIFIED, DELETED, MOVED
+from .quota import Quotas
+from .image import Image, ImageBackend, write_image
+from .inode import InodeTable, FILE, DIRECTORY, FLAG_ENCRYPTED
+import itertools
 import os
+import posixpath
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from array import array
+from collections.abc import Mapping, MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from operator import mul
 
 BLOCK_SIZE = 512
+TEXT_EXTS = ['.txt', '.py', '.json', '.md']
+BINARY_EXTS = ['.jpg', '.png', '.gif', '.bmp']
 
 class BlockStorage:
-    def __init__(self):
-        self.blocks = {}
+    def __init__(self, dedup=False, backend=None, writeback=False, dirty_limit=64 * BLOCK_SIZE, journal=None,
+                 compression=None):
+        self.blocks = backend if backend is not None else {}
+        self.dedup = dedup
+        self.journal = journal
+        self.compressor = Compressor(compression) if compression else None
+        # Uncompressed sizes of the blocks that are stored compressed.
+        self.raw_sizes = {}
+        # Incompressible blocks in a row per store_block() stream (a file's
+        # partial writes), for Compressor.should_try; absent means none.
+        self.compress_misses = {}
+        self.refcounts = {}
+        self.references = 0
+        self.physical_bytes = 0
+        self.unique_bytes = 0
+        self.logical_bytes = 0
+        self.digests = {}
+        self.block_digests = {}
+        if journal is None:
+            # Without a journal every block in the backend counts as live;
+            # with one, restore() rebuilds the counts from replayed inodes.
+            self.refcounts = {bid: 1 for bid in self.blocks}
+            self.references = len(self.refcounts)
+            self.physical_bytes = sum(len(block) for block in self.blocks.values())
+            self.unique_bytes = self.logical_bytes = self.physical_bytes
+            if dedup:
+                for bid, block in self.blocks.items():
+                    self._index_digest(bid, hashlib.sha256(block).digest())
+        self._next_id = max(self.blocks, default=0) + 1
+        self.writeback = writeback
+        self.dirty = {}
+        self.dirty_bytes = 0
+        self.dirty_limit = dirty_limit
+        self.dirty_event = threading.Event()
+        self.flushes = 0
+        self.flushed_blocks = 0
+        self._lock = threading.RLock()
 
-    def store(self, data):
-        block_ids = []
-        for i in range(0, len(data), BLOCK_SIZE):
+    def _index_digest(self, block_id, digest):
+        self.digests[digest] = block_id
+        self.block_digests[block_id] = digest
+
+    def _reuse(self, digest, size):
+        block_id = self.digests.get(digest)
+        if block_id is not None:
+            self.refcounts[block_id] += 1
+            self.references += 1
+            self.logical_bytes += size
+        return block_id
+
+    def store_block(self, block, compress=True, stream=None, index=0):
+        """Store one block. Blocks of the same ``stream`` (block ``index``
+        within it) share adaptive compression skipping, as the blocks of
+        one ``store()`` call do."""
+        digest = hashlib.sha256(block).digest() if self.dedup else None
+        if self.dedup:
+            with self._lock:
+                block_id = self._reuse(digest, len(block))
+            if block_id is not None:
+                return block_id
+        # Compress outside the lock; only blocks that are actually new pay for it.
+        packed = None
+        if compress and self.compressor is not None:
+            misses = self.compress_misses.get(stream, 0)
+            if self.compressor.should_try(misses, index):
+                packed = self.compressor.compress(block)
+                if stream is not None and packed is None:
+                    self.compress_misses[stream] = misses + 1
+                elif stream is not None:
+                    self.compress_misses.pop(stream, None)
+        with self._lock:
+            return self._put(block, digest, packed)
+
+    def _put(self, block, digest, packed):
+        block_id = self._reuse(digest, len(block)) if self.dedup else None
+        if block_id is not None:
+            return block_id
+        block_id = self._next_id
+        self._next_id += 1
+        if self.dedup:
+            self._index_digest(block_id, digest)
+        stored = block if packed is None else packed
+        if packed is not None:
+            self.raw_sizes[block_id] = len(block)
+        if self.writeback:
+            self.dirty[block_id] = stored
+            self.dirty_bytes += len(stored)
+            if self.dirty_bytes >= self.dirty_limit:
+                self.dirty_event.set()
+        else:
+            self.blocks[block_id] = stored
+        if self.journal is not None:
+            self.journal.log(("block", block_id, bytes(stored), digest, self.raw_sizes.get(block_id)))
+        self.refcounts[block_id] = 1
+        self.references += 1
+        self.physical_bytes += len(stored)
+        self.unique_bytes += len(block)
+        self.logical_bytes += len(block)
+        return block_id
+
+    def prepare(self, data):
+        """Chunk, hash and compress ``data`` without taking the storage
+        lock, so several files can be prepared in parallel."""
+        prepared = []
+        misses = 0
+        for index, i in enumerate(range(0, len(data), BLOCK_SIZE)):
             block = data[i:i+BLOCK_SIZE]
-            block_id = str(uuid.uuid4())
-            self.blocks[block_id] = block
-            block_ids.append(block_id)
-        return block_ids
+            digest = hashlib.sha256(block).digest() if self.dedup else None
+            packed = None
+            if self.compressor is not None and digest not in self.digests and self.compressor.should_try(misses, index):
+                packed = self.compressor.compress(block)
+                misses = 0 if packed is not None else misses + 1
+            prepared.append((block, digest, packed))
+        return prepared
+
+    def store_prepared(self, batches):
+        """Store several ``prepare()`` results under one lock acquisition.
+        Returns a block id list per batch, or the exception that batch
+        failed with (its blocks are released again)."""
+        results = []
+        with self._lock:
+            for prepared in batches:
+                block_ids = []
+                try:
+                    for block, digest, packed in prepared:
+                        block_ids.append(self._put(block, digest, packed))
+                except Exception as e:
+                    self.delete(block_ids)
+                    results.append(e)
+                else:
+                    results.append(block_ids)
+        return results
+
+    def store(self, data):
+        result = self.store_prepared([self.prepare(data)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    @property
+    def is_slow(self):
+        return getattr(self.blocks, 'slow', False)
+
+    @property
+    def is_persistent(self):
+        return getattr(self.blocks, 'persistent', False)
+
+    def _stored(self, block_id):
+        block = self.dirty.get(block_id)
+        if block is not None:
+            return block
+        return self.blocks.get(block_id, b'')
+
+    def get_block(self, block_id):
+        block = self._stored(block_id)
+        if block_id in self.raw_sizes:
+            return self.compressor.decompress(block)
+        return block
 
     def retrieve(self, block_ids):
-        return b''.join(self.blocks[bid] for bid in block_ids if bid in self.blocks)
+        return b''.join(self.get_block(bid) for bid in block_ids)
 
     def delete(self, block_ids):
-        for bid in block_ids:
-            self.blocks.pop(bid, None)
+        with self._lock:
+            for bid in block_ids:
+                count = self.refcounts.get(bid)
+                if count is None:
+                    continue
+                stored = len(self._stored(bid))
+                size = self.raw_sizes.get(bid, stored)
+                self.logical_bytes -= size
+                self.references -= 1
+                if count > 1:
+                    self.refcounts[bid] = count - 1
+                    continue
+                del self.refcounts[bid]
+                self.raw_sizes.pop(bid, None)
+                digest = self.block_digests.pop(bid, None)
+                if digest is not None:
+                    del self.digests[digest]
+                self.unique_bytes -= size
+                if self.dirty.pop(bid, None) is not None:
+                    self.dirty_bytes -= stored
+                elif self.journal is not None and self.is_persistent:
+                    # The block must outlive the journal entry that drops its
+                    # last reference, or a crash could leave it dangling.
+                    self.journal.defer(self._drop, bid)
+                else:
+                    del self.blocks[bid]
+                self.physical_bytes -= stored
+
+    def _drop(self, block_id):
+        with self._lock:
+            if block_id not in self.refcounts:
+                self.blocks.pop(block_id, None)
+
+    def flush(self, block_ids=None):
+        with self._lock:
+            if block_ids is None:
+                pending = list(self.dirty.items())
+            else:
+                pending = [(bid, self.dirty[bid]) for bid in block_ids if bid in self.dirty]
+            for bid, block in pending:
+                self.blocks[bid] = block
+            for bid, block in pending:
+                del self.dirty[bid]
+                self.dirty_bytes -= len(block)
+            if pending:
+                self.flushes += 1
+                self.flushed_blocks += len(pending)
+            return len(pending)
+
+    def sync(self, block_ids=None):
+        self.flush(block_ids)
+        if hasattr(self.blocks, 'flush'):
+            self.blocks.flush()
+
+    def close(self):
+        self.flush()
+        if hasattr(self.blocks, 'close'):
+            self.blocks.close()
+
+    def snapshot(self):
+        """Block table for a journal checkpoint: ``{id: (data, digest, raw_size)}``.
+        Data is left out when the backend persists blocks itself."""
+        with self._lock:
+            return {
+                bid: (None if self.is_persistent else bytes(self._stored(bid)),
+                      self.block_digests.get(bid), self.raw_sizes.get(bid))
+                for bid in self.refcounts
+            }
+
+    def restore(self, blocks, references):
+        """Rebuild refcounts and the digest index after a journal replay.
 
+        ``blocks`` maps recovered block ids to ``(data, digest, raw_size)``
+        (data is None for blocks the backend already holds, raw_size is None
+        for blocks stored uncompressed) and ``references`` lists every block
+        id the recovered inodes point at. Blocks nobody references are
+        dropped from the backend.
+        """
+        refcounts = Counter(references)
+        with self._lock:
+            self._reset_counts()
+            for bid in [bid for bid in self.blocks if bid not in refcounts]:
+                del self.blocks[bid]
+            for bid, count in refcounts.items():
+                data, digest, raw_size = blocks.get(bid, (None, None, None))
+                if data is not None:
+                    self.blocks[bid] = data
+                self._restore_block(bid, count, len(self.blocks.get(bid, b'')), digest, raw_size)
+            self.refcounts = dict(refcounts)
+            self.references = len(references)
+            self._next_id = max([self._next_id - 1, *blocks, *refcounts]) + 1
 
-class BlockCache:
-    def __init__(self, capacity=10):
-        self.cache = OrderedDict()
-        self.capacity = capacity
+    def restore_image(self, image):
+        """``restore`` from an Image. Refcounts, totals and the digest
+        index come straight from the image's block index columns, so only
+        copying blocks in (without a lazy mount) visits blocks one by one.
+        The backend must be empty, or an ImageBackend over ``image``."""
+        ids, lengths, raw_sizes, counts = image.block_ids, image.lengths, image.raw_sizes, image.refcounts
+        with self._lock:
+            self._reset_counts()
+            if image.copy_blocks:
+                for i, bid in enumerate(ids):
+                    self.blocks[bid] = bytes(image.block_at(i))
+            self.refcounts = dict(zip(ids, counts))
+            self.references = sum(counts)
+            self.physical_bytes = self.unique_bytes = sum(lengths)
+            self.logical_bytes = sum(map(mul, lengths, counts))
+            # Raw sizes are -1 for blocks stored uncompressed; the others
+            # count at their raw size instead of their stored length.
+            compressed = list(map((0).__le__, raw_sizes))
+            if any(compressed):
+                raws = list(itertools.compress(raw_sizes, compressed))
+                stored = list(itertools.compress(lengths, compressed))
+                shared = list(itertools.compress(counts, compressed))
+                self.raw_sizes = dict(zip(itertools.compress(ids, compressed), raws))
+                self.unique_bytes += sum(raws) - sum(stored)
+                self.logical_bytes += sum(map(mul, raws, shared)) - sum(map(mul, stored, shared))
+            self.block_digests = image.digests()
+            self.digests = dict(zip(self.block_digests.values(), self.block_digests))
+            self._next_id = max(self._next_id - 1, ids[-1] if ids else 0) + 1
 
-    def get(self, block_id):
-        if block_id in self.cache:
-            self.cache.move_to_end(block_id)
-            return self.cache[block_id]
-        return None
+    def _reset_counts(self):
+        self.physical_bytes = self.unique_bytes = self.logical_bytes = 0
+        self.raw_sizes.clear()
+        self.digests.clear()
+        self.block_digests.clear()
 
-    def put(self, block_id, data):
-        self.cache[block_id] = data
-        self.cache.move_to_end(block_id)
-        if len(self.cache) > self.capacity:
-            self.cache.popitem(last=False)
+    def _restore_block(self, bid, count, stored, digest, raw_size):
+        if digest is not None:
+            self._index_digest(bid, digest)
+        if raw_size is not None:
+            self.raw_sizes[bid] = raw_size
+        size = stored if raw_size is None else raw_size
+        self.physical_bytes += stored
+        self.unique_bytes += size
+        self.logical_bytes += size * count
+
+    def stats(self):
+        return {
+            "blocks": len(self.refcounts),
+            "references": self.references,
+            "logical_bytes": self.logical_bytes,
+            "physical_bytes": self.physical_bytes,
+            "dedup_ratio": self.logical_bytes / self.unique_bytes if self.unique_bytes else 1.0,
+            "compressed_blocks": len(self.raw_sizes),
+            "dirty_blocks": len(self.dirty),
+            "dirty_bytes": self.dirty_bytes,
+            "flushes": self.flushes,
+            "flushed_blocks": self.flushed_blocks,
+        }
 
 
 class File:
-    def __init__(self, name, content="", storage=None, cache=None):
-        self.name = name
-        self.created_at = time.ctime()
-        self.blocks = []
-        self.size = 0
-        self.storage = storage
-        self.cache = cache
-        if content:
-            self.write(content)
+    """Thin view over a FILE inode in an InodeTable."""
+
+    __slots__ = ("table", "ino", "name")
+
+    # Bytes of file data held by each storage block.
+    payload = BLOCK_SIZE
+
+    def __init__(self, table, ino, name=None):
+        self.table = table
+        self.ino = ino
+        self.name = table.names[ino] if name is None else name
+
+    @property
+    def storage(self):
+        return self.table.storage
+
+    @property
+    def cache(self):
+        return self.table.cache
+
+    @property
+    def readahead(self):
+        return self.table.readahead
+
+    @property
+    def created_at(self):
+        return time.ctime(self.table.ctime[self.ino])
+
+    @property
+    def size(self):
+        return self.table.size[self.ino]
+
+    @size.setter
+    def size(self, value):
+        self.table.size[self.ino] = value
+
+    @property
+    def blocks(self):
+        blocks = self.table.block_lists[self.ino]
+        if blocks is None:
+            blocks = self.table.block_lists[self.ino] = array('q')
+        return blocks
+
+    @blocks.setter
+    def blocks(self, block_ids):
+        self.table.block_lists[self.ino] = array('q', block_ids) if len(block_ids) else None
 
     def write(self, content):
         data = content.encode('utf-8') if isinstance(content, str) else content
-        if self.blocks:
-            self.storage.delete(self.blocks)
-        self.blocks = self.storage.store(data)
-        self.size = len(data)
+        self.adopt(self._store(data), len(data))
+
+    def adopt(self, block_ids, size):
+        """Point the file at already stored blocks and release the old ones."""
+        old_blocks = self.table.block_lists[self.ino]
+        self.blocks = block_ids
+        self.size = size
+        self.table.log(self.ino)
+        self._release(old_blocks)
+
+    def write_at(self, offset, content):
+        if offset < 0:
+            raise ValueError(f"Negative offset {offset}.")
+        data = content.encode('utf-8') if isinstance(content, str) else bytes(content)
+        if offset > self.size:
+            data = bytes(offset - self.size) + data
+            offset = self.size
+        if not data:
+            return
+        end = offset + len(data)
+        payload = self.payload
+        replaced = []
+        for index in range(offset // payload, (end - 1) // payload + 1):
+            start = index * payload
+            lo = max(offset - start, 0)
+            piece = data[start + lo - offset:min(end, start + payload) - offset]
+            if index < len(self.blocks):
+                old = bytes(self._load_block(index))
+                block = old[:lo] + piece + old[lo + len(piece):]
+            else:
+                block = piece
+            block_id = self._store_block(index, block)
+            if index < len(self.blocks):
+                replaced.append(self.blocks[index])
+                self.blocks[index] = block_id
+            else:
+                self.blocks.append(block_id)
+        self.size = max(self.size, end)
+        self.table.log(self.ino)
+        self._release(replaced)
+
+    def append(self, content):
+        self.write_at(self.size, content)
+
+    def truncate(self, size):
+        if size < 0:
+            raise ValueError(f"Negative size {size}.")
+        if size >= self.size:
+            self.write_at(size, b'')
+            return
+        keep = -(-size // self.payload)
+        old_blocks = self.blocks
+        blocks = old_blocks[:keep]
+        dropped = old_blocks[keep:]
+        tail = size % self.payload
+        if tail:
+            block = bytes(self._load_block(keep - 1))[:tail]
+            blocks[-1] = self._store_block(keep - 1, block)
+            dropped.append(old_blocks[keep - 1])
+        self.blocks = blocks
+        self.size = size
+        self.table.log(self.ino)
+        self._release(dropped)
+
+    def delete(self):
+        self._release(self.table.block_lists[self.ino])
+        self.storage.compress_misses.pop(self.ino, None)
+        self.blocks = ()
+        self.size = 0
+
+    def _release(self, block_ids):
+        if not block_ids:
+            return
+        self.storage.delete(block_ids)
+        if self.cache is not None:
+            for block_id in block_ids:
+                if block_id not in self.storage.refcounts:
+                    self.cache.invalidate(block_id)
+
+    def _store(self, data):
+        return self.storage.store(data)
+
+    def _store_block(self, index, block):
+        block_id = self.storage.store_block(block, stream=self.ino, index=index)
+        if self.cache is not None:
+            self.cache.put(block_id, block)
+        return block_id
+
+    def _fetch(self, block_id):
+        cached = self.cache.get(block_id) if self.cache is not None else None
+        if cached is not None:
+            return cached
+        block = self.storage.get_block(block_id)
+        if self.cache is not None:
+            self.cache.put(block_id, block)
+        return block
+
+    def _load_block(self, index):
+        return self._fetch(self.blocks[index])
+
+    def iter_chunks(self, offset=0, length=None):
+        end = self.size if length is None else min(self.size, offset + length)
+        if offset >= end:
+            return
+        payload = self.payload
+        for index in range(offset // payload, (end - 1) // payload + 1):
+            if self.readahead is not None:
+                self.readahead.on_read(self, index)
+            block = self._load_block(index)
+            start = index * payload
+            lo = max(offset - start, 0)
+            hi = min(end - start, len(block))
+            yield block if lo == 0 and hi == len(block) else block[lo:hi]
+
+    def read_range(self, offset, length):
+        return b''.join(self.iter_chunks(offset, length))
 
     def read(self):
-        content = []
-        for block_id in self.blocks:
-            cached = self.cache.get(block_id) if self.cache else None
-            if cached:
-                content.append(cached)
+        return b''.join(self.iter_chunks())
+
+
+class EncryptedFile(File):
+    """View over a FILE inode flagged FLAG_ENCRYPTED.
+
+    Every block holds one AES-GCM ciphertext of up to ``payload`` bytes,
+    sealed on its own with a random nonce and the inode number and block
+    index as associated data. A ranged read or a partial write only
+    decrypts and re-encrypts the blocks it touches.
+
+    Keys come from the password and a per-file salt. The salt and a key
+    verifier are kept in ``table.secrets``, so checking a password never
+    decrypts data. The block cache keeps ciphertext unless the table's
+    ``cache_plaintext`` is on. In that case decrypted blocks are cached
+    under ``("plain", block_id)`` and dropped when the file's key is
+    forgotten.
+    """
+
+    __slots__ = ()
+
+    NONCE_SIZE = 12
+    TAG_SIZE = 16
+    payload = BLOCK_SIZE - NONCE_SIZE - TAG_SIZE
+
+    @property
+    def key(self):
+        return self.table.keys.get(self.ino)
+
+    def _derive(self, password, salt):
+        if self.table.key_cache is not None:
+            return self.table.key_cache.derive(password, salt)
+        return derive_key(password, salt)
+
+    def set_password(self, password):
+        salt = os.urandom(SALT_SIZE)
+        key = self._derive(password, salt)
+        self.table.secrets[self.ino] = salt + make_verifier(key)
+        self.table.keys[self.ino] = key
+
+    def check_password(self, password):
+        """Check ``password`` against the stored verifier and, if it is
+        right, unlock the file."""
+        secret = self.table.secrets.get(self.ino)
+        if secret is None:
+            return False
+        key = self._derive(password, secret[:SALT_SIZE])
+        if not hmac.compare_digest(make_verifier(key), secret[SALT_SIZE:]):
+            return False
+        self.table.keys[self.ino] = key
+        return True
+
+    def _cipher(self, key=None):
+        key = key or self.key
+        if key is None:
+            raise PermissionError("Password required to decrypt this file.")
+        return AESGCM(key)
+
+    def _seal(self, index, block):
+        nonce = os.urandom(self.NONCE_SIZE)
+        return nonce + self._cipher().encrypt(nonce, bytes(block), struct.pack('<qq', self.ino, index))
+
+    def _unseal(self, index, sealed, key=None):
+        sealed = bytes(sealed)
+        return self._cipher(key).decrypt(sealed[:self.NONCE_SIZE], sealed[self.NONCE_SIZE:],
+                                         struct.pack('<qq', self.ino, index))
+
+    def _store(self, data):
+        block_ids = []
+        try:
+            for index, i in enumerate(range(0, len(data), self.payload)):
+                sealed = self._seal(index, data[i:i + self.payload])
+                block_ids.append(self.storage.store_block(sealed, compress=False))
+        except BaseException:
+            self.storage.delete(block_ids)
+            raise
+        return block_ids
+
+    def _store_block(self, index, block):
+        sealed = self._seal(index, block)
+        block_id = self.storage.store_block(sealed, compress=False)
+        if self.cache is not None:
+            if self.table.cache_plaintext:
+                self.cache.put(("plain", block_id), bytes(block))
             else:
-                block = self.storage.blocks.get(block_id, b'')
-                content.append(block)
-                if self.cache:
-                    self.cache.put(block_id, block)
-        return b''.join(content)
+                self.cache.put(block_id, sealed)
+        return block_id
+
+    def _load_block(self, index):
+        block_id = self.blocks[index]
+        if self.cache is None or not self.table.cache_plaintext:
+            return self._unseal(index, self._fetch(block_id))
+        block = self.cache.get(("plain", block_id))
+        if block is None:
+            block = self._unseal(index, self.storage.get_block(block_id))
+            self.cache.put(("plain", block_id), block)
+        return block
+
+    def _release(self, block_ids):
+        super()._release(block_ids)
+        self.forget_plaintext(block_ids)
+
+    def forget_plaintext(self, block_ids=None):
+        if block_ids is None:
+            block_ids = self.blocks
+        if self.cache is None or not block_ids:
+            return
+        for block_id in block_ids:
+            self.cache.invalidate(("plain", block_id))
+
+
+class DirectoryEntries(MutableMapping):
+    """Name -> node mapping for one kind of entry (files or subdirectories)
+    of a directory inode; nodes are built on access."""
+
+    def __init__(self, table, entries, dir_ino):
+        self.table = table
+        self.entries = entries
+        self.dir_ino = dir_ino
+
+    def __getitem__(self, name):
+        return node_for(self.table, self.entries[name], name)
+
+    def __setitem__(self, name, node):
+        old = self.entries.get(name)
+        self.entries[name] = node.ino
+        if old is not None and old != node.ino:
+            release_inode(self.table, old)
+
+    def __delitem__(self, name):
+        del self.entries[name]
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
 
 
 class Directory:
-    def __init__(self, name):
-        self.name = name
-        self.files = {}
-        self.subdirectories = {}
-        self.created_at = time.ctime()
+    """Thin view over a DIRECTORY inode in an InodeTable."""
+
+    __slots__ = ("table", "ino", "name")
+
+    def __init__(self, table, ino, name=None):
+        self.table = table
+        self.ino = ino
+        self.name = table.names[ino] if name is None else name
+
+    @property
+    def created_at(self):
+        return time.ctime(self.table.ctime[self.ino])
+
+    @property
+    def files(self):
+        return DirectoryEntries(self.table, self.table.files[self.ino], self.ino)
+
+    @property
+    def subdirectories(self):
+        return DirectoryEntries(self.table, self.table.subdirs[self.ino], self.ino)
+
+    def create_file(self, name, content="", owner=0):
+        file = File(self.table, self.table.alloc(FILE, name, self.ino, owner), name)
+        try:
+            if content:
+                file.write(content)
+            else:
+                self.table.log(file.ino)
+        except Exception:
+            release_inode(self.table, file.ino)
+            raise
+        self.files[name] = file
+        return file
 
-    def create_file(self, name, content="", storage=None, cache=None):
-        self.files[name] = File(name, content, storage, cache)
+    def release(self):
+        for ino in list(self.table.files[self.ino].values()) + list(self.table.subdirs[self.ino].values()):
+            release_inode(self.table, ino)
+        self.table.files[self.ino].clear()
+        self.table.subdirs[self.ino].clear()
 
-    def create_subdirectory(self, dir_name):
-        if dir_name not in self.subdirectories:
-            self.subdirectories[dir_name] = Directory(dir_name)
+    def create_subdirectory(self, dir_name, owner=0):
+        if dir_name not in self.table.subdirs[self.ino]:
+            ino = self.table.alloc(DIRECTORY, dir_name, self.ino, owner)
+            self.table.log(ino)
+            self.table.subdirs[self.ino][dir_name] = ino
+        return self.subdirectories[dir_name]
+
+
+def node_for(table, ino, name=None):
+    kind = table.kind[ino]
+    if kind == FILE:
+        return (EncryptedFile if table.has_flag(ino, FLAG_ENCRYPTED) else File)(table, ino, name)
+    if kind == DIRECTORY:
+        return Directory(table, ino, name)
+    raise FileNotFoundError(f"Inode {ino} is not allocated.")
+
+
+def _read_host_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def release_inode(table, ino):
+    kind = table.kind[ino]
+    if kind == FILE:
+        File(table, ino).delete()
+    elif kind == DIRECTORY:
+        Directory(table, ino).release()
+    table.free(ino)
 
 
 class FileSystem:
-    def __init__(self):
-        self.root = Directory("root")
-        self.current_directory = self.root
-        self.path_stack = [self.root]
+    def __init__(self, dedup=False, backend=None, cache_policy="lru", cache_size=20 * BLOCK_SIZE,
+                 readahead_window=4, writeback=False, flush_interval=1.0, dirty_limit=64 * BLOCK_SIZE,
+                 journal=None, commit_delay=0.0, checkpoint_bytes=4 * 1024 * 1024, compression=None,
+                 cache_plaintext=False, key_cache_size=32, key_ttl=300.0, quota_grace=None):
         self.lock = threading.Lock()
-        self.storage = BlockStorage()
-        self.cache = BlockCache(capacity=20)
+        self.locks = LockManager()
+        self.events = EventBus()
+        self.journal = Journal(journal, commit_delay=commit_delay) if journal else None
+        self.checkpoint_bytes = checkpoint_bytes
+        self.storage = BlockStorage(dedup=dedup, backend=backend, writeback=writeback, dirty_limit=dirty_limit,
+                                    journal=self.journal, compression=compression)
+        self.flusher = None
+        if writeback:
+            self.flusher = WriteBackFlusher(self.storage, interval=flush_interval)
+            self.flusher.start()
+        self.cache = BlockCache(capacity=cache_size, policy=cache_policy, block_size=BLOCK_SIZE)
+        self.readahead = ReadAhead(self.storage, self.cache, window=readahead_window) if readahead_window else None
         self.user_manager = UserManager()
         self.permission_manager = PermissionManager()
-        self.encrypted_flags = {}
+        self.inodes = InodeTable(self.storage, self.cache, self.readahead, journal=self.journal, index=NameIndex())
+        self.inodes.cache_plaintext = cache_plaintext
+        self.inodes.key_cache = KeyCache(capacity=key_cache_size, ttl=key_ttl, on_evict=self._forget_plaintext)
+        self.inodes.keys = self.inodes.key_cache.sessions
+        self.quotas = self.inodes.quotas = Quotas(grace=quota_grace)
+        self._acting = threading.local()
+        root_ino = self._recover() if self.journal is not None else None
+        if root_ino is None:
+            root_ino = self.inodes.alloc(DIRECTORY, "root")
+            self.inodes.log(root_ino)
+            self._commit()
+        self._set_root(root_ino)
+
+    def _set_root(self, root_ino):
+        self.root = Directory(self.inodes, root_ino)
+        self.current_directory = self.root
+        self.path_stack = [self.root]
+        self.path_index = {}
+        self._index_tree("/", self.root)
+
+    @classmethod
+    def from_image(cls, path, lazy=True, **options):
+        """Open a filesystem saved with ``export_image``.
+
+        Metadata is loaded right away. With ``lazy`` block contents stay in
+        the image and are read on first access, and changes are kept in
+        memory (or in ``backend``) without touching the image. Otherwise
+        every block is copied in. Other ``options`` go to the constructor;
+        dedup and compression default to those of the image.
+        """
+        if options.get("journal"):
+            raise ValueError("Images cannot be opened with a journal.")
+        image = Image(path, copy_blocks=not lazy)
+        options.setdefault("dedup", image.dedup)
+        options.setdefault("compression", image.codec)
+        if image.codec is not None and options["compression"] != image.codec:
+            image.close()
+            raise ValueError(f"Image blocks are compressed with '{image.codec}'.")
+        fs = cls(**options)
+        fs.inodes.restore({record[1]: record for record in image.records()})
+        if lazy:
+            fs.storage.blocks = ImageBackend(image, overlay=fs.storage.blocks)
+        fs.storage.restore_image(image)
+        if not lazy:
+            image.close()
+        fs._set_root(image.root)
+        return fs
+
+    def export_image(self, path):
+        """Write the whole filesystem to a single image file at ``path``."""
+        with self.locks.exclusive():
+            write_image(self.inodes, self.storage, self.root.ino, path, BLOCK_SIZE)
+
+    def _recover(self):
+        """Rebuild inodes and block refcounts from the last checkpoint plus
+        the journal entries after it. Returns the root inode, or None for
+        an empty journal."""
+        lsn, state = self.journal.load_checkpoint()
+        records = dict(state["inodes"]) if state else {}
+        blocks = dict(state["blocks"]) if state else {}
+        for _, entry in self.journal.replay(after=lsn):
+            for record in entry:
+                if record[0] == "block":
+                    blocks[record[1]] = record[2:]
+                elif record[0] == "free":
+                    records.pop(record[1], None)
+                else:
+                    records[record[1]] = record
+        if not records:
+            return None
+        self.inodes.restore(records)
+        self.storage.restore(blocks, [bid for block_list in self.inodes.block_lists if block_list for bid in block_list])
+        return next(ino for ino, record in records.items() if record[2] == DIRECTORY and not record[4])
+
+    def _transaction(self):
+        return self.journal.transaction() if self.journal is not None else nullcontext()
+
+    def _commit(self):
+        if self.journal is None:
+            return
+        self.journal.commit()
+        if self.journal.size >= self.checkpoint_bytes:
+            self.checkpoint()
+
+    def checkpoint(self):
+        if self.journal is None:
+            return
+        with self.locks.exclusive():
+            self.journal.commit()
+            self.storage.sync()
+            self.journal.checkpoint({"inodes": self.inodes.snapshot(), "blocks": self.storage.snapshot()})
+
+    def _publish(self, kind, path, src=None):
+        """Publish a change event once the change is durable: inside a
+        journal transaction it waits for the commit, so subscribers never
+        see a change that recovery would roll back."""
+        if self.journal is None:
+            self.events.publish(kind, path, src)
+        else:
+            self.journal.defer(self.events.publish, kind, path, src)
+
+    def subscribe(self, path="/"):
+        """Subscribe to change events on ``path`` and everything below it.
+        Returns a Subscription to ``get()`` or ``drain()`` events from and
+        ``close()`` when done."""
+        return self.events.subscribe(self._abspath(path))
+
+    @contextmanager
+    def as_user(self, username):
+        """Attribute new files and directories created by this thread to
+        ``username`` (and check them against its quota)."""
+        previous = getattr(self._acting, "uid", None)
+        self._acting.uid = self.user_manager.uid_of(username)
+        try:
+            yield
+        finally:
+            self._acting.uid = previous
+
+    def _current_uid(self):
+        uid = getattr(self._acting, "uid", None)
+        if uid is not None:
+            return uid
+        user = self.user_manager.get_current_user()
+        return user.uid if user is not None else 0
+
+    def _check_quota(self, ino, size):
+        """Refuse growing file ``ino`` (None for a new file) to ``size``
+        bytes if that breaks a quota. Existing files are charged to their
+        owner, new ones to the acting user."""
+        if ino is None:
+            self.quotas.check(self._current_uid(), size, 1)
+        else:
+            self.quotas.check(self.inodes.owner[ino], size - self.inodes.size[ino])
+
+    def set_quota(self, username, soft_bytes=None, hard_bytes=None, soft_inodes=None, hard_inodes=None):
+        """Limit the bytes and inodes owned by ``username``; None is unlimited."""
+        self.quotas.set_limits(self.user_manager.uid_of(username), soft_bytes, hard_bytes, soft_inodes, hard_inodes)
+
+    def quota_usage(self, username):
+        return self.quotas.report(self.user_manager.uid_of(username))
+
+    def journal_stats(self):
+        return self.journal.stats() if self.journal is not None else None
+
+    def _index_tree(self, path, directory):
+        self._register(path, directory)
+        for name, ino in self.inodes.files[directory.ino].items():
+            self.path_index[posixpath.join(path, name)] = ino
+        for subdir in directory.subdirectories.values():
+            self._index_tree(posixpath.join(path, subdir.name), subdir)
 
     def get_current_path(self):
         return "/".join([d.name for d in self.path_stack])
 
+    def _cwd_path(self):
+        return "/" + "/".join(d.name for d in self.path_stack[1:])
+
+    def _abspath(self, path):
+        if not path.startswith("/"):
+            path = posixpath.join(self._cwd_path(), path)
+        return "/" + posixpath.normpath(path).lstrip("/")
+
+    def _register(self, path, node):
+        self.path_index[path] = node.ino
+
+    def _unregister(self, path, node):
+        self.path_index.pop(path, None)
+        if isinstance(node, Directory):
+            for name, child in list(node.files.items()) + list(node.subdirectories.items()):
+                self._unregister(posixpath.join(path, name), child)
+
+    def _lookup(self, path):
+        ino = self.path_index.get(self._abspath(path))
+        return None if ino is None else node_for(self.inodes, ino)
+
+    def _parent(self, path):
+        path = self._abspath(path)
+        parent_path, name = posixpath.split(path)
+        parent = self._lookup(parent_path)
+        if not name or not isinstance(parent, Directory):
+            raise FileNotFoundError(f"Directory '{parent_path}' not found.")
+        return path, parent, name
+
+    def _ancestry(self, ino):
+        chain = []
+        while ino:
+            chain.append(ino)
+            ino = self.inodes.parent[ino]
+        return chain[::-1]
+
+    def _path_of(self, ino):
+        names = [self.inodes.names[i] for i in self._ancestry(ino)[1:]]
+        return None if None in names else "/" + "/".join(names)
+
+    def _get_file(self, path):
+        node = self._lookup(path)
+        return None if isinstance(node, Directory) else node
+
+    def _entry_ino(self, dir_ino, name):
+        ino = self.inodes.files.get(dir_ino, {}).get(name)
+        return ino if ino is not None else self.inodes.subdirs.get(dir_ino, {}).get(name)
+
+    def _subtree_inos(self, ino):
+        inos = []
+        pending = [ino]
+        while pending:
+            dir_ino = pending.pop()
+            inos.extend(self.inodes.files.get(dir_ino, {}).values())
+            children = list(self.inodes.subdirs.get(dir_ino, {}).values())
+            inos.extend(children)
+            pending.extend(children)
+        return inos
+
+    @contextmanager
+    def _locked_entries(self, names, subtree=False):
+        """Hold the parent directories and current entries of ``names``
+        (plus, with ``subtree``, everything below them) for writing, in one
+        lock acquisition. Yields ``{name: (path, parent, entry_name)}``, or
+        the FileNotFoundError for names whose parent does not exist. The
+        body runs as one journal transaction, committed once the locks are
+        released."""
+        try:
+            while True:
+                resolved = {}
+                snapshot = {}
+                inos = []
+                for name in names:
+                    try:
+                        resolved[name] = path, parent, entry_name = self._parent(name)
+                    except FileNotFoundError as e:
+                        resolved[name] = e
+                        continue
+                    ino = self._entry_ino(parent.ino, entry_name)
+                    below = self._subtree_inos(ino) if subtree and ino is not None else None
+                    snapshot[name] = (ino, below)
+                    inos.append(parent.ino)
+                    if ino is not None:
+                        inos.append(ino)
+                    inos.extend(below or ())
+                with self.locks.writing(*inos):
+                    if all(self._unchanged(resolved[name], ino, below) for name, (ino, below) in snapshot.items()):
+                        with self._transaction():
+                            yield resolved
+                        return
+        finally:
+            self._commit()
+
+    def _unchanged(self, entry, ino, below):
+        path, parent, entry_name = entry
+        return self.path_index.get(posixpath.dirname(path)) == parent.ino and \
+            self._entry_ino(parent.ino, entry_name) == ino and \
+            (below is None or self._subtree_inos(ino) == below)
+
+    @contextmanager
+    def _locked_entry(self, name, subtree=False):
+        """Single-path form of ``_locked_entries``."""
+        with self._locked_entries([name], subtree) as resolved:
+            entry = resolved[name]
+            if isinstance(entry, Exception):
+                raise entry
+            yield entry
+
+    @contextmanager
+    def _locked_file(self, name, password=None, write=False):
+        path = self._abspath(name)
+        file = self._open_for_read(path, password)
+        if not write:
+            with self.locks.reading(file.ino):
+                if self.path_index.get(path) != file.ino:
+                    raise FileNotFoundError(f"File '{name}' not found.")
+                yield file
+            return
+        try:
+            with self.locks.writing(file.ino), self._transaction():
+                if self.path_index.get(path) != file.ino:
+                    raise FileNotFoundError(f"File '{name}' not found.")
+                yield file
+        finally:
+            self._commit()
+        self._publish(MODIFIED, path)
+
     def get_tree_structure(self, directory=None):
-        with self.lock:
-            if directory is None:
-                directory = self.root
-            result = {
-                'type': 'dir',
-                'name': directory.name,
-                'children': []
-            }
-            for subdir in directory.subdirectories.values():
-                result['children'].append(self.get_tree_structure(subdir))
-            for file in directory.files.values():
-                result['children'].append({
-                    'type': 'file',
-                    'name': file.name,
-                    'size': file.size,
-                    'encrypted': self.is_encrypted(file.name)
-                })
-            return result
+        if directory is None:
+            directory = self.root
+        with self.locks.reading(directory.ino):
+            subdirs = list(directory.subdirectories.values())
+            files = [{
+                'type': 'file',
+                'name': file.name,
+                'size': file.size,
+                'encrypted': self.inodes.has_flag(file.ino, FLAG_ENCRYPTED)
+            } for file in directory.files.values()]
+        return {
+            'type': 'dir',
+            'name': directory.name,
+            'size': self.inodes.tree_bytes[directory.ino],
+            'children': [self.get_tree_structure(subdir) for subdir in subdirs] + files
+        }
 
     def mkdir(self, name):
-        with self.lock:
-            self.current_directory.create_subdirectory(name)
+        with self._locked_entry(name) as (path, parent, dir_name):
+            if dir_name in parent.files:
+                raise FileExistsError(f"'{path}' is a file.")
+            if dir_name not in parent.subdirectories:
+                self.quotas.check(self._current_uid(), 0, 1)
+                self._register(path, parent.create_subdirectory(dir_name, self._current_uid()))
+                self._publish(CREATED, path)
 
     def cd(self, name):
         with self.lock:
             if name == "..":
                 if len(self.path_stack) > 1:
                     self.path_stack.pop()
-            elif name in self.current_directory.subdirectories:
-                self.path_stack.append(self.current_directory.subdirectories[name])
+            elif isinstance(self._lookup(name), Directory):
+                stack = [self.root]
+                for part in self._abspath(name).split("/")[1:]:
+                    if part:
+                        stack.append(stack[-1].subdirectories[part])
+                self.path_stack = stack
             else:
                 print("Directory not found.")
             self.current_directory = self.path_stack[-1]
 
+    def rename(self, old, new):
+        """Move or rename a file or directory. ``new`` must not exist yet."""
+        with self._locked_entries([old, new], subtree=True) as resolved:
+            for entry in resolved.values():
+                if isinstance(entry, Exception):
+                    raise entry
+            old_path, old_parent, old_name = resolved[old]
+            new_path, new_parent, new_name = resolved[new]
+            ino = self._entry_ino(old_parent.ino, old_name)
+            if ino is None:
+                raise FileNotFoundError(f"'{old}' not found.")
+            if new_path == old_path:
+                return
+            if self._entry_ino(new_parent.ino, new_name) is not None:
+                raise FileExistsError(f"'{new}' already exists.")
+            if new_path.startswith(old_path + "/"):
+                raise ValueError(f"Cannot move '{old}' into itself.")
+            self._unregister(old_path, node_for(self.inodes, ino))
+            self.inodes.move(ino, new_parent.ino, new_name)
+            node = node_for(self.inodes, ino)
+            if isinstance(node, Directory):
+                self._index_tree(new_path, node)
+            else:
+                self._register(new_path, node)
+        self._publish(MOVED, new_path, old_path)
+        with self.lock:
+            self.path_stack = [Directory(self.inodes, i) for i in self._ancestry(self.current_directory.ino)]
+            self.current_directory = self.path_stack[-1]
+
+    def _leave_deleted(self, inos):
+        """Move the current directory up to its nearest ancestor that is
+        not one of the deleted directories ``inos``."""
+        with self.lock:
+            for depth, directory in enumerate(self.path_stack):
+                if directory.ino in inos:
+                    self.path_stack = self.path_stack[:depth]
+                    self.current_directory = self.path_stack[-1]
+                    return
+
+    def find(self, pattern, mode=None, kind=None):
+        """Absolute paths of every entry whose name matches ``pattern``,
+        ignoring case. ``mode`` is "prefix", "substring" or "glob"; by
+        default patterns containing ``*``, ``?`` or ``[`` are globs and
+        anything else a substring. ``kind`` limits results to "file" or
+        "dir"."""
+        if mode is None:
+            mode = "glob" if any(c in pattern for c in "*?[") else "substring"
+        if mode not in ("prefix", "substring", "glob"):
+            raise ValueError(f"Unknown search mode '{mode}'.")
+        kinds = {None: (FILE, DIRECTORY), "file": (FILE,), "dir": (DIRECTORY,)}[kind]
+        paths = []
+        for ino in getattr(self.inodes.index, mode)(pattern):
+            if self.inodes.kind[ino] in kinds:
+                path = self._path_of(ino)
+                if path is not None:
+                    paths.append(path)
+        return sorted(paths)
+
     def is_encrypted(self, filename):
-        return self.encrypted_flags.get(filename, False)
+        node = self._lookup(filename)
+        return node is not None and self.inodes.has_flag(node.ino, FLAG_ENCRYPTED)
     
     def check_password(self, filename, password):
-        file = self.current_directory.files.get(filename)
+        file = self._get_file(filename)
         if file is None:
             raise FileNotFoundError(f"File '{filename}' not found.")
 
@@ -159,8 +1148,36 @@ class FileSystem:
 
 
 
+    def forget_key(self, filename=None):
+        """Lock encrypted files again: drop the session key of ``filename``
+        (or of every unlocked file) and any plaintext cached under it."""
+        if filename is None:
+            inos = list(self.inodes.keys)
+        else:
+            file = self._get_file(filename)
+            if file is None:
+                raise FileNotFoundError(f"File '{filename}' not found.")
+            inos = [file.ino]
+        for ino in inos:
+            with self.locks.writing(ino):
+                self.inodes.keys.pop(ino, None)
+        if filename is None:
+            self.inodes.key_cache.clear()
+
+    def _forget_plaintext(self, ino):
+        """Called by the key cache when the session key of ``ino`` is gone,
+        however it went, so no plaintext outlives it."""
+        blocks = self.inodes.block_lists[ino]
+        if blocks and self.inodes.cache_plaintext:
+            EncryptedFile(self.inodes, ino).forget_plaintext(blocks)
+
     def set_encrypted_flag(self, filename, encrypted=True):
-        self.encrypted_flags[filename] = encrypted
+        node = self._lookup(filename)
+        if node is not None:
+            with self.locks.writing(node.ino):
+                self.inodes.set_flag(node.ino, FLAG_ENCRYPTED, encrypted)
+            self._commit()
+            self._publish(MODIFIED, self._abspath(filename))
 
     def encrypt_content(self, content, password):
         key = Fernet.generate_key()
@@ -170,43 +1187,231 @@ class FileSystem:
         return encrypted
 
     def create_file(self, name, content=""):
-        self.current_directory.create_file(name, content, storage=self.storage, cache=self.cache)
-        self.set_encrypted_flag(name, False)
+        with self._locked_entry(name) as (path, parent, file_name):
+            if file_name in parent.subdirectories:
+                raise IsADirectoryError(f"'{path}' is a directory.")
+            data = content.encode('utf-8') if isinstance(content, str) else content
+            existing = self.inodes.files[parent.ino].get(file_name)
+            self._check_quota(existing, len(data))
+            self._register(path, parent.create_file(file_name, data, self._current_uid()))
+        self._publish(CREATED if existing is None else MODIFIED, path)
 
     def write_file(self, name, content, password=None):
-        if password:
-            key = EncryptedFile.derive_key_from_password(password)
-            if name not in self.current_directory.files or not isinstance(self.current_directory.files[name], EncryptedFile):
-                enc_file = EncryptedFile(name, content, key=key, owner=self.user_manager.get_current_user())
-                self.current_directory.files[name] = enc_file
-                self.set_encrypted_flag(name, True)
-            else:
-                file = self.current_directory.files[name]
-                if isinstance(file, EncryptedFile):
-                    if file.key != key:
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        if not password:
+            path = self._abspath(name)
+            file = self._get_file(path)
+            if isinstance(file, File) and not isinstance(file, EncryptedFile):
+                with self.locks.writing(file.ino), self._transaction():
+                    written = self.path_index.get(path) == file.ino
+                    if written:
+                        self._check_quota(file.ino, len(data))
+                        file.write(data)
+                self._commit()
+                if written:
+                    self._publish(MODIFIED, path)
+                    return
+        with self._locked_entry(name) as (path, parent, file_name):
+            if file_name in parent.subdirectories:
+                raise IsADirectoryError(f"'{path}' is a directory.")
+            existing = parent.files.get(file_name)
+            kind = CREATED if existing is None else MODIFIED
+            if password:
+                if not isinstance(existing, EncryptedFile):
+                    self._check_quota(None if existing is None else existing.ino, len(data))
+                    ino = self.inodes.alloc(FILE, file_name, parent.ino, self._current_uid())
+                    enc_file = EncryptedFile(self.inodes, ino, file_name)
+                    try:
+                        enc_file.set_password(password)
+                        self.inodes.set_flag(ino, FLAG_ENCRYPTED)
+                        enc_file.write(data)
+                    except Exception:
+                        release_inode(self.inodes, ino)
+                        raise
+                    parent.files[file_name] = enc_file
+                    self._register(path, enc_file)
+                else:
+                    if not existing.check_password(password):
                         raise PermissionError("Wrong password for existing encrypted file.")
-                    file.write(content)
+                    self._check_quota(existing.ino, len(data))
+                    existing.write(data)
+            else:
+                self._check_quota(None if existing is None else existing.ino, len(data))
+                if existing is None or isinstance(existing, EncryptedFile):
+                    self._register(path, parent.create_file(file_name, data, self._current_uid()))
                 else:
-                    raise TypeError("Existing file is not encrypted.")
-            self.set_encrypted_flag(name, True)
+                    existing.write(data)
+        self._publish(kind, path)
+
+
+    def create_files(self, items, workers=None):
+        """Create or overwrite many files at once.
+
+        ``items`` is a mapping or an iterable of ``(path, content)`` pairs.
+        Content is chunked, hashed and compressed on a thread pool, blocks
+        are stored under one storage lock acquisition and all metadata is
+        committed under one directory lock acquisition (and one journal
+        transaction). Returns a ``{"path", "ok", "error"}`` dict per item,
+        in order.
+        """
+        items = list(items.items() if isinstance(items, Mapping) else items)
+        return self._create_files([path for path, _ in items], lambda index: items[index][1], workers)
+
+    def import_host_directory(self, host_dir, dest="/", workers=None):
+        """Copy a host directory tree into ``dest``, reading files in parallel."""
+        dest = self._abspath(dest)
+        paths = []
+        sources = []
+        for root, dirs, files in os.walk(host_dir):
+            dirs.sort()
+            rel = os.path.relpath(root, host_dir)
+            target = dest if rel == "." else posixpath.join(dest, *rel.split(os.sep))
+            if rel != ".":
+                self.mkdir(target)
+            for file_name in sorted(files):
+                paths.append(posixpath.join(target, file_name))
+                sources.append(os.path.join(root, file_name))
+        return self._create_files(paths, lambda index: _read_host_file(sources[index]), workers)
+
+    def _create_files(self, paths, load, workers):
+        results = [{"path": path, "ok": False, "error": None} for path in paths]
+        prepared = {}
+
+        def prepare(indexes):
+            for index in indexes:
+                try:
+                    content = load(index)
+                    data = content.encode('utf-8') if isinstance(content, str) else bytes(content)
+                    prepared[index] = len(data), self.storage.prepare(data)
+                except Exception as e:
+                    results[index]["error"] = str(e)
+
+        workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        step = max(1, len(paths) // (workers * 4))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(prepare, [range(i, min(i + step, len(paths))) for i in range(0, len(paths), step)]))
+        prepared = dict(sorted(prepared.items()))
+        with self._locked_entries([paths[index] for index in prepared]) as resolved:
+            # Stored under the entry locks, so a checkpoint (which holds
+            # every lock) sees both the blocks and the files using them or
+            # neither.
+            batches = self.storage.store_prepared([p[1] for p in prepared.values()])
+            for index, block_ids in zip(prepared, batches):
+                if isinstance(block_ids, Exception):
+                    results[index]["error"] = str(block_ids)
+                    continue
+                try:
+                    entry = resolved[paths[index]]
+                    if isinstance(entry, Exception):
+                        raise entry
+                    self._adopt_file(*entry, block_ids, prepared[index][0])
+                except Exception as e:
+                    self.storage.delete(block_ids)
+                    results[index]["error"] = str(e)
+                else:
+                    results[index]["ok"] = True
+        return results
+
+    def _adopt_file(self, path, parent, name, block_ids, size):
+        if name in self.inodes.subdirs[parent.ino]:
+            raise IsADirectoryError(f"'{path}' is a directory.")
+        ino = self.inodes.files[parent.ino].get(name)
+        self._check_quota(ino, size)
+        if ino is None or self.inodes.has_flag(ino, FLAG_ENCRYPTED):
+            file = File(self.inodes, self.inodes.alloc(FILE, name, parent.ino, self._current_uid()), name)
+            file.adopt(block_ids, size)
+            parent.files[name] = file
+            self._register(path, file)
         else:
-            if name not in self.current_directory.files or isinstance(self.current_directory.files[name], EncryptedFile):
-                self.create_file(name, content)
-                self.set_encrypted_flag(name, False)
-            else:
-                file = self.current_directory.files[name]
-                file.write(content)
-            self.set_encrypted_flag(name, False)
+            File(self.inodes, ino, name).adopt(block_ids, size)
+        self._publish(CREATED if ino is None else MODIFIED, path)
+
+    def delete_many(self, paths):
+        """Delete files and directories (with their contents) under one
+        lock acquisition. Returns a ``{"path", "ok", "error"}`` dict per path."""
+        paths = list(paths)
+        results = []
+        deleted_dirs = set()
+        with self._locked_entries(paths, subtree=True) as resolved:
+            for name in paths:
+                result = {"path": name, "ok": False, "error": None}
+                results.append(result)
+                entry = resolved[name]
+                if isinstance(entry, Exception):
+                    result["error"] = str(entry)
+                    continue
+                path, parent, entry_name = entry
+                ino = self.path_index.get(path)
+                if ino is None:
+                    result["error"] = f"'{name}' not found."
+                    continue
+                node = node_for(self.inodes, ino, entry_name)
+                if isinstance(node, Directory):
+                    del parent.subdirectories[entry_name]
+                    deleted_dirs.add(ino)
+                else:
+                    del parent.files[entry_name]
+                self._unregister(path, node)
+                release_inode(self.inodes, ino)
+                self._publish(DELETED, path)
+                result["ok"] = True
+        if deleted_dirs:
+            self._leave_deleted(deleted_dirs)
+        return results
 
+    def _open_for_read(self, name, password=None):
+        file = self._get_file(name)
+        if not file:
+            raise FileNotFoundError(f"File '{name}' not found.")
+        if self.is_encrypted(name):
+            if password is None:
+                raise PermissionError("Password required to decrypt this file.")
+            if not file.check_password(password):
+                raise PermissionError("Invalid password.")
+        return file
+
+    def iter_file(self, name, password=None):
+        return self._iter_blocks(self._open_for_read(name, password))
+
+    def _iter_blocks(self, file):
+        offset = 0
+        while True:
+            with self.locks.reading(file.ino):
+                chunk = file.read_range(offset, file.payload)
+            if not chunk:
+                return
+            yield chunk
+            offset += len(chunk)
+
+    def read_file_range(self, name, offset, length, password=None):
+        with self._locked_file(name, password) as file:
+            return file.read_range(offset, length)
+
+    def write_file_at(self, name, offset, content, password=None):
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        with self._locked_file(name, password, write=True) as file:
+            self._check_quota(file.ino, offset + len(data))
+            file.write_at(offset, data)
+
+    def append_file(self, name, content, password=None):
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        with self._locked_file(name, password, write=True) as file:
+            self._check_quota(file.ino, file.size + len(data))
+            file.append(data)
+
+    def truncate_file(self, name, size, password=None):
+        with self._locked_file(name, password, write=True) as file:
+            self._check_quota(file.ino, size)
+            file.truncate(size)
 
     def read_file(self, name, password=None):
-        file = self.current_directory.files.get(name)
+        file = self._get_file(name)
         if not file:
             return "File not found."
         
         ext = os.path.splitext(name)[1].lower()
-        text_exts = ['.txt', '.py', '.json', '.md']
-        binary_exts = ['.jpg', '.png', '.gif', '.bmp']
+        text_exts = TEXT_EXTS
+        binary_exts = BINARY_EXTS
         
         if ext not in text_exts + binary_exts:
             return "[Unsupported or binary file type.]"
@@ -221,7 +1426,8 @@ class FileSystem:
             if not file.check_password(password):
                 raise PermissionError("Invalid password.")
 
-            decrypted = file.read()
+            with self.locks.reading(file.ino):
+                decrypted = file.read()
             if ext in text_exts:
                 try:
                     return decrypted.decode('utf-8')
@@ -231,7 +1437,8 @@ class FileSystem:
                 return decrypted
 
         else:
-            data = file.read()
+            with self.locks.reading(file.ino):
+                data = file.read()
             if ext in text_exts:
                 try:
                     return data.decode('utf-8')
@@ -242,42 +1449,123 @@ class FileSystem:
 
 
     def file_info(self, name):
+        file = self._get_file(name)
+        if not file:
+            return "File not found."
+        with self.locks.reading(file.ino):
+            return {
+                "name": file.name,
+                "size": file.size,
+                "created_at": file.created_at,
+                "encrypted": self.inodes.has_flag(file.ino, FLAG_ENCRYPTED)
+            }
+
+    def close(self):
+        if self.journal is not None:
+            self.checkpoint()
+            self.journal.close()
         with self.lock:
-            file = self.current_directory.files.get(name)
-            if file:
-                return {
-                    "name": file.name,
-                    "size": file.size,
-                    "created_at": file.created_at,
-                    "encrypted": self.is_encrypted(name)
-                }
-            else:
-                return "File not found."
+            if self.flusher is not None:
+                self.flusher.stop()
+            if self.readahead is not None:
+                self.readahead.close()
+            self.cache.clear()
+            self.storage.close()
+
+    def sync(self):
+        self.storage.sync()
+
+    def fsync(self, name):
+        file = self._get_file(name)
+        if file is None:
+            raise FileNotFoundError(f"File '{name}' not found.")
+        if isinstance(file, File):
+            with self.locks.reading(file.ino):
+                block_ids = list(file.blocks)
+            self.storage.sync(block_ids)
+
+    def storage_stats(self):
+        return self.storage.stats()
+
+    def cache_stats(self):
+        return self.cache.stats()
+
+    def inode_stats(self):
+        """``InodeTable.stats()`` with the path index added in, so
+        ``bytes_per_inode`` is the metadata cost of one entry."""
+        stats = self.inodes.stats()
+        index = dict(self.path_index)
+        stats["path_index_bytes"] = sys.getsizeof(index) + sum(map(sys.getsizeof, index))
+        if stats["inodes"]:
+            stats["bytes_per_inode"] += stats["path_index_bytes"] / stats["inodes"]
+        return stats
+
+    def compression_stats(self):
+        return self.storage.compressor.stats() if self.storage.compressor is not None else None
+
+    def key_cache_stats(self):
+        return self.inodes.key_cache.stats()
+
+    def readahead_stats(self):
+        return self.readahead.stats() if self.readahead is not None else None
 
     def dir_info(self, name):
-        with self.lock:
-            directory = self.current_directory.subdirectories.get(name)
-            if directory:
-                return {
-                    "name": directory.name,
-                    "created_at": directory.created_at,
-                    "folders": len(directory.subdirectories),
-                    "files": len(directory.files)
-                }
-            else:
-                return "Directory not found."
+        directory = self._lookup(name)
+        if not isinstance(directory, Directory):
+            return "Directory not found."
+        with self.locks.reading(directory.ino):
+            return {
+                "name": directory.name,
+                "created_at": directory.created_at,
+                "folders": len(directory.subdirectories),
+                "files": len(directory.files),
+                "total_folders": self.inodes.tree_dirs[directory.ino] - 1,
+                "total_files": self.inodes.tree_files[directory.ino],
+                "total_size": self.inodes.tree_bytes[directory.ino],
+                "total_blocks": self.inodes.tree_blocks[directory.ino],
+            }
+
+    def du(self, name="/"):
+        """Recursive totals (bytes, blocks, files, dirs) of a file or
+        directory, read from the inode table without walking the tree."""
+        node = self._lookup(name)
+        if node is None:
+            raise FileNotFoundError(f"'{name}' not found.")
+        return self.inodes.totals(node.ino)
+
+    def stats(self):
+        totals = self.inodes.totals(self.root.ino)
+        return {
+            "files": totals["files"],
+            "folders": totals["dirs"] - 1,
+            "bytes": totals["bytes"],
+            "block_references": totals["blocks"],
+            "blocks": len(self.storage.refcounts),
+            "physical_bytes": self.storage.physical_bytes,
+            "inodes": len(self.inodes),
+        }
 
     def delete_file(self, name):
-        with self.lock:
-            if name in self.current_directory.files:
-                del self.current_directory.files[name]
-                self.encrypted_flags.pop(name, None)
-            else:
+        if self._abspath(name) == "/":
+            raise FileNotFoundError(f"File '{name}' not found.")
+        with self._locked_entry(name) as (path, parent, file_name):
+            file = parent.files.get(file_name)
+            if file is None:
                 raise FileNotFoundError(f"File '{name}' not found.")
+            del parent.files[file_name]
+            self._unregister(path, file)
+            release_inode(self.inodes, file.ino)
+            self._publish(DELETED, path)
 
     def delete_directory(self, name):
-        with self.lock:
-            if name in self.current_directory.subdirectories:
-                del self.current_directory.subdirectories[name]
-            else:
+        if self._abspath(name) == "/":
+            raise FileNotFoundError(f"Directory '{name}' not found.")
+        with self._locked_entry(name, subtree=True) as (path, parent, dir_name):
+            directory = parent.subdirectories.get(dir_name)
+            if directory is None:
                 raise FileNotFoundError(f"Directory '{name}' not found.")
+            del parent.subdirectories[dir_name]
+            self._unregister(path, directory)
+            release_inode(self.inodes, directory.ino)
+            self._publish(DELETED, path)
+        self._leave_deleted({directory.ino})
@@ -0,0 +1,85 @@
+import errno
+import threading
+import time
+
+
+class QuotaExceededError(OSError):
+    def __init__(self, message):
+        super().__init__(errno.EDQUOT, message)
+
+
+class Quotas:
+    """Per-owner usage counters and storage limits.
+
+    ``usage`` maps an owner id to ``[bytes, inodes]`` and is kept current
+    by the InodeTable as inodes are allocated, written and freed, so a
+    check is O(1). Writes may go past a soft limit until it has been
+    exceeded for ``grace`` seconds (forever if None); a hard limit is
+    never exceeded. Only growth is checked: shrinking and deleting always
+    succeed. Checks run before a write, so concurrent writers of one owner
+    can overshoot by their writes in flight.
+    """
+
+    def __init__(self, grace=None):
+        self.grace = grace
+        self.usage = {}
+        # owner -> (soft bytes, hard bytes, soft inodes, hard inodes); None is unlimited.
+        self.limits = {}
+        self._over_since = {}
+        self._lock = threading.Lock()
+        self.denied = 0
+
+    def charge(self, owner, size, inodes):
+        with self._lock:
+            usage = self.usage.get(owner)
+            if usage is None:
+                usage = self.usage[owner] = [0, 0]
+            usage[0] += size
+            usage[1] += inodes
+
+    def set_limits(self, owner, soft_bytes=None, hard_bytes=None, soft_inodes=None, hard_inodes=None):
+        with self._lock:
+            if (soft_bytes, hard_bytes, soft_inodes, hard_inodes) == (None, None, None, None):
+                self.limits.pop(owner, None)
+            else:
+                self.limits[owner] = (soft_bytes, hard_bytes, soft_inodes, hard_inodes)
+            self._over_since.pop((owner, "bytes"), None)
+            self._over_since.pop((owner, "inodes"), None)
+
+    def check(self, owner, size, inodes=0):
+        """Raise QuotaExceededError if ``owner`` may not grow by ``size``
+        bytes and ``inodes`` inodes."""
+        limits = self.limits.get(owner)
+        if limits is None or (size <= 0 and inodes <= 0):
+            return
+        now = time.monotonic()
+        with self._lock:
+            used_bytes, used_inodes = self.usage.get(owner, (0, 0))
+            soft_bytes, hard_bytes, soft_inodes, hard_inodes = limits
+            for what, value, soft, hard in (("bytes", used_bytes + size, soft_bytes, hard_bytes),
+                                            ("inodes", used_inodes + inodes, soft_inodes, hard_inodes)):
+                if hard is not None and value > hard:
+                    self.denied += 1
+                    raise QuotaExceededError(f"Hard quota of {hard} {what} exceeded.")
+                if soft is None or value <= soft:
+                    self._over_since.pop((owner, what), None)
+                    continue
+                since = self._over_since.setdefault((owner, what), now)
+                if self.grace is not None and now - since > self.grace:
+                    self.denied += 1
+                    raise QuotaExceededError(f"Soft quota of {soft} {what} exceeded for longer than {self.grace}s.")
+
+    def report(self, owner):
+        with self._lock:
+            used_bytes, used_inodes = self.usage.get(owner, (0, 0))
+            soft_bytes, hard_bytes, soft_inodes, hard_inodes = self.limits.get(owner, (None, None, None, None))
+        return {
+            "bytes": used_bytes,
+            "inodes": used_inodes,
+            "soft_bytes": soft_bytes,
+            "hard_bytes": hard_bytes,
+            "soft_inodes": soft_inodes,
+            "hard_inodes": hard_inodes,
+            "over_soft": (soft_bytes is not None and used_bytes > soft_bytes) or
+                         (soft_inodes is not None and used_inodes > soft_inodes),
+        }
@@ -0,0 +1,121 @@
+import queue
+import threading
+from collections import OrderedDict
+
+
+class _Stream:
+    __slots__ = ("last", "streak", "ahead")
+
+    def __init__(self):
+        self.last = -1
+        self.streak = 0
+        self.ahead = 0
+
+
+class ReadAhead:
+    """Detects sequential block reads per file and prefetches the next
+    ``window`` blocks into the cache.
+
+    Prefetching runs inline for fast backends and on a background worker
+    when the backend is marked ``slow``.
+    """
+
+    TRIGGER = 2
+    MAX_STREAMS = 256
+
+    def __init__(self, storage, cache, window=4, background=None):
+        self.storage = storage
+        self.cache = cache
+        self.window = window
+        self.background = storage.is_slow if background is None else background
+        self._streams = OrderedDict()
+        self._prefetched = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = None
+        self._worker = None
+        self.issued = 0
+        self.used = 0
+
+    def on_read(self, file, index):
+        block_id = file.blocks[index]
+        with self._lock:
+            if block_id in self._prefetched:
+                del self._prefetched[block_id]
+                if block_id in self.cache:
+                    self.used += 1
+            stream = self._streams.get(file.ino)
+            if stream is None:
+                stream = self._streams[file.ino] = _Stream()
+                if len(self._streams) > self.MAX_STREAMS:
+                    self._streams.popitem(last=False)
+            else:
+                self._streams.move_to_end(file.ino)
+            if index == stream.last + 1:
+                stream.streak += 1
+            else:
+                stream.streak = 1
+                stream.ahead = index + 1
+            stream.last = index
+            if stream.streak < self.TRIGGER:
+                return
+            start = max(stream.ahead, index + 1)
+            end = min(index + 1 + self.window, len(file.blocks))
+            if start >= end:
+                return
+            stream.ahead = end
+            targets = [bid for bid in file.blocks[start:end] if bid not in self.cache and bid not in self._prefetched]
+            for bid in targets:
+                self._prefetched[bid] = None
+            while len(self._prefetched) > 8 * self.window:
+                self._prefetched.popitem(last=False)
+        if not targets:
+            return
+        if self.background:
+            self._submit(targets)
+        else:
+            self._fetch(targets)
+
+    def _fetch(self, block_ids):
+        for block_id in block_ids:
+            if block_id in self.cache or block_id not in self.storage.refcounts:
+                continue
+            self.cache.put(block_id, self.storage.get_block(block_id))
+            with self._lock:
+                self.issued += 1
+
+    def _submit(self, block_ids):
+        if self._worker is None:
+            self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+        self._queue.put(block_ids)
+
+    def _run(self):
+        while True:
+            block_ids = self._queue.get()
+            if block_ids is None:
+                break
+            try:
+                self._fetch(block_ids)
+            finally:
+                self._queue.task_done()
+
+    def drain(self):
+        if self._queue is not None:
+            self._queue.join()
+
+    def close(self):
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
+            self._worker = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "window": self.window,
+                "background": self.background,
+                "issued": self.issued,
+                "used": self.used,
+                "usefulness": self.used / self.issued if self.issued else 0.0,
+            }
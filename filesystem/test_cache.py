@@ -0,0 +1,80 @@
+import threading
+import unittest
+from filesystem.cache import BlockCache, POLICIES
+
+
+class TestBlockCache(unittest.TestCase):
+    def test_capacity_is_in_bytes(self):
+        for policy in POLICIES:
+            cache = BlockCache(capacity=100, policy=policy)
+            for i in range(10):
+                cache.put(i, b"x" * 30)
+            self.assertLessEqual(cache.used, 100, policy)
+            self.assertEqual(len(cache), 3, policy)
+            self.assertEqual(cache.evictions, 7, policy)
+
+    def test_empty_block_is_a_hit(self):
+        cache = BlockCache()
+        cache.put("empty", b"")
+        self.assertEqual(cache.get("empty"), b"")
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_lru_keeps_recently_used(self):
+        cache = BlockCache(capacity=2, policy="lru")
+        cache.put("a", b"a")
+        cache.put("b", b"b")
+        cache.get("a")
+        cache.put("c", b"c")
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+
+    def test_arc_scan_does_not_flush_hot_set(self):
+        cache = BlockCache(capacity=8, policy="arc", block_size=1)
+        for key in ("h1", "h2"):
+            cache.put(key, b"h")
+            cache.get(key)
+        for i in range(20):
+            cache.put(f"scan{i}", b"s")
+        self.assertIn("h1", cache)
+        self.assertIn("h2", cache)
+
+    def test_2q_promotes_blocks_seen_again(self):
+        cache = BlockCache(capacity=4, policy="2q", block_size=1)
+        cache.put("hot", b"h")
+        for i in range(4):
+            cache.put(f"warm{i}", b"w")
+        self.assertNotIn("hot", cache)
+        cache.put("hot", b"h")
+        for i in range(20):
+            cache.put(f"scan{i}", b"s")
+        self.assertIn("hot", cache)
+
+    def test_invalidate_and_stats(self):
+        cache = BlockCache(capacity=100, policy="clock")
+        cache.put("a", b"abc")
+        cache.get("a")
+        cache.get("b")
+        cache.invalidate("a")
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"], stats["used"]), (1, 1, 0, 0))
+
+    def test_concurrent_access(self):
+        cache = BlockCache(capacity=64, policy="arc", block_size=8)
+
+        def worker(seed):
+            for i in range(2000):
+                key = (seed * 7 + i) % 40
+                if cache.get(key) is None:
+                    cache.put(key, b"12345678")
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertLessEqual(cache.used, 64)
+        self.assertEqual(cache.used, 8 * len(cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
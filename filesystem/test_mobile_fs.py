@@ -0,0 +1,1120 @@
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+from cryptography.exceptions import InvalidTag
+from filesystem.mobile_fs import FileSystem, BlockStorage, EncryptedFile, BLOCK_SIZE
+from filesystem.mmap_backend import MmapBackend
+from filesystem.image import Image
+from filesystem.locks import RWLock
+from filesystem.keys import KeyCache
+from filesystem.name_index import NameIndex
+from filesystem.quota import QuotaExceededError
+from filesystem.events import Event, CREATED, MODIFIED, DELETED, MOVED, DIR_CHANGED
+
+
+class TestBlockStorageDedup(unittest.TestCase):
+    def setUp(self):
+        self.storage = BlockStorage(dedup=True)
+
+    def test_identical_blocks_share_storage(self):
+        data = b"x" * (BLOCK_SIZE * 3)
+        first = self.storage.store(data)
+        second = self.storage.store(data)
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.storage.blocks), 1)
+        self.assertEqual(self.storage.refcounts[first[0]], 6)
+        self.assertEqual(self.storage.stats()["dedup_ratio"], 6.0)
+
+    def test_delete_drops_references(self):
+        ids = self.storage.store(b"hello")
+        self.storage.store(b"hello")
+        self.storage.delete(ids)
+        self.assertIn(ids[0], self.storage.blocks)
+        self.storage.delete(ids)
+        self.assertNotIn(ids[0], self.storage.blocks)
+        self.assertEqual(self.storage.stats()["physical_bytes"], 0)
+
+
+class TestFileSystemDedup(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem(dedup=True)
+
+    def test_rewriting_same_payload_keeps_one_copy(self):
+        payload = bytes(range(256)) * 8
+        self.fs.create_file("a.jpg", payload)
+        self.fs.write_file("a.jpg", payload)
+        self.fs.create_file("b.jpg", payload)
+        stats = self.fs.storage_stats()
+        self.assertEqual(stats["physical_bytes"], BLOCK_SIZE)
+        self.assertEqual(stats["logical_bytes"], 2 * len(payload))
+        self.assertEqual(self.fs.read_file("b.jpg"), payload)
+
+    def test_delete_file_releases_blocks(self):
+        self.fs.create_file("note.txt", "hello")
+        self.fs.delete_file("note.txt")
+        self.assertEqual(self.fs.storage_stats()["blocks"], 0)
+
+
+class TestRangedReads(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem()
+        self.payload = bytes(i % 251 for i in range(BLOCK_SIZE * 4 + 100))
+        self.fs.create_file("clip.jpg", self.payload)
+
+    def test_read_range_spans_blocks(self):
+        data = self.fs.read_file_range("clip.jpg", BLOCK_SIZE - 10, BLOCK_SIZE + 20)
+        self.assertEqual(data, self.payload[BLOCK_SIZE - 10:2 * BLOCK_SIZE + 10])
+
+    def test_read_range_past_end_is_clamped(self):
+        self.assertEqual(self.fs.read_file_range("clip.jpg", len(self.payload) - 5, 100), self.payload[-5:])
+        self.assertEqual(self.fs.read_file_range("clip.jpg", len(self.payload) + 5, 100), b"")
+
+    def test_read_range_only_touches_covering_blocks(self):
+        self.fs.read_file_range("clip.jpg", 2 * BLOCK_SIZE + 1, 10)
+        file = self.fs.current_directory.files["clip.jpg"]
+        self.assertEqual(len(self.fs.cache), 1)
+        self.assertIn(file.blocks[2], self.fs.cache)
+
+    def test_iter_file_yields_whole_payload(self):
+        chunks = list(self.fs.iter_file("clip.jpg"))
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(b"".join(chunks), self.payload)
+
+
+class TestPartialWrites(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem()
+        self.payload = bytes(i % 251 for i in range(BLOCK_SIZE * 3 + 7))
+        self.fs.create_file("log.txt", self.payload)
+        self.file = self.fs.current_directory.files["log.txt"]
+
+    def test_write_at_restores_only_touched_blocks(self):
+        before = list(self.file.blocks)
+        self.fs.write_file_at("log.txt", BLOCK_SIZE + 3, b"XYZ")
+        expected = self.payload[:BLOCK_SIZE + 3] + b"XYZ" + self.payload[BLOCK_SIZE + 6:]
+        self.assertEqual(self.file.read(), expected)
+        self.assertEqual(self.file.blocks[0], before[0])
+        self.assertNotEqual(self.file.blocks[1], before[1])
+        self.assertEqual(list(self.file.blocks[2:]), before[2:])
+        self.assertEqual(len(self.fs.storage.blocks), 4)
+
+    def test_append_keeps_full_blocks(self):
+        before = list(self.file.blocks)
+        self.fs.append_file("log.txt", b"a" * BLOCK_SIZE)
+        self.assertEqual(self.file.size, len(self.payload) + BLOCK_SIZE)
+        self.assertEqual(list(self.file.blocks[:3]), before[:3])
+        self.assertEqual(self.file.read(), self.payload + b"a" * BLOCK_SIZE)
+
+    def test_write_past_end_zero_fills(self):
+        self.fs.write_file_at("log.txt", self.file.size + 2, b"!")
+        self.assertEqual(self.file.read(), self.payload + b"\0\0!")
+
+    def test_truncate_shrinks_and_releases_blocks(self):
+        self.fs.truncate_file("log.txt", BLOCK_SIZE + 1)
+        self.assertEqual(self.file.read(), self.payload[:BLOCK_SIZE + 1])
+        self.assertEqual(len(self.file.blocks), 2)
+        self.assertEqual(len(self.fs.storage.blocks), 2)
+        self.fs.truncate_file("log.txt", BLOCK_SIZE + 4)
+        self.assertEqual(self.file.read(), self.payload[:BLOCK_SIZE + 1] + b"\0\0\0")
+
+    def test_negative_offset_or_size_changes_nothing(self):
+        before = list(self.file.blocks)
+        with self.assertRaises(ValueError):
+            self.fs.write_file_at("log.txt", -1, b"X")
+        with self.assertRaises(ValueError):
+            self.fs.truncate_file("log.txt", -1)
+        self.assertEqual(list(self.file.blocks), before)
+        self.assertEqual(self.file.read(), self.payload)
+        self.assertEqual(len(self.fs.storage.blocks), 4)
+
+
+class TestReadAhead(unittest.TestCase):
+    def setUp(self):
+        self.payload = bytes(i % 251 for i in range(BLOCK_SIZE * 12))
+
+    def test_sequential_scan_uses_prefetched_blocks(self):
+        fs = FileSystem(readahead_window=4)
+        fs.create_file("song.jpg", self.payload)
+        self.assertEqual(b"".join(fs.iter_file("song.jpg")), self.payload)
+        stats = fs.readahead_stats()
+        self.assertEqual(stats["issued"], 10)
+        self.assertEqual(stats["used"], 10)
+        self.assertEqual(fs.cache_stats()["hits"], 10)
+
+    def test_random_reads_do_not_prefetch(self):
+        fs = FileSystem(readahead_window=4)
+        fs.create_file("song.jpg", self.payload)
+        for index in (7, 2, 9, 0):
+            fs.read_file_range("song.jpg", index * BLOCK_SIZE, 1)
+        self.assertEqual(fs.readahead_stats()["issued"], 0)
+
+    def test_background_prefetch(self):
+        fs = FileSystem(readahead_window=4)
+        fs.readahead.background = True
+        fs.create_file("song.jpg", self.payload)
+        fs.read_file_range("song.jpg", 0, 2 * BLOCK_SIZE)
+        fs.readahead.drain()
+        file = fs.current_directory.files["song.jpg"]
+        for block_id in file.blocks[2:6]:
+            self.assertIn(block_id, fs.cache)
+        fs.close()
+
+
+class TestWriteBack(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem(writeback=True, flush_interval=60, dirty_limit=4 * BLOCK_SIZE)
+
+    def tearDown(self):
+        self.fs.close()
+
+    def test_writes_stay_dirty_until_sync(self):
+        self.fs.create_file("photo_1.jpg", b"p" * BLOCK_SIZE * 2)
+        self.assertEqual(len(self.fs.storage.blocks), 0)
+        self.assertEqual(self.fs.read_file("photo_1.jpg"), b"p" * BLOCK_SIZE * 2)
+        self.fs.sync()
+        self.assertEqual(len(self.fs.storage.blocks), 2)
+        self.assertEqual(self.fs.storage_stats()["dirty_blocks"], 0)
+
+    def test_fsync_flushes_only_that_file(self):
+        self.fs.create_file("a.jpg", b"a")
+        self.fs.create_file("b.jpg", b"b")
+        self.fs.fsync("a.jpg")
+        self.assertEqual(list(self.fs.storage.blocks), list(self.fs.current_directory.files["a.jpg"].blocks))
+        self.assertEqual(self.fs.storage_stats()["dirty_blocks"], 1)
+
+    def test_deleting_dirty_file_never_reaches_storage(self):
+        self.fs.create_file("tmp.txt", "scratch")
+        self.fs.delete_file("tmp.txt")
+        self.fs.sync()
+        self.assertEqual(len(self.fs.storage.blocks), 0)
+
+    def test_flusher_writes_batch_at_dirty_limit(self):
+        self.fs.create_file("burst.jpg", bytes(range(256)) * 8)
+        for _ in range(100):
+            if not self.fs.storage.dirty:
+                break
+            time.sleep(0.01)
+        stats = self.fs.storage_stats()
+        self.assertEqual(stats["dirty_blocks"], 0)
+        self.assertEqual(stats["flushed_blocks"], 4)
+
+
+class TestAbsolutePaths(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem()
+        self.fs.mkdir("/DCIM")
+        self.fs.mkdir("/DCIM/Camera")
+        self.fs.mkdir("/Notes")
+
+    def test_operations_do_not_depend_on_current_directory(self):
+        self.fs.create_file("/DCIM/Camera/photo_1.jpg", b"jpeg")
+        self.fs.cd("Notes")
+        self.assertEqual(self.fs.read_file("/DCIM/Camera/photo_1.jpg"), b"jpeg")
+        self.assertEqual(self.fs.file_info("/DCIM/Camera/photo_1.jpg")["size"], 4)
+        self.assertEqual(self.fs.dir_info("/DCIM")["folders"], 1)
+        self.fs.delete_file("/DCIM/Camera/photo_1.jpg")
+        self.assertNotIn("/DCIM/Camera/photo_1.jpg", self.fs.path_index)
+        self.assertEqual(self.fs.get_current_path(), "root/Notes")
+
+    def test_relative_paths_resolve_against_current_directory(self):
+        self.fs.cd("/DCIM/Camera")
+        self.fs.create_file("a.txt", "x")
+        self.assertIn("/DCIM/Camera/a.txt", self.fs.path_index)
+        self.fs.cd("..")
+        self.assertEqual(self.fs.read_file("Camera/a.txt"), "x")
+
+    def test_encryption_is_tracked_per_inode(self):
+        self.fs.write_file("/Notes/todo.txt", "secret", password="pw")
+        self.fs.create_file("/DCIM/todo.txt", "public")
+        self.assertTrue(self.fs.is_encrypted("/Notes/todo.txt"))
+        self.assertFalse(self.fs.is_encrypted("/DCIM/todo.txt"))
+        self.assertEqual(self.fs.read_file("/DCIM/todo.txt"), "public")
+        self.assertEqual(self.fs.read_file("/Notes/todo.txt", password="pw"), "secret")
+
+    def test_files_and_directories_do_not_share_names(self):
+        self.fs.create_file("/Notes/todo.txt", "x")
+        with self.assertRaises(IsADirectoryError):
+            self.fs.create_file("/DCIM", "x")
+        with self.assertRaises(IsADirectoryError):
+            self.fs.write_file("/DCIM", "x")
+        with self.assertRaises(IsADirectoryError):
+            self.fs.write_file("/DCIM", "x", password="pw")
+        with self.assertRaises(FileExistsError):
+            self.fs.mkdir("/Notes/todo.txt")
+        self.assertEqual(self.fs.read_file("/Notes/todo.txt"), "x")
+        self.fs.cd("/DCIM")
+        self.assertEqual(self.fs.dir_info("/DCIM")["folders"], 1)
+
+    def test_delete_directory_drops_subtree_from_index(self):
+        self.fs.create_file("/DCIM/Camera/photo_1.jpg", b"jpeg")
+        self.fs.delete_directory("/DCIM")
+        self.assertEqual(sorted(self.fs.path_index), ["/", "/Notes"])
+        self.assertEqual(self.fs.storage_stats()["blocks"], 0)
+
+    def test_deleting_the_current_directory_moves_up(self):
+        self.fs.cd("/DCIM/Camera")
+        self.fs.delete_directory("/DCIM")
+        self.assertEqual(self.fs.get_current_path(), "root")
+        self.assertEqual(self.fs.current_directory.files, {})
+        self.fs.mkdir("/Notes/a")
+        self.fs.cd("/Notes/a")
+        self.fs.delete_many(["/Notes/a"])
+        self.assertEqual(self.fs.get_current_path(), "root/Notes")
+        self.fs.create_file("b.txt", "x")
+        self.assertEqual(self.fs.read_file("/Notes/b.txt"), "x")
+
+
+class TestInodeTable(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem()
+
+    def test_files_are_views_over_the_table(self):
+        self.fs.create_file("/a.jpg", b"x" * (BLOCK_SIZE + 1))
+        file = self.fs.root.files["a.jpg"]
+        self.assertEqual(self.fs.inodes.size[file.ino], BLOCK_SIZE + 1)
+        self.assertEqual(list(self.fs.inodes.block_lists[file.ino]), list(file.blocks))
+        self.assertTrue(all(isinstance(bid, int) for bid in file.blocks))
+
+    def test_deleted_inodes_are_reused(self):
+        self.fs.create_file("/a.txt", "a")
+        ino = self.fs.path_index["/a.txt"]
+        self.fs.delete_file("/a.txt")
+        self.assertEqual(len(self.fs.inodes), 1)
+        self.fs.create_file("/b.txt", "b")
+        self.assertEqual(self.fs.path_index["/b.txt"], ino)
+        self.assertEqual(self.fs.read_file("/b.txt"), "b")
+
+    def test_replacing_a_file_frees_the_old_inode(self):
+        self.fs.create_file("/a.txt", "one")
+        self.fs.create_file("/a.txt", "two")
+        self.assertEqual(len(self.fs.inodes), 2)
+        self.assertEqual(self.fs.storage_stats()["blocks"], 1)
+
+    def test_stats_report_the_real_per_inode_cost(self):
+        for i in range(200):
+            self.fs.create_file(f"/photo_{i}.jpg", b"x" * 10)
+        stats = self.fs.inode_stats()
+        self.assertEqual(stats["inodes"], 201)
+        self.assertGreater(stats["path_index_bytes"], 0)
+        self.assertGreater(stats["bytes_per_inode"], 3 * stats["fixed_bytes_per_inode"])
+
+
+class TestLocking(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem()
+
+    def test_tree_structure_with_subdirectories(self):
+        self.fs.mkdir("/a")
+        self.fs.mkdir("/a/b")
+        self.fs.create_file("/a/b/c.txt", "x")
+        tree = self.fs.get_tree_structure()
+        self.assertEqual(tree["children"][0]["name"], "a")
+        self.assertEqual(tree["children"][0]["children"][0]["children"][0]["name"], "c.txt")
+
+    def test_readers_share_a_lock(self):
+        lock = RWLock()
+        lock.acquire_read()
+        acquired = threading.Event()
+
+        def reader():
+            lock.acquire_read()
+            acquired.set()
+            lock.release_read()
+
+        threading.Thread(target=reader).start()
+        self.assertTrue(acquired.wait(1))
+        lock.release_read()
+
+    def test_concurrent_writers_and_readers(self):
+        for d in range(4):
+            self.fs.mkdir(f"/d{d}")
+        errors = []
+
+        def writer(d):
+            try:
+                for i in range(25):
+                    self.fs.write_file(f"/d{d}/f{i}.txt", f"{d}-{i}" * 200)
+                    self.fs.append_file(f"/d{d}/f{i}.txt", "!")
+            except Exception as e:
+                errors.append(e)
+
+        def reader():
+            try:
+                for _ in range(25):
+                    self.fs.get_tree_structure()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer, args=(d,)) for d in range(4)]
+        threads += [threading.Thread(target=reader) for _ in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+        self.assertFalse(any(t.is_alive() for t in threads))
+        self.assertEqual(errors, [])
+        for d in range(4):
+            self.assertEqual(self.fs.read_file(f"/d{d}/f24.txt"), f"{d}-24" * 200 + "!")
+
+    def test_delete_directory_releases_subtree(self):
+        self.fs.mkdir("/a")
+        self.fs.mkdir("/a/b")
+        self.fs.create_file("/a/b/c.txt", "x" * 2000)
+        self.fs.delete_directory("/a")
+        self.assertEqual(len(self.fs.inodes), 1)
+        self.assertEqual(self.fs.storage_stats()["blocks"], 0)
+        with self.assertRaises(FileNotFoundError):
+            self.fs.delete_directory("/")
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "fs.journal")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def crash(self, fs):
+        fs.journal.close()
+
+    def test_replay_rebuilds_tree(self):
+        fs = FileSystem(journal=self.path)
+        fs.mkdir("/docs")
+        fs.create_file("/docs/a.txt", "alpha" * 300)
+        fs.write_file("/b.txt", "beta")
+        fs.append_file("/b.txt", "!")
+        fs.create_file("/gone.txt", "x")
+        fs.delete_file("/gone.txt")
+        self.crash(fs)
+
+        fs = FileSystem(journal=self.path)
+        self.assertEqual(fs.read_file("/docs/a.txt"), "alpha" * 300)
+        self.assertEqual(fs.read_file("/b.txt"), "beta!")
+        self.assertEqual(fs.read_file("/gone.txt"), "File not found.")
+        self.assertEqual(fs.storage_stats()["blocks"], 4)
+        fs.close()
+
+    def test_torn_tail_is_ignored(self):
+        fs = FileSystem(journal=self.path)
+        fs.write_file("/a.txt", "kept")
+        self.crash(fs)
+        with open(self.path, "ab") as f:
+            f.write(b"\x10\x00\x00\x00garbage")
+
+        fs = FileSystem(journal=self.path)
+        self.assertEqual(fs.read_file("/a.txt"), "kept")
+        fs.write_file("/a.txt", "still works")
+        self.crash(fs)
+        self.assertEqual(FileSystem(journal=self.path).read_file("/a.txt"), "still works")
+
+    def test_checkpoint_truncates_journal(self):
+        fs = FileSystem(journal=self.path)
+        fs.write_file("/a.txt", "before")
+        fs.checkpoint()
+        self.assertEqual(os.path.getsize(self.path), 0)
+        fs.write_file("/b.txt", "after")
+        fs.delete_file("/a.txt")
+        self.crash(fs)
+
+        fs = FileSystem(journal=self.path)
+        self.assertEqual(fs.read_file("/b.txt"), "after")
+        self.assertEqual(fs.read_file("/a.txt"), "File not found.")
+
+    def test_encrypted_file_survives_replay(self):
+        fs = FileSystem(journal=self.path)
+        fs.write_file("/secret.txt", "hidden", password="pw")
+        self.crash(fs)
+
+        fs = FileSystem(journal=self.path)
+        self.assertTrue(fs.is_encrypted("/secret.txt"))
+        self.assertFalse(fs.check_password("/secret.txt", "nope"))
+        self.assertEqual(fs.read_file("/secret.txt", password="pw"), "hidden")
+
+    def test_group_commit_shares_fsyncs(self):
+        fs = FileSystem(journal=self.path, commit_delay=0.01)
+
+        def writer(n):
+            for i in range(10):
+                fs.write_file(f"/w{n}-{i}.txt", "data")
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = fs.journal_stats()
+        self.assertGreater(stats["entries_per_commit"], 1.0)
+        self.crash(fs)
+        self.assertEqual(len(FileSystem(journal=self.path).root.files), 80)
+
+    def test_failed_write_keeps_old_content(self):
+        backend = MmapBackend(os.path.join(self.tmp.name, "blocks"), capacity=4)
+        fs = FileSystem(backend=backend, journal=self.path)
+        fs.write_file("/a.txt", "old")
+        with self.assertRaises(OSError):
+            fs.write_file("/a.txt", "n" * 10 * BLOCK_SIZE)
+        self.assertEqual(fs.read_file("/a.txt"), "old")
+        self.assertEqual(fs.storage_stats()["blocks"], 1)
+        fs.close()
+
+        fs = FileSystem(backend=MmapBackend(os.path.join(self.tmp.name, "blocks"), capacity=4), journal=self.path)
+        self.assertEqual(fs.read_file("/a.txt"), "old")
+        fs.close()
+
+
+class TestCompression(unittest.TestCase):
+    def test_text_is_stored_compressed(self):
+        fs = FileSystem(compression="zlib")
+        text = '{"event": "tick", "value": 42}\n' * 200
+        fs.write_file("log.json", text)
+        self.assertEqual(fs.read_file("log.json"), text)
+        stats = fs.storage_stats()
+        self.assertLess(stats["physical_bytes"] * 3, stats["logical_bytes"])
+        self.assertEqual(stats["compressed_blocks"], len(fs.current_directory.files["log.json"].blocks))
+
+    def test_incompressible_blocks_are_stored_raw_and_skipped(self):
+        fs = FileSystem(compression="zlib")
+        data = os.urandom(40 * BLOCK_SIZE)
+        fs.write_file("photo.jpg", data)
+        self.assertEqual(fs.read_file("photo.jpg"), data)
+        stats = fs.compression_stats()
+        self.assertEqual(stats["compressed_blocks"], 0)
+        self.assertEqual(fs.storage_stats()["physical_bytes"], len(data))
+        self.assertGreater(stats["skipped_blocks"], 0)
+
+    def test_appends_of_incompressible_data_are_skipped(self):
+        fs = FileSystem(compression="zlib")
+        fs.write_file("video.jpg", b"")
+        chunks = [os.urandom(BLOCK_SIZE) for _ in range(24)]
+        for chunk in chunks:
+            fs.append_file("video.jpg", chunk)
+        self.assertEqual(fs.read_file("video.jpg"), b"".join(chunks))
+        stats = fs.compression_stats()
+        # Two misses in a row, then only every PROBE_INTERVAL-th block is tried.
+        self.assertEqual(stats["incompressible_blocks"], 4)
+        self.assertEqual(stats["skipped_blocks"], 20)
+        fs.append_file("video.jpg", b"a" * BLOCK_SIZE)
+        self.assertEqual(fs.compression_stats()["compressed_blocks"], 1)
+        self.assertEqual(fs.storage.compress_misses, {})
+
+    def test_codecs_round_trip_through_cache(self):
+        for codec in ("zlib", "lzma", "bz2"):
+            fs = FileSystem(compression=codec)
+            fs.write_file("a.txt", "abc" * 1000)
+            self.assertEqual(fs.read_file("a.txt"), "abc" * 1000)
+            hits = fs.cache_stats()["hits"]
+            self.assertEqual(fs.read_file_range("a.txt", 0, BLOCK_SIZE), ("abc" * 1000)[:BLOCK_SIZE].encode())
+            self.assertEqual(fs.cache_stats()["hits"], hits + 1)
+            self.assertGreater(fs.compression_stats()["compression_ratio"], 1.0)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            FileSystem(compression="zip")
+
+    def test_compressed_blocks_survive_replay(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "fs.journal")
+            fs = FileSystem(journal=path, compression="zlib")
+            fs.write_file("/a.txt", "hello " * 500)
+            fs.checkpoint()
+            fs.write_file("/b.txt", "world " * 500)
+            fs.journal.close()
+
+            fs = FileSystem(journal=path, compression="zlib")
+            self.assertEqual(fs.read_file("/a.txt"), "hello " * 500)
+            self.assertEqual(fs.read_file("/b.txt"), "world " * 500)
+            self.assertEqual(fs.storage_stats()["logical_bytes"], 6000)
+            fs.close()
+
+
+class TestEncryptedFiles(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem()
+        self.data = bytes(range(256)) * 80
+        self.fs.write_file("/video.png", self.data, password="pw")
+        self.file = self.fs.root.files["video.png"]
+
+    def test_blocks_are_sealed_in_block_storage(self):
+        self.assertEqual(self.fs.read_file("/video.png", password="pw"), self.data)
+        self.assertEqual(self.fs.file_info("/video.png")["size"], len(self.data))
+        stored = self.fs.storage.retrieve(self.file.blocks)
+        self.assertNotIn(self.data[:64], stored)
+        self.assertTrue(all(len(self.fs.storage.get_block(bid)) <= BLOCK_SIZE for bid in self.file.blocks))
+
+    def test_ranged_read_and_partial_write_touch_only_their_blocks(self):
+        payload = EncryptedFile.payload
+        offset = 10 * payload + 7
+        self.assertEqual(self.fs.read_file_range("/video.png", offset, 100, password="pw"),
+                         self.data[offset:offset + 100])
+        before = list(self.file.blocks)
+        self.fs.write_file_at("/video.png", offset, b"X" * 10, password="pw")
+        after = list(self.file.blocks)
+        self.assertEqual([i for i in range(len(before)) if before[i] != after[i]], [10])
+        expected = self.data[:offset] + b"X" * 10 + self.data[offset + 10:]
+        self.assertEqual(b"".join(self.fs.iter_file("/video.png", password="pw")), expected)
+
+    def test_wrong_password_and_swapped_blocks_are_rejected(self):
+        self.fs.forget_key()
+        self.assertFalse(self.fs.check_password("/video.png", "nope"))
+        with self.assertRaises(PermissionError):
+            self.fs.read_file_range("/video.png", 0, 10)
+        self.assertTrue(self.fs.check_password("/video.png", "pw"))
+        blocks = self.file.blocks
+        blocks[1], blocks[2] = blocks[2], blocks[1]
+        with self.assertRaises(InvalidTag):
+            self.fs.read_file_range("/video.png", EncryptedFile.payload, 10, password="pw")
+
+    def test_plaintext_cache_is_key_scoped(self):
+        fs = FileSystem(cache_plaintext=True, cache_size=100 * BLOCK_SIZE)
+        fs.write_file("/note.txt", "secret " * 200, password="pw")
+        fs.read_file("/note.txt", password="pw")
+        block_id = fs.root.files["note.txt"].blocks[0]
+        self.assertIn(("plain", block_id), fs.cache)
+        fs.forget_key("/note.txt")
+        self.assertNotIn(("plain", block_id), fs.cache)
+        with self.assertRaises(PermissionError):
+            fs.read_file("/note.txt")
+
+    def test_expired_or_evicted_keys_take_their_plaintext(self):
+        fs = FileSystem(cache_plaintext=True, cache_size=100 * BLOCK_SIZE, key_cache_size=1, key_ttl=0.2)
+        fs.write_file("/a.txt", "secret " * 200, password="pw")
+        fs.read_file("/a.txt", password="pw")
+        fs.write_file("/b.txt", "other " * 200, password="pw")
+        fs.read_file("/b.txt", password="pw")
+        a, b = fs.root.files["a.txt"], fs.root.files["b.txt"]
+        # Unlocking b.txt evicted the session of a.txt, plaintext and all.
+        self.assertEqual(list(fs.inodes.keys), [b.ino])
+        self.assertFalse(any(("plain", bid) in fs.cache for bid in a.blocks))
+        self.assertIn(("plain", b.blocks[0]), fs.cache)
+        time.sleep(0.25)
+        self.assertIsNone(b.key)
+        self.assertFalse(any(("plain", bid) in fs.cache for bid in b.blocks))
+        with self.assertRaises(PermissionError):
+            fs.write_file_at("/b.txt", 0, b"x")
+        self.assertEqual(fs.read_file("/b.txt", password="pw"), "other " * 200)
+
+    def test_tree_lists_encrypted_size(self):
+        entry = self.fs.get_tree_structure()["children"][0]
+        self.assertEqual((entry["size"], entry["encrypted"]), (len(self.data), True))
+
+    def test_password_check_reads_no_blocks(self):
+        self.fs.forget_key("/video.png")
+        reads = []
+        get_block = self.fs.storage.get_block
+        self.fs.storage.get_block = lambda bid: reads.append(bid) or get_block(bid)
+        self.assertFalse(self.fs.check_password("/video.png", "nope"))
+        self.assertTrue(self.fs.check_password("/video.png", "pw"))
+        self.assertEqual(reads, [])
+
+    def test_empty_file_checks_password(self):
+        self.fs.write_file("/empty.txt", "", password="pw")
+        self.fs.forget_key()
+        self.assertFalse(self.fs.check_password("/empty.txt", "nope"))
+        self.assertTrue(self.fs.check_password("/empty.txt", "pw"))
+
+    def test_derived_keys_are_cached(self):
+        self.fs.forget_key("/video.png")
+        hits = self.fs.key_cache_stats()["hits"]
+        self.assertTrue(self.fs.check_password("/video.png", "pw"))
+        self.assertEqual(self.fs.key_cache_stats()["hits"], hits + 1)
+        self.fs.forget_key()
+        self.assertEqual(self.fs.key_cache_stats()["entries"], 0)
+
+
+class TestKeyCache(unittest.TestCase):
+    def test_entries_expire_and_are_bounded(self):
+        cache = KeyCache(capacity=2, ttl=0)
+        cache.derive("pw", b"salt")
+        cache.derive("pw", b"salt")
+        self.assertEqual(cache.stats()["hits"], 0)
+
+        cache = KeyCache(capacity=2, ttl=60)
+        for salt in (b"a", b"b", b"c"):
+            cache.derive("pw", salt)
+        self.assertEqual(cache.stats()["entries"], 2)
+        self.assertEqual(cache.derive("pw", b"c"), cache.derive("pw", b"c"))
+        self.assertEqual(cache.stats()["hits"], 2)
+
+
+class TestBulkOperations(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem(dedup=True)
+        self.fs.mkdir("/photos")
+        self.fs.write_file("/photos/old.jpg", "old")
+
+    def test_create_files_reports_per_item(self):
+        results = self.fs.create_files([
+            ("/photos/a.jpg", b"A" * 2000),
+            ("/photos/b.jpg", b"A" * 2000),
+            ("/photos/old.jpg", "new"),
+            ("/missing/c.jpg", "x"),
+            ("/photos", "x"),
+        ])
+        self.assertEqual([r["ok"] for r in results], [True, True, True, False, False])
+        self.assertIsNotNone(results[3]["error"])
+        self.assertEqual(self.fs.read_file("/photos/a.jpg"), b"A" * 2000)
+        self.assertEqual(self.fs.read_file("/photos/old.jpg"), b"new")
+        self.assertEqual(self.fs.storage_stats()["blocks"], 3)
+
+    def test_import_host_directory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, "sub"))
+            for rel, data in (("a.txt", b"alpha"), ("sub/b.txt", b"beta" * 500)):
+                with open(os.path.join(tmp, rel), "wb") as f:
+                    f.write(data)
+            results = self.fs.import_host_directory(tmp, "/photos", workers=4)
+        self.assertEqual([r["path"] for r in results], ["/photos/a.txt", "/photos/sub/b.txt"])
+        self.assertTrue(all(r["ok"] for r in results))
+        self.assertEqual(self.fs.read_file("/photos/sub/b.txt"), "beta" * 500)
+
+    def test_delete_many(self):
+        self.fs.create_files({f"/photos/{i}.jpg": str(i) * 600 for i in range(10)})
+        self.fs.mkdir("/photos/album")
+        self.fs.create_file("/photos/album/x.jpg", "x")
+        results = self.fs.delete_many(["/photos/0.jpg", "/photos/album", "/photos/nope.jpg", "/photos/album/x.jpg"])
+        self.assertEqual([r["ok"] for r in results], [True, True, False, False])
+        self.assertEqual(len(self.fs.root.subdirectories["photos"].files), 10)
+        results = self.fs.delete_many(["/photos"])
+        self.assertTrue(results[0]["ok"])
+        self.assertEqual(len(self.fs.inodes), 1)
+        self.assertEqual(self.fs.storage_stats()["blocks"], 0)
+
+    def test_batch_is_journaled_as_one_entry(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "fs.journal")
+            fs = FileSystem(journal=path)
+            entries = fs.journal_stats()["entries"]
+            fs.create_files((f"/{i}.txt", str(i)) for i in range(50))
+            # The stored blocks and the metadata go in one entry.
+            self.assertEqual(fs.journal_stats()["entries"], entries + 1)
+            fs.journal.close()
+            self.assertEqual(len(FileSystem(journal=path).root.files), 50)
+
+    def test_checkpoint_never_splits_a_batch(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "fs.journal")
+            fs = FileSystem(journal=path)
+            blocks = fs.storage_stats()["blocks"]
+            with fs.locks.exclusive():
+                worker = threading.Thread(target=fs.create_files, args=({"/x.txt": "x" * 80},))
+                worker.start()
+                worker.join(0.2)
+                # Nothing is stored while a checkpoint could be snapshotting.
+                self.assertEqual(fs.storage_stats()["blocks"], blocks)
+            worker.join()
+            fs.checkpoint()
+            fs.journal.close()
+            self.assertEqual(FileSystem(journal=path).read_file("/x.txt"), "x" * 80)
+
+
+class TestNameIndex(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem()
+        self.fs.mkdir("/Photos")
+        self.fs.mkdir("/Photos/2023")
+        for path in ("/Photos/IMG_0001.jpg", "/Photos/2023/img_0002.JPG", "/notes.txt", "/Photos/2023/beach.png"):
+            self.fs.write_file(path, "x")
+
+    def test_queries_ignore_case(self):
+        self.assertEqual(self.fs.find("img"), ["/Photos/2023/img_0002.JPG", "/Photos/IMG_0001.jpg"])
+        self.assertEqual(self.fs.find("0001.J"), ["/Photos/IMG_0001.jpg"])
+        self.assertEqual(self.fs.find("pho", mode="prefix"), ["/Photos"])
+        self.assertEqual(self.fs.find("hoto", mode="prefix"), [])
+        self.assertEqual(self.fs.find("*.jpg", kind="file"), ["/Photos/2023/img_0002.JPG", "/Photos/IMG_0001.jpg"])
+        self.assertEqual(self.fs.find("[bn]*"), ["/Photos/2023/beach.png", "/notes.txt"])
+        self.assertEqual(self.fs.find("20?3", kind="dir"), ["/Photos/2023"])
+
+    def test_index_follows_deletes_and_renames(self):
+        self.fs.delete_file("/notes.txt")
+        self.assertEqual(self.fs.find("notes"), [])
+        self.fs.rename("/Photos/2023", "/Trip")
+        self.assertEqual(self.fs.find("beach"), ["/Trip/beach.png"])
+        self.assertEqual(self.fs.read_file("/Trip/beach.png"), b"x")
+        self.assertIsNone(self.fs._lookup("/Photos/2023/beach.png"))
+        self.fs.rename("/Trip/beach.png", "/Photos/sea.png")
+        self.assertEqual(self.fs.find("*.png"), ["/Photos/sea.png"])
+
+    def test_rename_rejects_bad_targets(self):
+        with self.assertRaises(FileExistsError):
+            self.fs.rename("/notes.txt", "/Photos/IMG_0001.jpg")
+        with self.assertRaises(ValueError):
+            self.fs.rename("/Photos", "/Photos/2023/Photos")
+        with self.assertRaises(FileNotFoundError):
+            self.fs.rename("/nope.txt", "/other.txt")
+
+    def test_rename_updates_current_directory(self):
+        self.fs.cd("/Photos/2023")
+        self.fs.rename("/Photos", "/Pictures")
+        self.assertEqual(self.fs.get_current_path(), "root/Pictures/2023")
+        self.assertEqual(self.fs.read_file("beach.png"), b"x")
+
+    def test_index_is_rebuilt_on_recovery(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "fs.journal")
+            fs = FileSystem(journal=path)
+            fs.mkdir("/docs")
+            fs.write_file("/docs/report.txt", "r")
+            fs.rename("/docs/report.txt", "/docs/final.txt")
+            fs.journal.close()
+            self.assertEqual(FileSystem(journal=path).find("*.txt"), ["/docs/final.txt"])
+
+    def test_long_substring_uses_trigrams(self):
+        index = NameIndex()
+        index.add(1, "holiday_video.mp4")
+        index.add(2, "video_holiday.mp4")
+        self.assertEqual(index.substring("day_vid"), [1])
+        self.assertEqual(sorted(index.prefix("VIDEO_")), [2])
+        index.remove(1)
+        self.assertEqual(index.substring("holiday"), [2])
+
+    def test_short_queries_and_memory_per_name(self):
+        index = NameIndex()
+        for name in ("a", "ab", "abc", "b.txt", "cab"):
+            index.add(len(index) + 1, name)
+        self.assertEqual(sorted(index.prefix("a")), [1, 2, 3])
+        self.assertEqual(sorted(index.prefix("ab")), [2, 3])
+        self.assertEqual(sorted(index.prefix("abc")), [3])
+        self.assertEqual(sorted(index.substring("b")), [2, 3, 4, 5])
+        self.assertEqual(sorted(index.substring("ab")), [2, 3, 5])
+        index = NameIndex()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            for i in range(5000):
+                index.add(i + 1, f"photo_{i}.jpg")
+            per_name = (tracemalloc.get_traced_memory()[0] - before) / 5000
+        finally:
+            tracemalloc.stop()
+        # Only trigrams are posted, about 1.3 KB per name.
+        self.assertLess(per_name, 1600)
+
+
+class TestTreeTotals(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem(dedup=True)
+        self.fs.mkdir("/a")
+        self.fs.mkdir("/a/b")
+        self.fs.write_file("/a/one.txt", "x" * 1000)
+        self.fs.write_file("/a/b/two.txt", "y" * 100)
+
+    def walk_totals(self, directory):
+        size = blocks = files = 0
+        dirs = 1
+        for file in directory.files.values():
+            size += file.size
+            blocks += len(file.blocks)
+            files += 1
+        for subdir in directory.subdirectories.values():
+            sub = self.walk_totals(subdir)
+            size, blocks, files, dirs = size + sub[0], blocks + sub[1], files + sub[2], dirs + sub[3]
+        return size, blocks, files, dirs
+
+    def assert_consistent(self):
+        totals = self.fs.du("/")
+        self.assertEqual((totals["bytes"], totals["blocks"], totals["files"], totals["dirs"]),
+                         self.walk_totals(self.fs.root))
+
+    def test_totals_follow_every_mutation(self):
+        self.assertEqual(self.fs.du("/a"), {"bytes": 1100, "blocks": 3, "files": 2, "dirs": 2})
+        self.fs.append_file("/a/b/two.txt", "z" * 500)
+        self.fs.truncate_file("/a/one.txt", 10)
+        self.assertEqual(self.fs.du("/a/b")["bytes"], 600)
+        self.assert_consistent()
+        self.fs.write_file("/a/b/two.txt", "secret", password="pw")
+        self.fs.rename("/a/b", "/b")
+        self.assertEqual(self.fs.du("/a"), {"bytes": 10, "blocks": 1, "files": 1, "dirs": 1})
+        self.assert_consistent()
+        self.fs.delete_directory("/b")
+        self.fs.delete_file("/a/one.txt")
+        self.assertEqual(self.fs.du("/"), {"bytes": 0, "blocks": 0, "files": 0, "dirs": 2})
+
+    def test_stats_and_dir_info(self):
+        stats = self.fs.stats()
+        self.assertEqual((stats["files"], stats["folders"], stats["bytes"]), (2, 2, 1100))
+        self.assertEqual(stats["block_references"], self.fs.storage_stats()["references"])
+        info = self.fs.dir_info("/a")
+        self.assertEqual((info["files"], info["total_files"], info["total_size"]), (1, 2, 1100))
+
+    def test_totals_survive_recovery(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "fs.journal")
+            fs = FileSystem(journal=path)
+            fs.mkdir("/docs")
+            fs.write_file("/docs/a.txt", "a" * 700)
+            fs.journal.close()
+            self.assertEqual(FileSystem(journal=path).du("/docs"), {"bytes": 700, "blocks": 2, "files": 1, "dirs": 1})
+
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem()
+        self.fs.mkdir("/docs")
+        self.events = self.fs.subscribe()
+
+    def test_mutations_publish_events(self):
+        self.fs.write_file("/docs/a.txt", "a")
+        self.fs.append_file("/docs/a.txt", "b")
+        self.fs.rename("/docs/a.txt", "/b.txt")
+        self.fs.delete_directory("/docs")
+        self.assertEqual(self.events.drain(), [
+            Event(CREATED, "/docs/a.txt"),
+            Event(DIR_CHANGED, "/docs"),
+            Event(MOVED, "/b.txt", "/docs/a.txt"),
+            Event(DIR_CHANGED, "/"),
+            Event(DELETED, "/docs"),
+        ])
+
+    def test_events_wait_for_the_journal_commit(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fs = FileSystem(journal=os.path.join(tmp, "fs.journal"))
+            fs.write_file("/a.txt", "a")
+            events = fs.subscribe()
+            early, published = [], []
+            commit = fs.journal.commit
+
+            def checked_commit():
+                early.extend(events.drain())
+                commit()
+                published.extend(event.kind for event in events.drain())
+
+            fs.journal.commit = checked_commit
+            fs.mkdir("/docs")
+            fs.create_files([("/docs/b.txt", b"b")])
+            fs.delete_file("/a.txt")
+            fs.delete_many(["/docs/b.txt"])
+            self.assertEqual(early, [])
+            self.assertEqual(published, [CREATED, DIR_CHANGED] * 2 + [DELETED, DIR_CHANGED] * 2)
+            fs.close()
+
+    def test_pending_events_are_coalesced(self):
+        for i in range(20):
+            self.fs.write_file("/docs/log.txt", str(i))
+        self.fs.write_file("/docs/tmp.txt", "x")
+        self.fs.delete_file("/docs/tmp.txt")
+        self.assertEqual(self.events.drain(), [Event(CREATED, "/docs/log.txt"), Event(DIR_CHANGED, "/docs")])
+        self.fs.write_file("/docs/log.txt", "again")
+        self.assertEqual(self.events.get(timeout=0), Event(MODIFIED, "/docs/log.txt"))
+
+    def test_subscriptions_are_scoped_to_a_subtree(self):
+        docs = self.fs.subscribe("/docs")
+        self.fs.mkdir("/other")
+        self.fs.write_file("/docs/a.txt", "a")
+        self.assertEqual([e.path for e in docs.drain()], ["/docs/a.txt", "/docs"])
+        self.fs.rename("/docs", "/papers")
+        self.assertEqual(docs.drain(), [Event(MOVED, "/papers", "/docs")])
+        docs.close()
+        self.fs.write_file("/papers/b.txt", "b")
+        self.assertEqual(docs.drain(), [])
+
+    def test_get_waits_for_another_thread(self):
+        threading.Timer(0.05, self.fs.create_file, ("/docs/late.txt",)).start()
+        self.assertEqual(self.events.get(timeout=5), Event(CREATED, "/docs/late.txt"))
+
+
+class TestQuotas(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem()
+        self.fs.user_manager.register("camera", "pw")
+        self.fs.set_quota("camera", hard_bytes=1000, hard_inodes=3)
+
+    def test_usage_follows_writes_and_deletes(self):
+        with self.fs.as_user("camera"):
+            self.fs.mkdir("/cam")
+            self.fs.write_file("/cam/a.jpg", b"a" * 400)
+            self.fs.append_file("/cam/a.jpg", b"b" * 100)
+        self.fs.write_file("/mine.txt", "x" * 5000)
+        usage = self.fs.quota_usage("camera")
+        self.assertEqual((usage["bytes"], usage["inodes"]), (500, 2))
+        self.fs.truncate_file("/cam/a.jpg", 100)
+        self.assertEqual(self.fs.quota_usage("camera")["bytes"], 100)
+        self.fs.delete_directory("/cam")
+        self.assertEqual(self.fs.quota_usage("camera")["inodes"], 0)
+
+    def test_hard_limits_are_enforced(self):
+        with self.fs.as_user("camera"):
+            self.fs.write_file("/a.jpg", b"a" * 900)
+            with self.assertRaises(QuotaExceededError):
+                self.fs.write_file("/b.jpg", b"b" * 200)
+            self.assertIsNone(self.fs._lookup("/b.jpg"))
+            with self.assertRaises(QuotaExceededError):
+                self.fs.append_file("/a.jpg", b"a" * 200)
+            self.fs.create_file("/b.jpg")
+            self.fs.create_file("/c.jpg")
+            with self.assertRaises(QuotaExceededError):
+                self.fs.create_file("/d.jpg")
+            results = self.fs.create_files([("/c.jpg", b"c" * 100), ("/c.jpg", b"c" * 200)])
+            self.assertEqual([r["ok"] for r in results], [True, False])
+        # Overwrites are charged to the file's owner, whoever writes them.
+        with self.assertRaises(QuotaExceededError):
+            self.fs.write_file("/a.jpg", b"a" * 2000)
+        self.fs.write_file("/a.jpg", b"small")
+        self.assertEqual(self.fs.quota_usage("camera")["bytes"], 105)
+
+    def test_soft_limit_grace_period(self):
+        fs = FileSystem(quota_grace=0.05)
+        fs.user_manager.register("bob", "pw")
+        fs.set_quota("bob", soft_bytes=100)
+        with fs.as_user("bob"):
+            fs.write_file("/a", b"a" * 150)
+            self.assertTrue(fs.quota_usage("bob")["over_soft"])
+            fs.append_file("/a", b"a")
+            time.sleep(0.1)
+            with self.assertRaises(QuotaExceededError):
+                fs.append_file("/a", b"a")
+            fs.truncate_file("/a", 10)
+            fs.append_file("/a", b"a")
+
+    def test_owners_survive_recovery(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "fs.journal")
+            fs = FileSystem(journal=path)
+            fs.user_manager.register("camera", "pw")
+            with fs.as_user("camera"):
+                fs.write_file("/a.jpg", b"a" * 300)
+            fs.journal.close()
+            recovered = FileSystem(journal=path)
+            recovered.user_manager.register("camera", "pw")
+            self.assertEqual(recovered.quota_usage("camera")["bytes"], 300)
+
+
+class TestImages(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "fs.img")
+        fs = FileSystem(dedup=True, compression="zlib")
+        fs.user_manager.register("camera", "pw")
+        fs.mkdir("/photos")
+        with fs.as_user("camera"):
+            fs.write_file("/photos/a.jpg", os.urandom(3000))
+        fs.write_file("/photos/b.txt", "hello " * 500)
+        fs.write_file("/photos/copy.txt", "hello " * 500)
+        fs.write_file("/secret.txt", "top secret", password="pw")
+        self.original = fs
+        fs.export_image(self.path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def assert_same_content(self, fs):
+        for path in ("/photos/a.jpg", "/photos/b.txt", "/photos/copy.txt"):
+            self.assertEqual(fs.read_file(path), self.original.read_file(path))
+        self.assertEqual(fs.read_file("/secret.txt", password="pw"), "top secret")
+        self.assertEqual(fs.stats(), self.original.stats())
+        self.assertEqual(fs.storage_stats()["dedup_ratio"], self.original.storage_stats()["dedup_ratio"])
+
+    def test_eager_import(self):
+        fs = FileSystem.from_image(self.path, lazy=False)
+        self.assert_same_content(fs)
+        self.assertIsInstance(fs.storage.blocks, dict)
+
+    def test_lazy_mount_reads_blocks_on_demand(self):
+        fs = FileSystem.from_image(self.path)
+        self.assertEqual(fs.storage.compressor.codec, "zlib")
+        self.assert_same_content(fs)
+        fs.user_manager.register("camera", "pw")
+        self.assertEqual(fs.quota_usage("camera")["bytes"], 3000)
+        fs.close()
+
+    def test_changes_after_mount_leave_the_image_alone(self):
+        fs = FileSystem.from_image(self.path)
+        fs.write_file("/photos/b.txt", "changed")
+        fs.delete_file("/photos/a.jpg")
+        fs.write_file("/photos/new.txt", "hello " * 500)
+        self.assertEqual(fs.read_file("/photos/copy.txt"), "hello " * 500)
+        copy = os.path.join(self.tmpdir.name, "copy.img")
+        fs.export_image(copy)
+        fs.close()
+        self.assertEqual(FileSystem.from_image(self.path).read_file("/photos/b.txt"), "hello " * 500)
+        reopened = FileSystem.from_image(copy)
+        self.assertEqual(reopened.read_file("/photos/b.txt"), "changed")
+        self.assertIsNone(reopened._lookup("/photos/a.jpg"))
+        self.assertEqual(reopened.storage_stats()["blocks"], fs.storage_stats()["blocks"])
+
+    def test_mount_keeps_the_digest_index(self):
+        fs = FileSystem.from_image(self.path)
+        blocks = fs.storage_stats()["blocks"]
+        fs.write_file("/photos/again.txt", "hello " * 500)
+        self.assertEqual(fs.storage_stats()["blocks"], blocks)
+        fs.close()
+
+    def test_images_without_dedup_store_no_digests(self):
+        fs = FileSystem(compression="zlib")
+        fs.write_file("/a.txt", "hello " * 500)
+        fs.write_file("/b.jpg", os.urandom(1000))
+        path = os.path.join(self.tmpdir.name, "plain.img")
+        fs.export_image(path)
+        image = Image(path)
+        self.assertEqual(image.digests(), {})
+        self.assertEqual(image._digest_offset, image.data_offset)
+        image.close()
+        mounted = FileSystem.from_image(path)
+        self.assertEqual(mounted.read_file("/a.txt"), "hello " * 500)
+        self.assertEqual(mounted.storage_stats(), fs.storage_stats())
+        mounted.close()
+
+    def test_rejects_other_files(self):
+        with open(self.path, "r+b") as f:
+            f.write(b"garbage!")
+        with self.assertRaises(ValueError):
+            FileSystem.from_image(self.path)
+
+
+class TestMmapBackend(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "blocks.img")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_reads_are_views_into_the_mapping(self):
+        backend = MmapBackend(self.path, capacity=4)
+        backend[1] = b"hello"
+        view = backend[1]
+        self.assertIsInstance(view, memoryview)
+        self.assertEqual(view, b"hello")
+        view.release()
+        backend.close()
+
+    def test_blocks_survive_reopen(self):
+        fs = FileSystem(backend=MmapBackend(self.path, capacity=8))
+        fs.create_file("a.txt", "hello" * 300)
+        block_ids = fs.current_directory.files["a.txt"].blocks
+        fs.close()
+
+        backend = MmapBackend(self.path, capacity=8)
+        self.assertEqual(len(backend), len(block_ids))
+        self.assertEqual(bytes(backend[block_ids[0]]), (b"hello" * 300)[:BLOCK_SIZE])
+        backend.close()
+
+    def test_full_block_file_raises(self):
+        backend = MmapBackend(self.path, capacity=1)
+        backend[1] = b"1"
+        with self.assertRaises(OSError):
+            backend[2] = b"2"
+        backend.close()
+
+    def test_failed_writes_leave_no_inode(self):
+        fs = FileSystem(backend=MmapBackend(self.path, capacity=1))
+        fs.user_manager.register("camera", "pw")
+        fs.set_quota("camera", hard_inodes=2)
+        fs.write_file("/a.txt", "a")
+        files = fs.stats()["files"]
+        with fs.as_user("camera"):
+            for name in ("b0.txt", "b1.txt", "b2.txt"):
+                with self.assertRaises(OSError):
+                    fs.create_file("/" + name, "b")
+            with self.assertRaises(OSError):
+                fs.write_file("/secret.txt", "s", password="pw")
+        self.assertEqual(fs.find("b"), [])
+        self.assertEqual(fs.stats()["files"], files)
+        self.assertEqual(fs.quota_usage("camera")["inodes"], 0)
+        fs.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
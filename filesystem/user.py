@@ -1,8 +1,9 @@
 import hashlib
 
 class User:
-    def __init__(self, username, password, is_admin=False):
+    def __init__(self, username, password, is_admin=False, uid=0):
         self.username = username
+        self.uid = uid
         self.password_hash = self._hash_password(password)
         self.is_admin = is_admin
 
@@ -21,7 +22,8 @@ class UserManager:
     def register(self, username, password, is_admin=False):
         if username in self.users:
             raise ValueError("Username already exists.")
-        self.users[username] = User(username, password, is_admin)
+        # uid 0 is the system; users are numbered from 1.
+        self.users[username] = User(username, password, is_admin, uid=len(self.users) + 1)
 
     def login(self, username, password):
         user = self.users.get(username)
@@ -38,6 +40,12 @@ class UserManager:
 
     def get_current_user(self):
         return self.current_user
+
+    def uid_of(self, username):
+        user = self.users.get(username)
+        if user is None:
+            raise ValueError(f"Unknown user '{username}'.")
+        return user.uid
     
 
 class PermissionManager:
@@ -62,43 +70,3 @@ class PermissionManager:
     def remove(self, path):
         if path in self.permissions:
             del self.permissions[path]
-
-import base64
-from hashlib import sha256
-from cryptography.fernet import Fernet
-
-class EncryptedFile:
-    def __init__(self, name, content="", key=None, owner=None):
-        if key is None:
-            raise ValueError("Key must be provided for EncryptedFile.")
-        self.name = name
-        self.key = key
-        self.fernet = Fernet(self.key)
-        self.owner = owner
-        self._encrypted = self.fernet.encrypt(content.encode() if isinstance(content, str) else content)
-
-    def read(self):
-        return self.fernet.decrypt(self._encrypted)
-
-    def write(self, content):
-        data = content.encode() if isinstance(content, str) else content
-        self._encrypted = self.fernet.encrypt(data)
-
-    def get_size(self):
-        return len(self._encrypted)
-
-    @staticmethod
-    def derive_key_from_password(password):
-        hash = sha256(password.encode()).digest()
-        return base64.urlsafe_b64encode(hash)
-
-    def check_password(self, password):
-        try:
-            key = self.derive_key_from_password(password)
-            if key != self.key:
-                return False
-            fernet = Fernet(key)
-            fernet.decrypt(self._encrypted)
-            return True
-        except Exception:
-            return False
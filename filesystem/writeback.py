@@ -0,0 +1,23 @@
+import threading
+
+
+class WriteBackFlusher(threading.Thread):
+    """Writes a BlockStorage's dirty blocks to its backend in batches,
+    every ``interval`` seconds or as soon as the dirty limit is reached."""
+
+    def __init__(self, storage, interval=1.0):
+        super().__init__(daemon=True)
+        self.storage = storage
+        self.interval = interval
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.storage.dirty_event.wait(self.interval)
+            self.storage.dirty_event.clear()
+            self.storage.flush()
+
+    def stop(self):
+        self.running = False
+        self.storage.dirty_event.set()
+        self.join()
@@ -0,0 +1,399 @@
+import time
+from array import array
+from heapq import heappop, heappush
+from typing import Iterable
+
+__all__ = ["RegionAllocator", "FirstFitAllocator", "NextFitAllocator", "BestFitAllocator",
+           "BuddyAllocator", "POLICIES", "make_allocator", "replay", "compare"]
+
+
+class RegionAllocator:
+    """Hands out contiguous runs of frames and measures how well it does.
+
+    ``allocate(n)`` returns the first frame of a run of ``n`` free frames,
+    or None; ``free(start)`` returns the run. ``allocated`` maps the start
+    of every live run to its length in frames. Subclasses implement
+    ``_allocate``, ``_free`` and ``largest_free_block``.
+    """
+
+    name = ""
+
+    def __init__(self, total_frames: int):
+        self.total_frames = total_frames
+        self.allocated: dict[int, int] = {}
+        self.used = 0
+        self.allocations = 0
+        self.failures = 0
+        self.alloc_ns = 0
+        self.max_alloc_ns = 0
+
+    def allocate(self, num_frames: int) -> int | None:
+        if num_frames <= 0:
+            raise ValueError("Allocation size must be positive.")
+        start_ns = time.perf_counter_ns()
+        start = self._allocate(num_frames)
+        elapsed = time.perf_counter_ns() - start_ns
+        self.alloc_ns += elapsed
+        self.max_alloc_ns = max(self.max_alloc_ns, elapsed)
+        if start is None:
+            self.failures += 1
+            return None
+        self.allocations += 1
+        self.used += self.allocated[start]
+        return start
+
+    def free(self, start: int) -> None:
+        size = self.allocated.get(start)
+        if size is None:
+            raise KeyError(f"No allocation starts at frame {start}.")
+        self._free(start)
+        self.used -= size
+
+    def _allocate(self, num_frames: int) -> int | None:
+        raise NotImplementedError
+
+    def _free(self, start: int) -> None:
+        raise NotImplementedError
+
+    def largest_free_block(self) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> dict[str, float]:
+        free = self.total_frames - self.used
+        largest = self.largest_free_block()
+        attempts = self.allocations + self.failures
+        return {
+            "policy": self.name,
+            "total": self.total_frames,
+            "used": self.used,
+            "free": free,
+            "largest_free_block": largest,
+            # Share of free memory that cannot serve a request as large as all of it.
+            "external_fragmentation": 1 - largest / free if free else 0.0,
+            # Frames handed out beyond what was asked for (buddy rounding).
+            "internal_fragmentation": 1 - self.requested_live / self.used if self.used else 0.0,
+            "allocations": self.allocations,
+            "failures": self.failures,
+            "mean_alloc_ns": self.alloc_ns / attempts if attempts else 0.0,
+            "max_alloc_ns": self.max_alloc_ns,
+        }
+
+    @property
+    def requested_live(self) -> int:
+        return self.used
+
+
+class _RunTree:
+    """Segment tree over frames. Each node knows the longest free run in
+    its range and the free runs touching either end, so the leftmost run
+    of ``n`` free frames at or after a position is found, and a range is
+    marked used or free, in O(log frames)."""
+
+    FREE, USED = 1, 2
+
+    def __init__(self, size: int):
+        self.size = size
+        # Children inherit the root's FREE state lazily, so nothing else is built up front.
+        nodes = 2 << max(size - 1, 1).bit_length()
+        self.best = array('i', [0]) * nodes
+        self.prefix = array('i', [0]) * nodes
+        self.suffix = array('i', [0]) * nodes
+        self.pending = array('b', [0]) * nodes
+        if size:
+            self._fill(1, 0, size - 1, self.FREE)
+
+    def _fill(self, node: int, lo: int, hi: int, state: int) -> None:
+        length = hi - lo + 1 if state == self.FREE else 0
+        self.best[node] = self.prefix[node] = self.suffix[node] = length
+        self.pending[node] = state
+
+    def _push(self, node: int, lo: int, mid: int, hi: int) -> None:
+        state = self.pending[node]
+        if state:
+            self._fill(2 * node, lo, mid, state)
+            self._fill(2 * node + 1, mid + 1, hi, state)
+            self.pending[node] = 0
+
+    def mark(self, start: int, end: int, state: int, node: int = 1, lo: int = 0, hi: int | None = None) -> None:
+        """Mark frames ``start`` to ``end`` (inclusive) FREE or USED."""
+        if hi is None:
+            hi = self.size - 1
+        if start <= lo and hi <= end:
+            self._fill(node, lo, hi, state)
+            return
+        mid = (lo + hi) // 2
+        self._push(node, lo, mid, hi)
+        left = 2 * node
+        if start <= mid:
+            self.mark(start, end, state, left, lo, mid)
+        if end > mid:
+            self.mark(start, end, state, left + 1, mid + 1, hi)
+        prefix, suffix, best = self.prefix, self.suffix, self.best
+        left_prefix, right_suffix = prefix[left], suffix[left + 1]
+        prefix[node] = left_prefix + prefix[left + 1] if left_prefix == mid - lo + 1 else left_prefix
+        suffix[node] = right_suffix + suffix[left] if right_suffix == hi - mid else right_suffix
+        best[node] = max(best[left], best[left + 1], suffix[left] + prefix[left + 1])
+
+    def find(self, length: int, after: int = 0, node: int = 1, lo: int = 0, hi: int | None = None) -> int | None:
+        """First frame ``p >= after`` starting ``length`` free frames."""
+        if hi is None:
+            hi = self.size - 1
+        if hi < after or self.best[node] < length:
+            return None
+        if lo == hi:
+            return lo
+        if self.pending[node] == self.FREE:
+            start = max(lo, after)
+            return start if hi - start + 1 >= length else None
+        mid = (lo + hi) // 2
+        self._push(node, lo, mid, hi)
+        found = self.find(length, after, 2 * node, lo, mid)
+        if found is not None:
+            return found
+        # A run crossing into the right half, starting no earlier than ``after``.
+        tail = min(self.suffix[2 * node], mid + 1 - after)
+        if tail > 0 and tail + self.prefix[2 * node + 1] >= length:
+            return mid + 1 - tail
+        return self.find(length, after, 2 * node + 1, mid + 1, hi)
+
+    def largest(self) -> int:
+        return self.best[1]
+
+
+class FirstFitAllocator(RegionAllocator):
+    """Lowest-addressed run that fits."""
+
+    name = "first_fit"
+
+    def __init__(self, total_frames: int):
+        super().__init__(total_frames)
+        self._runs = _RunTree(total_frames)
+
+    def _allocate(self, num_frames: int) -> int | None:
+        start = self._runs.find(num_frames)
+        if start is not None:
+            self._take(start, num_frames)
+        return start
+
+    def _take(self, start: int, num_frames: int) -> None:
+        self._runs.mark(start, start + num_frames - 1, _RunTree.USED)
+        self.allocated[start] = num_frames
+
+    def _free(self, start: int) -> None:
+        self._runs.mark(start, start + self.allocated.pop(start) - 1, _RunTree.FREE)
+
+    def largest_free_block(self) -> int:
+        return self._runs.largest()
+
+
+class NextFitAllocator(FirstFitAllocator):
+    """First run that fits at or after the end of the previous
+    allocation, wrapping around to the start."""
+
+    name = "next_fit"
+
+    def __init__(self, total_frames: int):
+        super().__init__(total_frames)
+        self._cursor = 0
+
+    def _allocate(self, num_frames: int) -> int | None:
+        start = self._runs.find(num_frames, self._cursor)
+        if start is None and self._cursor:
+            start = self._runs.find(num_frames)
+        if start is not None:
+            self._take(start, num_frames)
+            self._cursor = (start + num_frames) % self.total_frames
+        return start
+
+
+class BestFitAllocator(RegionAllocator):
+    """Smallest free region that fits, lowest address first on ties.
+
+    Free regions are indexed by start and by end (for coalescing) and
+    bucketed by size, each bucket a heap of starts. A Fenwick tree counts
+    the free regions of every size, so the smallest size that fits and the
+    largest free region are found in O(log frames). Heap entries of
+    regions that were merged away are skipped when they surface.
+    """
+
+    name = "best_fit"
+
+    def __init__(self, total_frames: int):
+        super().__init__(total_frames)
+        self._starts: dict[int, int] = {}
+        self._ends: dict[int, int] = {}
+        self._buckets: dict[int, list[int]] = {}
+        self._live: dict[int, int] = {}
+        self._sizes = array('i', [0]) * (total_frames + 1)
+        self._regions = 0
+        if total_frames:
+            self._add_region(0, total_frames)
+
+    def _count(self, size: int, delta: int) -> None:
+        self._regions += delta
+        live = self._live.get(size, 0) + delta
+        if live:
+            self._live[size] = live
+        else:
+            # No region of this size is left, so every heap entry is stale.
+            del self._live[size]
+            del self._buckets[size]
+        tree = self._sizes
+        while size < len(tree):
+            tree[size] += delta
+            size += size & -size
+
+    def _smaller(self, size: int) -> int:
+        """Number of free regions shorter than ``size``."""
+        tree, total = self._sizes, 0
+        size -= 1
+        while size > 0:
+            total += tree[size]
+            size -= size & -size
+        return total
+
+    def _size_of_rank(self, rank: int) -> int:
+        """Size of the ``rank``-th smallest free region (1-based)."""
+        tree, size = self._sizes, 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            if size + step < len(tree) and tree[size + step] < rank:
+                size += step
+                rank -= tree[size]
+            step >>= 1
+        return size + 1
+
+    def _add_region(self, start: int, size: int) -> None:
+        heappush(self._buckets.setdefault(size, []), start)
+        self._starts[start] = size
+        self._ends[start + size] = start
+        self._count(size, 1)
+
+    def _remove_region(self, start: int) -> int:
+        size = self._starts.pop(start)
+        del self._ends[start + size]
+        self._count(size, -1)
+        return size
+
+    def _allocate(self, num_frames: int) -> int | None:
+        if num_frames > self.total_frames:
+            return None
+        rank = self._smaller(num_frames) + 1
+        if rank > self._regions:
+            return None
+        size = self._size_of_rank(rank)
+        bucket = self._buckets[size]
+        start = heappop(bucket)
+        while self._starts.get(start) != size:
+            start = heappop(bucket)
+        self._remove_region(start)
+        if size > num_frames:
+            self._add_region(start + num_frames, size - num_frames)
+        self.allocated[start] = num_frames
+        return start
+
+    def _free(self, start: int) -> None:
+        size = self.allocated.pop(start)
+        end = start + size
+        if end in self._starts:
+            size += self._remove_region(end)
+        if start in self._ends:
+            before = self._ends[start]
+            size += self._remove_region(before)
+            start = before
+        self._add_region(start, size)
+
+    def largest_free_block(self) -> int:
+        return self._size_of_rank(self._regions) if self._regions else 0
+
+
+class BuddyAllocator(RegionAllocator):
+    """Binary buddy allocator.
+
+    Requests are rounded up to a power of two. Free blocks of each order
+    sit in their own free list; a block is split on demand and merged
+    with its buddy again when both are free. Memory that is not a power
+    of two in size is seeded as several maximal aligned blocks.
+    """
+
+    name = "buddy"
+
+    def __init__(self, total_frames: int):
+        super().__init__(total_frames)
+        self.max_order = max(total_frames.bit_length() - 1, 0)
+        self._free_lists: list[dict[int, None]] = [{} for _ in range(self.max_order + 1)]
+        self._requested: dict[int, int] = {}
+        self._requested_live = 0
+        start = 0
+        while start < total_frames:
+            order = min((start & -start).bit_length() - 1 if start else self.max_order,
+                        (total_frames - start).bit_length() - 1)
+            self._free_lists[order][start] = None
+            start += 1 << order
+
+    def _allocate(self, num_frames: int) -> int | None:
+        order = (num_frames - 1).bit_length()
+        for found in range(order, self.max_order + 1):
+            if self._free_lists[found]:
+                break
+        else:
+            return None
+        start, _ = self._free_lists[found].popitem()
+        while found > order:
+            found -= 1
+            self._free_lists[found][start + (1 << found)] = None
+        self.allocated[start] = 1 << order
+        self._requested[start] = num_frames
+        self._requested_live += num_frames
+        return start
+
+    def _free(self, start: int) -> None:
+        order = self.allocated.pop(start).bit_length() - 1
+        self._requested_live -= self._requested.pop(start)
+        while order < self.max_order:
+            buddy = start ^ (1 << order)
+            if buddy not in self._free_lists[order]:
+                break
+            del self._free_lists[order][buddy]
+            start = min(start, buddy)
+            order += 1
+        self._free_lists[order][start] = None
+
+    def largest_free_block(self) -> int:
+        for order in range(self.max_order, -1, -1):
+            if self._free_lists[order]:
+                return 1 << order
+        return 0
+
+    @property
+    def requested_live(self) -> int:
+        return self._requested_live
+
+
+POLICIES = {cls.name: cls for cls in (FirstFitAllocator, NextFitAllocator, BestFitAllocator, BuddyAllocator)}
+
+
+def make_allocator(policy: str, total_frames: int) -> RegionAllocator:
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown allocation policy '{policy}'.")
+    return POLICIES[policy](total_frames)
+
+
+def replay(allocator: RegionAllocator, operations: Iterable[tuple]) -> RegionAllocator:
+    """Run a workload of ``("alloc", key, frames)`` and ``("free", key)``
+    operations; frees of keys whose allocation failed are ignored."""
+    starts: dict = {}
+    for op in operations:
+        if op[0] == "alloc":
+            start = allocator.allocate(op[2])
+            if start is not None:
+                starts[op[1]] = start
+        elif op[1] in starts:
+            allocator.free(starts.pop(op[1]))
+    return allocator
+
+
+def compare(total_frames: int, operations: Iterable[tuple], policies: Iterable[str] = POLICIES) -> dict[str, dict]:
+    """``stats()`` of every policy after replaying the same workload."""
+    operations = list(operations)
+    return {policy: replay(make_allocator(policy, total_frames), operations).stats() for policy in policies}
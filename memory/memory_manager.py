@@ -1,78 +1,399 @@
+import re
+import sys
+from array import array
 from threading import Lock
 from utils.config import MEMORY_SIZE
+from memory.allocators import RegionAllocator, make_allocator
+from memory.replacement import Replacer, make_replacer
+from memory.swap import SwapFile
+from memory.tlb import TLB
 
-__all__ = ["PageFault", "MemoryManager"]
+__all__ = ["PageFault", "MemoryManager", "FREE", "PROCESS", "FILE"]
 
 class PageFault(Exception):
     pass
 
 
+# Page keys are (PROCESS, pid, page_no) or (FILE, file_id, page_no).
+PROCESS, FILE = 0, 1
+
+# Owner recorded in the frame table for a free frame.
+FREE = -1
+
+# One match per run of equal 4-byte frame table entries; matches start
+# where the previous one ended, so they stay aligned to entries.
+_RUN = re.compile(rb'(.{4})\1*', re.DOTALL)
+# Most significant byte of an entry: 0xFF only for FREE, as owners are never negative.
+_MSB = 3 if sys.byteorder == "little" else 0
+_SNAPSHOT_CHARS = bytes.maketrans(bytes(range(256)), b'#' * 255 + b'.')
+
+
 class MemoryManager:
+    """Frame allocator.
+
+    The frame table ``pages`` is an ``array('i')`` of owners, FREE for a
+    free frame. Free frames are tracked without scanning it: frames at or
+    above ``_high_water`` have never been handed out, and frames returned
+    since sit on the ``_free`` stack and are reused first. Allocating or
+    freeing costs O(pages), assigning consecutive frames by slice, and
+    per-owner frame counts are kept as frames change hands, so
+    ``stats()`` and ``histogram()`` never touch the frame table.
+    ``runs()`` and ``snapshot()`` scan it in C. ``version`` changes on
+    every allocation or release, so observers can skip redrawing an
+    unchanged memory map.
+
+    With a ``policy`` (see ``allocators.POLICIES``) every request is
+    instead served as one contiguous run of frames by that allocator, and
+    ``allocator_stats()`` reports its fragmentation and latency. A buddy
+    allocator's rounding-up is marked used in the frame map but not mapped.
+
+    With a ``swap`` area, memory is paged on demand instead. Processes may
+    allocate more pages than there are frames, up to frames plus swap
+    slots. Allocating only reserves the pages; the first access through
+    ``translate``, ``read`` or ``write`` faults a page in zero-filled,
+    evicting a page chosen by the ``replacement`` policy (a name from
+    ``REPLACEMENT_POLICIES`` or a Replacer) to swap when frames run out,
+    and later accesses fault evicted pages back in. Dirty pages are
+    written to swap on eviction; clean zero pages are dropped and
+    zero-filled again. ``paging_stats()`` reports the counters.
+
+    A ``tlb`` caches translations in front of the page tables. It is told
+    about context switches through ``context_switch``, and loses a page's
+    translation when the page is evicted or its process deallocated.
+    """
+
     FRAME_SIZE = 512
 
-    def __init__(self):
-        self.total_frames: int = MEMORY_SIZE
-        self._frames: list[int | None] = [None] * self.total_frames
-        self._page_tables: dict[int, list[int]] = {}
-        self._file_pages: dict[int, list[int]] = {}
+    def __init__(self, size: int | None = None, policy: str | None = None, swap: SwapFile | None = None,
+                 replacement: str | Replacer = "lru", tlb: TLB | None = None):
+        self.total_frames: int = MEMORY_SIZE if size is None else size
+        self.allocator: RegionAllocator | None = None if policy is None else make_allocator(policy, self.total_frames)
+        self.swap = swap
+        self.tlb = tlb
+        self.replacer: Replacer | None = None
+        if swap is not None:
+            if self.allocator is not None:
+                raise ValueError("Demand paging cannot be combined with a contiguous allocation policy.")
+            self.replacer = make_replacer(replacement) if isinstance(replacement, str) else replacement
+            self._memory = bytearray(self.total_frames * self.FRAME_SIZE)
+            self._dirty = bytearray(self.total_frames)
+            self._slots: dict[tuple[int, int, int], int] = {}
+            self._committed = 0
+            self.hits = self.faults = self.evictions = self.zero_fills = self.swap_ins = self.swap_outs = 0
+        self._frames = array('i', [FREE]) * self.total_frames
+        self._owner_frames: dict[int, int] = {}
+        self._runs: tuple[int, list[tuple[int, int, int]]] | None = None
+        self._free = array('q')
+        self._high_water = 0
+        # Entries of a paged table are None while the page is not resident.
+        self._page_tables: dict[int, list[int | None]] = {}
+        self._file_pages: dict[int, list[int | None]] = {}
         self._lock = Lock()
+        self.version = 0
 
     @property
-    def pages(self) -> list[int | None]:
+    def pages(self) -> array:
         return self._frames
 
+    @property
+    def free_frames(self) -> int:
+        if self.allocator is not None:
+            return self.total_frames - self.allocator.used
+        return len(self._free) + self.total_frames - self._high_water
+
     def stats(self) -> dict[str, int]:
-        used = sum(1 for f in self._frames if f is not None)
+        free = self.free_frames
 
         return {
             "total": self.total_frames,
-            "used": used,
-            "free": self.total_frames - used,
+            "used": self.total_frames - free,
+            "free": free,
         }
 
-    def allocate(self, pid: int, num_pages: int) -> bool:
+    def histogram(self) -> dict[int, int]:
+        """Frames held by each owner."""
         with self._lock:
-            free_frames = [i for i, owner in enumerate(self._frames) if owner is None]
-            if len(free_frames) < num_pages:
-                return False
+            return dict(self._owner_frames)
+
+    def runs(self) -> list[tuple[int, int, int]]:
+        """Run-length encoded frame table: ``(owner, first frame, length)``
+        for every run of frames with the same owner, FREE included."""
+        with self._lock:
+            if self._runs is None or self._runs[0] != self.version:
+                raw = self._frames.tobytes()
+                self._runs = (self.version, [(int.from_bytes(m.group(1), sys.byteorder, signed=True),
+                                              m.start() // 4, (m.end() - m.start()) // 4)
+                                             for m in _RUN.finditer(raw)])
+            return list(self._runs[1])
+
+    def _assign(self, start: int, length: int, owner: int) -> None:
+        """Give frames ``start`` to ``start + length`` to ``owner``, or
+        release them if it is FREE; a released run has a single owner."""
+        if owner == FREE:
+            self._count(self._frames[start], -length)
+        else:
+            self._count(owner, length)
+        self._frames[start:start + length] = array('i', [owner]) * length
+
+    def _count(self, owner: int, frames: int) -> None:
+        count = self._owner_frames.get(owner, 0) + frames
+        if count:
+            self._owner_frames[owner] = count
+        else:
+            self._owner_frames.pop(owner, None)
+
+    def allocator_stats(self) -> dict[str, float] | None:
+        with self._lock:
+            return None if self.allocator is None else self.allocator.stats()
+
+    def tlb_stats(self) -> dict[str, float] | None:
+        with self._lock:
+            return None if self.tlb is None else self.tlb.stats()
+
+    def context_switch(self, pid: int) -> None:
+        if self.tlb is not None:
+            with self._lock:
+                self.tlb.switch(pid)
+
+    def paging_stats(self) -> dict[str, float] | None:
+        if self.swap is None:
+            return None
+        with self._lock:
+            references = self.hits + self.faults
+            return {
+                "policy": self.replacer.name,
+                "committed": self._committed,
+                "resident": self.total_frames - self.free_frames,
+                "swapped": len(self._slots),
+                "swap_free": self.swap.free_slots,
+                "hits": self.hits,
+                "faults": self.faults,
+                "fault_rate": self.faults / references if references else 0.0,
+                "evictions": self.evictions,
+                "zero_fills": self.zero_fills,
+                "swap_ins": self.swap_ins,
+                "swap_outs": self.swap_outs,
+            }
+
+    def _take(self, owner: int, num_pages: int) -> list[int] | None:
+        if self.allocator is not None:
+            return self._take_region(owner, num_pages)
+        if num_pages > self.free_frames:
+            return None
+        reused = min(num_pages, len(self._free))
+        taken = self._free[len(self._free) - reused:].tolist()
+        del self._free[len(self._free) - reused:]
+        fresh = num_pages - reused
+        for idx in taken:
+            self._frames[idx] = owner
+        self._count(owner, reused)
+        if fresh:
+            self._assign(self._high_water, fresh, owner)
+            taken.extend(range(self._high_water, self._high_water + fresh))
+            self._high_water += fresh
+        self.version += 1
+        return taken
+
+    def _take_region(self, owner: int, num_pages: int) -> list[int] | None:
+        if not num_pages:
+            return []
+        start = self.allocator.allocate(num_pages)
+        if start is None:
+            return None
+        self._assign(start, self.allocator.allocated[start], owner)
+        self.version += 1
+        return list(range(start, start + num_pages))
+
+    def _release(self, owner: int, frames: list[int]) -> None:
+        if self.allocator is not None:
+            for idx in frames:
+                size = self.allocator.allocated.get(idx)
+                if size is not None:
+                    self.allocator.free(idx)
+                    self._assign(idx, size, FREE)
+            self.version += 1
+            return
+        if frames and frames[-1] - frames[0] == len(frames) - 1 and frames == list(range(frames[0], frames[-1] + 1)):
+            self._assign(frames[0], len(frames), FREE)
+        else:
+            for idx in frames:
+                self._frames[idx] = FREE
+            self._count(owner, -len(frames))
+        self._free.extend(frames)
+        self.version += 1
+
+    def _tables(self, kind: int) -> dict[int, list[int | None]]:
+        return self._page_tables if kind == PROCESS else self._file_pages
+
+    def _evict(self) -> int:
+        key = self.replacer.evict()
+        kind, owner, page_no = key
+        table = self._tables(kind)[owner]
+        frame = table[page_no]
+        if self._dirty[frame]:
+            # Committed pages never outnumber frames plus slots, so a slot is free.
+            slot = self.swap.alloc()
+            start = frame * self.FRAME_SIZE
+            self.swap.write(slot, self._memory[start:start + self.FRAME_SIZE])
+            self._slots[key] = slot
+            self.swap_outs += 1
+        table[page_no] = None
+        if kind == PROCESS and self.tlb is not None:
+            self.tlb.invalidate(owner, page_no)
+        self.evictions += 1
+        return frame
 
-            taken = free_frames[:num_pages]
-            for idx in taken:
-                self._frames[idx] = pid
+    def _page_in(self, key: tuple[int, int, int], table: list[int | None]) -> int:
+        kind, owner, page_no = key
+        if self.free_frames:
+            frame = self._take(owner, 1)[0]
+        else:
+            frame = self._evict()
+            self._count(self._frames[frame], -1)
+            self._count(owner, 1)
+            self._frames[frame] = owner
+        start = frame * self.FRAME_SIZE
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            self._memory[start:start + self.FRAME_SIZE] = bytes(self.FRAME_SIZE)
+            self._dirty[frame] = 0
+            self.zero_fills += 1
+        else:
+            # The slot is released at once, so the page is dirty until written back.
+            self._memory[start:start + self.FRAME_SIZE] = self.swap.read(slot)
+            self.swap.free(slot)
+            self._dirty[frame] = 1
+            self.swap_ins += 1
+        table[page_no] = frame
+        self.replacer.insert(key)
+        self.version += 1
+        return frame
 
+    def _reserve(self, kind: int, owner: int, num_pages: int) -> bool:
+        if self._committed + num_pages > self.total_frames + self.swap.slots:
+            return False
+        self._committed += num_pages
+        # Not resident until first touched; _access zero-fills them then.
+        self._tables(kind).setdefault(owner, []).extend([None] * num_pages)
+        return True
+
+    def _release_pages(self, kind: int, owner: int, table: list[int | None]) -> None:
+        resident = 0
+        for page_no, frame in enumerate(table):
+            key = (kind, owner, page_no)
+            if frame is None:
+                slot = self._slots.pop(key, None)
+                if slot is not None:
+                    self.swap.free(slot)
+            else:
+                self.replacer.discard(key)
+                self._frames[frame] = FREE
+                self._free.append(frame)
+                resident += 1
+        self._count(owner, -resident)
+        self._committed -= len(table)
+        self.version += 1
+
+    def allocate(self, pid: int, num_pages: int) -> bool:
+        with self._lock:
+            if self.swap is not None:
+                return self._reserve(PROCESS, pid, num_pages)
+            taken = self._take(pid, num_pages)
+            if taken is None:
+                return False
             self._page_tables.setdefault(pid, []).extend(taken)
             return True
-    
+
     def allocate_file(self, file_id: int, num_pages: int) -> bool:
         with self._lock:
-            free_frames = [i for i, owner in enumerate(self._frames) if owner is None]
-            if len(free_frames) < num_pages:
+            if self.swap is not None:
+                return self._reserve(FILE, file_id, num_pages)
+            taken = self._take(file_id, num_pages)
+            if taken is None:
                 return False
-
-            taken = free_frames[:num_pages]
-            for idx in taken:
-                self._frames[idx] = file_id  
             self._file_pages.setdefault(file_id, []).extend(taken)
             return True
 
     def deallocate(self, pid: int) -> None:
         with self._lock:
-            if pid not in self._page_tables:
+            frames = self._page_tables.pop(pid, None)
+            if frames is None:
                 return
-            for idx in self._page_tables[pid]:
-                if all(idx not in pages for pages in self._file_pages.values()):
-                    self._frames[idx] = None
-            del self._page_tables[pid]
-    
+            if self.tlb is not None:
+                self.tlb.flush(pid)
+            if self.swap is not None:
+                self._release_pages(PROCESS, pid, frames)
+            else:
+                self._release(pid, frames)
+
     def deallocate_file(self, file_id: int) -> None:
         with self._lock:
-            if file_id not in self._file_pages:
+            frames = self._file_pages.pop(file_id, None)
+            if frames is None:
                 return
-            for idx in self._file_pages[file_id]:
-                self._frames[idx] = None
-            del self._file_pages[file_id]
+            if self.swap is not None:
+                self._release_pages(FILE, file_id, frames)
+            else:
+                self._release(file_id, frames)
+
+    def _access(self, pid: int, logical_address: int, write: bool) -> int:
+        page_no, offset = divmod(logical_address, self.FRAME_SIZE)
+        tlb = self.tlb
+        frame = None
+        if tlb is not None:
+            tlb.switch(pid)
+            frame = tlb.lookup(pid, page_no)
+        if frame is None:
+            table = self._page_tables.get(pid)
+            if table is None or not 0 <= page_no < len(table):
+                raise PageFault(f"Page fault in PID {pid}: page {page_no} not mapped")
+            frame = table[page_no]
+            if frame is None:
+                self.faults += 1
+                frame = self._page_in((PROCESS, pid, page_no), table)
+            elif self.swap is not None:
+                self.hits += 1
+                self.replacer.access((PROCESS, pid, page_no))
+            if tlb is not None:
+                tlb.insert(pid, page_no, frame)
+        elif self.swap is not None:
+            self.hits += 1
+            self.replacer.access((PROCESS, pid, page_no))
+        if write:
+            self._dirty[frame] = 1
+        return frame * self.FRAME_SIZE + offset
+
+    def read(self, pid: int, logical_address: int, length: int) -> bytes:
+        """Read ``length`` bytes of a paged process's memory."""
+        if self.swap is None:
+            raise RuntimeError("Memory contents are only kept when paging to swap.")
+        with self._lock:
+            chunks = []
+            while length > 0:
+                n = min(length, self.FRAME_SIZE - logical_address % self.FRAME_SIZE)
+                start = self._access(pid, logical_address, False)
+                chunks.append(bytes(self._memory[start:start + n]))
+                logical_address += n
+                length -= n
+            return b''.join(chunks)
+
+    def write(self, pid: int, logical_address: int, data: bytes) -> None:
+        """Write ``data`` into a paged process's memory."""
+        if self.swap is None:
+            raise RuntimeError("Memory contents are only kept when paging to swap.")
+        with self._lock:
+            view = memoryview(data)
+            while view:
+                n = min(len(view), self.FRAME_SIZE - logical_address % self.FRAME_SIZE)
+                start = self._access(pid, logical_address, True)
+                self._memory[start:start + n] = view[:n]
+                logical_address += n
+                view = view[n:]
 
     def translate(self, pid: int, logical_address: int) -> int:
+        if self.swap is not None or self.tlb is not None:
+            with self._lock:
+                return self._access(pid, logical_address, False)
         page_no, offset = divmod(logical_address, self.FRAME_SIZE)
         try:
             frame_idx = self._page_tables[pid][page_no]
@@ -82,11 +403,5 @@ class MemoryManager:
 
     def snapshot(self) -> str:
         with self._lock:
-            rows = []
-            for i in range(0, self.total_frames, 16):
-                chunk = ''.join('.' if f is None else '#' for f in self._frames[i:i+16])
-                rows.append(chunk)
-            return '\n'.join(rows)
-
-
-
+            marks = self._frames.tobytes()[_MSB::4].translate(_SNAPSHOT_CHARS).decode()
+            return '\n'.join(marks[i:i + 16] for i in range(0, self.total_frames, 16))
@@ -0,0 +1,213 @@
+import heapq
+from collections import OrderedDict
+from typing import Hashable, Sequence
+
+__all__ = ["Replacer", "FIFOReplacer", "LRUReplacer", "ClockReplacer", "SecondChanceReplacer",
+           "OptimalReplacer", "REPLACEMENT_POLICIES", "make_replacer", "simulate"]
+
+
+class Replacer:
+    """Chooses which resident page to evict.
+
+    Pages are identified by any hashable key. ``insert`` is called when a
+    page is loaded into a frame, ``access`` on every reference to a
+    resident page, ``discard`` when a resident page is freed and
+    ``evict`` to pick (and forget) a victim.
+    """
+
+    name = ""
+
+    def insert(self, key: Hashable) -> None:
+        raise NotImplementedError
+
+    def access(self, key: Hashable) -> None:
+        pass
+
+    def discard(self, key: Hashable) -> None:
+        raise NotImplementedError
+
+    def evict(self) -> Hashable:
+        raise NotImplementedError
+
+
+class FIFOReplacer(Replacer):
+    """Evicts the page that was loaded first."""
+
+    name = "fifo"
+
+    def __init__(self):
+        self._queue: OrderedDict = OrderedDict()
+
+    def insert(self, key: Hashable) -> None:
+        self._queue[key] = None
+
+    def discard(self, key: Hashable) -> None:
+        self._queue.pop(key, None)
+
+    def evict(self) -> Hashable:
+        return self._queue.popitem(last=False)[0]
+
+
+class LRUReplacer(FIFOReplacer):
+    """Evicts the page referenced longest ago."""
+
+    name = "lru"
+
+    def access(self, key: Hashable) -> None:
+        self._queue.move_to_end(key)
+
+
+class SecondChanceReplacer(FIFOReplacer):
+    """FIFO that moves a referenced page to the back of the queue once
+    instead of evicting it."""
+
+    name = "second_chance"
+
+    def insert(self, key: Hashable) -> None:
+        self._queue[key] = False
+
+    def access(self, key: Hashable) -> None:
+        self._queue[key] = True
+
+    def evict(self) -> Hashable:
+        while True:
+            key, referenced = self._queue.popitem(last=False)
+            if not referenced:
+                return key
+            self._queue[key] = False
+
+
+class ClockReplacer(Replacer):
+    """Second chance without moving pages: a hand sweeps a fixed ring,
+    clearing reference bits until it finds a page without one. A loaded
+    page takes the ring slot its victim left."""
+
+    name = "clock"
+
+    def __init__(self):
+        self._ring: list = []
+        self._referenced: list[bool] = []
+        self._slot: dict = {}
+        self._empty: list[int] = []
+        self._hand = 0
+
+    def insert(self, key: Hashable) -> None:
+        if self._empty:
+            slot = self._empty.pop()
+            self._ring[slot] = key
+            self._referenced[slot] = False
+        else:
+            slot = len(self._ring)
+            self._ring.append(key)
+            self._referenced.append(False)
+        self._slot[key] = slot
+
+    def access(self, key: Hashable) -> None:
+        self._referenced[self._slot[key]] = True
+
+    def discard(self, key: Hashable) -> None:
+        slot = self._slot.pop(key, None)
+        if slot is not None:
+            self._ring[slot] = None
+            self._empty.append(slot)
+
+    def evict(self) -> Hashable:
+        if not self._slot:
+            raise KeyError("No resident pages.")
+        ring, referenced = self._ring, self._referenced
+        while True:
+            slot = self._hand
+            self._hand = (slot + 1) % len(ring)
+            key = ring[slot]
+            if key is None:
+                continue
+            if referenced[slot]:
+                referenced[slot] = False
+                continue
+            self.discard(key)
+            return key
+
+
+class OptimalReplacer(Replacer):
+    """Belady's OPT: evicts the page whose next reference is farthest away.
+
+    It needs the whole reference string in advance, so it serves as an
+    offline baseline: every ``insert`` and ``access`` must follow
+    ``trace`` in order. References past the end of ``trace`` are treated
+    as never used again.
+    """
+
+    name = "opt"
+
+    def __init__(self, trace: Sequence[Hashable]):
+        self._next_use = [0] * len(trace)
+        last: dict = {}
+        for i in range(len(trace) - 1, -1, -1):
+            self._next_use[i] = last.get(trace[i], len(trace))
+            last[trace[i]] = i
+        self._position = 0
+        self._current: dict = {}
+        self._heap: list = []
+
+    def _reference(self, key: Hashable) -> None:
+        i = self._position
+        self._position += 1
+        next_use = self._next_use[i] if i < len(self._next_use) else len(self._next_use)
+        self._current[key] = next_use
+        # Stale heap entries are skipped in evict().
+        heapq.heappush(self._heap, (-next_use, i, key))
+
+    def insert(self, key: Hashable) -> None:
+        self._reference(key)
+
+    def access(self, key: Hashable) -> None:
+        self._reference(key)
+
+    def discard(self, key: Hashable) -> None:
+        self._current.pop(key, None)
+
+    def evict(self) -> Hashable:
+        while self._heap:
+            next_use, _, key = heapq.heappop(self._heap)
+            if self._current.get(key) == -next_use:
+                del self._current[key]
+                return key
+        raise KeyError("No resident pages.")
+
+
+REPLACEMENT_POLICIES = {cls.name: cls for cls in (FIFOReplacer, LRUReplacer, ClockReplacer,
+                                                    SecondChanceReplacer, OptimalReplacer)}
+
+
+def make_replacer(policy: str, trace: Sequence[Hashable] | None = None) -> Replacer:
+    if policy not in REPLACEMENT_POLICIES:
+        raise ValueError(f"Unknown replacement policy '{policy}'.")
+    if policy == OptimalReplacer.name:
+        if trace is None:
+            raise ValueError("The optimal policy needs the reference string in advance.")
+        return OptimalReplacer(trace)
+    return REPLACEMENT_POLICIES[policy]()
+
+
+def simulate(policy: str, frames: int, trace: Sequence[Hashable]) -> dict[str, float]:
+    """Run a reference string through ``frames`` frames under ``policy``."""
+    replacer = make_replacer(policy, trace)
+    resident: set = set()
+    faults = evictions = 0
+    for key in trace:
+        if key in resident:
+            replacer.access(key)
+            continue
+        faults += 1
+        if len(resident) >= frames:
+            resident.remove(replacer.evict())
+            evictions += 1
+        resident.add(key)
+        replacer.insert(key)
+    return {
+        "policy": policy,
+        "references": len(trace),
+        "faults": faults,
+        "evictions": evictions,
+        "fault_rate": faults / len(trace) if trace else 0.0,
+    }
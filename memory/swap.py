@@ -0,0 +1,54 @@
+import mmap
+from array import array
+
+__all__ = ["SwapFile"]
+
+
+class SwapFile:
+    """Swap area of ``slots`` page-sized slots.
+
+    The slots live in a memory-mapped file at ``path``, or in anonymous
+    memory if ``path`` is None. Free slots sit on a stack, so taking and
+    returning one is O(1).
+    """
+
+    def __init__(self, slots: int, page_size: int, path: str | None = None):
+        self.slots = slots
+        self.page_size = page_size
+        self.path = path
+        size = max(slots, 1) * page_size
+        self._file = None
+        if path is None:
+            self._map = mmap.mmap(-1, size)
+        else:
+            self._file = open(path, 'w+b')
+            self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+        self._free = array('q', range(slots - 1, -1, -1))
+        self.reads = 0
+        self.writes = 0
+
+    @property
+    def free_slots(self) -> int:
+        return len(self._free)
+
+    def alloc(self) -> int | None:
+        return self._free.pop() if self._free else None
+
+    def free(self, slot: int) -> None:
+        self._free.append(slot)
+
+    def write(self, slot: int, data: bytes) -> None:
+        start = slot * self.page_size
+        self._map[start:start + self.page_size] = data
+        self.writes += 1
+
+    def read(self, slot: int) -> bytes:
+        start = slot * self.page_size
+        self.reads += 1
+        return self._map[start:start + self.page_size]
+
+    def close(self) -> None:
+        self._map.close()
+        if self._file is not None:
+            self._file.close()
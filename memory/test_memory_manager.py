@@ -0,0 +1,295 @@
+import random
+import unittest
+from memory.allocators import BuddyAllocator, POLICIES, compare, make_allocator
+from memory.memory_manager import FREE, MemoryManager, PageFault
+from memory.replacement import REPLACEMENT_POLICIES, simulate
+from memory.swap import SwapFile
+from memory.tlb import TLB
+
+
+class TestFrameAllocator(unittest.TestCase):
+    def setUp(self):
+        self.memory = MemoryManager(size=16)
+
+    def test_allocate_and_translate(self):
+        self.assertTrue(self.memory.allocate(1, 3))
+        self.assertEqual(self.memory.pages[:4].tolist(), [1, 1, 1, FREE])
+        self.assertEqual(self.memory.translate(1, 2 * MemoryManager.FRAME_SIZE + 7), 2 * MemoryManager.FRAME_SIZE + 7)
+        with self.assertRaises(PageFault):
+            self.memory.translate(1, 3 * MemoryManager.FRAME_SIZE)
+
+    def test_freed_frames_are_reused(self):
+        self.memory.allocate(1, 4)
+        self.memory.allocate_file(2, 4)
+        self.memory.deallocate(1)
+        self.assertEqual(self.memory.stats(), {"total": 16, "used": 4, "free": 12})
+        self.assertTrue(self.memory.allocate(3, 6))
+        self.assertEqual(sorted(self.memory._page_tables[3]), [0, 1, 2, 3, 8, 9])
+        self.assertEqual(self.memory.pages[4:8].tolist(), [2, 2, 2, 2])
+
+    def test_allocation_fails_when_full(self):
+        self.assertTrue(self.memory.allocate(1, 16))
+        self.assertFalse(self.memory.allocate(2, 1))
+        self.memory.deallocate_file(99)
+        self.memory.deallocate(1)
+        self.assertEqual(self.memory.stats()["free"], 16)
+        self.assertEqual(self.memory.pages.count(FREE), 16)
+
+    def test_version_tracks_changes(self):
+        version = self.memory.version
+        self.memory.allocate(1, 1)
+        self.assertNotEqual(self.memory.version, version)
+        version = self.memory.version
+        self.memory.allocate(2, 100)
+        self.assertEqual(self.memory.version, version)
+
+    def test_histogram_runs_and_snapshot(self):
+        self.memory.allocate(1, 3)
+        self.memory.allocate_file(2, 2)
+        self.memory.allocate(3, 1)
+        self.memory.deallocate_file(2)
+        self.memory.allocate(1, 1)
+        self.assertEqual(self.memory.histogram(), {1: 4, 3: 1})
+        self.assertEqual(self.memory.runs(), [(1, 0, 3), (FREE, 3, 1), (1, 4, 1), (3, 5, 1), (FREE, 6, 10)])
+        self.assertEqual(self.memory.snapshot(), "###.##..........")
+        self.memory.deallocate(1)
+        self.assertEqual(self.memory.histogram(), {3: 1})
+        self.assertEqual(self.memory.runs()[1], (3, 5, 1))
+
+    def test_large_memory(self):
+        memory = MemoryManager(size=2_000_000)
+        for pid in range(1000):
+            memory.allocate(pid, 3)
+        self.assertEqual(memory.stats()["used"], 3000)
+        self.assertEqual(memory.histogram()[999], 3)
+        self.assertEqual(memory.runs()[-1], (FREE, 3000, 2_000_000 - 3000))
+        self.assertEqual(memory.snapshot().count("#"), 3000)
+
+
+class TestRegionAllocators(unittest.TestCase):
+    def test_fit_policies(self):
+        starts = {}
+        for policy in ("first_fit", "best_fit", "next_fit"):
+            allocator = make_allocator(policy, 20)
+            a, b, c = allocator.allocate(6), allocator.allocate(2), allocator.allocate(4)
+            allocator.free(a)
+            allocator.free(c)
+            starts[policy] = allocator.allocate(3)
+            self.assertEqual(allocator.largest_free_block(), 6 if policy == "next_fit" else 12)
+        # Free: [0, 6) and [8, 20); the cursor of next-fit sits at 12.
+        self.assertEqual(starts, {"first_fit": 0, "best_fit": 0, "next_fit": 12})
+        best = make_allocator("best_fit", 20)
+        a, b, c, d = (best.allocate(n) for n in (5, 1, 3, 1))
+        best.free(a)
+        best.free(c)
+        self.assertEqual(best.allocate(3), c)
+
+    def test_best_fit_skips_merged_regions(self):
+        best = make_allocator("best_fit", 12)
+        a, b, c, d = (best.allocate(n) for n in (2, 2, 2, 6))
+        best.free(c)
+        best.free(a)
+        # [0, 2) and [4, 6) tie; the lower one goes first.
+        self.assertEqual(best.allocate(2), a)
+        best.free(a)
+        best.free(b)
+        self.assertEqual(best.largest_free_block(), 6)
+        # The 2-frame holes were merged away, so the 6-frame region serves this.
+        self.assertEqual(best.allocate(2), 0)
+        self.assertEqual(best.allocate(4), 2)
+        self.assertIsNone(best.allocate(1))
+        best.free(d)
+        self.assertEqual(best.largest_free_block(), 6)
+        self.assertIsNone(best.allocate(13))
+
+    def test_buddy_splits_and_coalesces(self):
+        buddy = BuddyAllocator(16)
+        a = buddy.allocate(3)
+        b = buddy.allocate(1)
+        self.assertEqual(buddy.allocated[a], 4)
+        self.assertEqual(buddy.stats()["used"], 5)
+        self.assertAlmostEqual(buddy.stats()["internal_fragmentation"], 1 / 5)
+        self.assertEqual(buddy.largest_free_block(), 8)
+        buddy.free(a)
+        buddy.free(b)
+        self.assertEqual(buddy.largest_free_block(), 16)
+        self.assertEqual(buddy.allocate(16), 0)
+        self.assertIsNone(buddy.allocate(1))
+        odd = BuddyAllocator(12)
+        self.assertEqual(sorted((odd.allocate(8), odd.allocate(4))), [0, 8])
+        self.assertIsNone(odd.allocate(1))
+
+    def test_random_workload_matches_frame_map(self):
+        rng = random.Random(7)
+        for policy in POLICIES:
+            allocator = make_allocator(policy, 300)
+            frames = [None] * 300
+            live = []
+            for step in range(2000):
+                if live and rng.random() < 0.45:
+                    start = live.pop(rng.randrange(len(live)))
+                    size = allocator.allocated[start]
+                    allocator.free(start)
+                    frames[start:start + size] = [None] * size
+                    continue
+                n = rng.randint(1, 24)
+                start = allocator.allocate(n)
+                if start is None:
+                    continue
+                size = allocator.allocated[start]
+                self.assertTrue(all(f is None for f in frames[start:start + size]), policy)
+                self.assertLessEqual(start + size, 300)
+                frames[start:start + size] = [step] * size
+                live.append(start)
+            free = frames.count(None)
+            self.assertEqual(allocator.stats()["free"], free, policy)
+            if policy != "buddy":
+                longest = max(len(run) for run in ''.join('.' if f is None else '#' for f in frames).split('#'))
+                self.assertEqual(allocator.largest_free_block(), longest, policy)
+
+    def test_compare_reports_metrics(self):
+        workload = [("alloc", i, 1 + i % 5) for i in range(40)] + [("free", i) for i in range(0, 40, 2)]
+        report = compare(64, workload)
+        self.assertEqual(set(report), set(POLICIES))
+        for stats in report.values():
+            self.assertGreater(stats["allocations"], 0)
+            self.assertGreaterEqual(stats["mean_alloc_ns"], 0)
+            self.assertLessEqual(stats["largest_free_block"], stats["free"])
+            self.assertTrue(0 <= stats["external_fragmentation"] < 1)
+
+    def test_memory_manager_policy(self):
+        memory = MemoryManager(size=16, policy="buddy")
+        self.assertTrue(memory.allocate(1, 3))
+        self.assertTrue(memory.allocate_file(2, 4))
+        self.assertEqual(memory.stats()["used"], 8)
+        self.assertEqual(memory.pages.count(1), 4)
+        self.assertEqual(len(memory._page_tables[1]), 3)
+        memory.deallocate(1)
+        self.assertEqual(memory.pages.count(1), 0)
+        self.assertFalse(memory.allocate(3, 13))
+        self.assertEqual(memory.allocator_stats()["failures"], 1)
+        self.assertIsNone(MemoryManager(size=4).allocator_stats())
+        with self.assertRaises(ValueError):
+            MemoryManager(size=4, policy="worst_fit")
+
+
+class TestDemandPaging(unittest.TestCase):
+    def paged(self, replacement="lru", frames=4, slots=8):
+        return MemoryManager(size=frames, swap=SwapFile(slots, MemoryManager.FRAME_SIZE), replacement=replacement)
+
+    def test_overcommit_and_swap(self):
+        memory = self.paged()
+        self.assertTrue(memory.allocate(1, 3))
+        memory.write(1, 0, b"first page")
+        memory.write(1, MemoryManager.FRAME_SIZE - 2, b"span")
+        self.assertTrue(memory.allocate(2, 6))
+        # Allocating only reserves pages: PID 1 keeps the two it touched.
+        stats = memory.paging_stats()
+        self.assertEqual((stats["resident"], stats["evictions"], stats["swap_outs"]), (2, 0, 0))
+        for page in range(6):
+            memory.write(2, page * MemoryManager.FRAME_SIZE, b"x")
+        self.assertEqual(memory.stats()["free"], 0)
+        # The pages of PID 1 were evicted; the two it wrote went to swap.
+        self.assertEqual(memory.read(1, 0, 10), b"first page")
+        self.assertEqual(memory.read(1, MemoryManager.FRAME_SIZE - 2, 4), b"span")
+        stats = memory.paging_stats()
+        self.assertEqual(stats["committed"], 9)
+        self.assertGreaterEqual(stats["swap_outs"], 2)
+        self.assertEqual(stats["swap_ins"], 2)
+        self.assertEqual(stats["zero_fills"], 8)
+        self.assertEqual(stats["faults"], 10)
+        self.assertFalse(memory.allocate(3, 4))
+        with self.assertRaises(PageFault):
+            memory.translate(1, 3 * MemoryManager.FRAME_SIZE)
+        memory.deallocate(1)
+        memory.deallocate(2)
+        self.assertEqual(memory.stats()["free"], 4)
+        self.assertEqual(memory.swap.free_slots, 8)
+        self.assertEqual(memory.paging_stats()["committed"], 0)
+
+    def test_clean_zero_pages_are_not_written(self):
+        memory = self.paged(frames=2, slots=4)
+        memory.allocate(1, 6)
+        stats = memory.paging_stats()
+        self.assertEqual((stats["resident"], stats["evictions"], stats["swap_outs"]), (0, 0, 0))
+        for page in range(6):
+            self.assertEqual(memory.read(1, page * MemoryManager.FRAME_SIZE, 4), bytes(4))
+        stats = memory.paging_stats()
+        self.assertEqual((stats["zero_fills"], stats["evictions"], stats["swap_outs"]), (6, 4, 0))
+
+    def test_policies_under_manager(self):
+        for policy in ("fifo", "lru", "clock", "second_chance"):
+            memory = self.paged(policy, frames=3, slots=8)
+            memory.allocate(1, 6)
+            for page in (0, 1, 2, 0, 3, 0, 4, 5, 0, 1):
+                memory.write(1, page * MemoryManager.FRAME_SIZE, bytes([page + 1]))
+            for page in range(6):
+                self.assertEqual(memory.read(1, page * MemoryManager.FRAME_SIZE, 1), bytes([page + 1]), policy)
+            self.assertEqual(memory.paging_stats()["policy"], policy)
+
+    def test_simulated_policies(self):
+        trace = [7, 0, 1, 2, 0, 3, 0, 4, 2, 3, 0, 3, 2, 1, 2, 0, 1, 7, 0, 1]
+        faults = {policy: simulate(policy, 3, trace)["faults"] for policy in REPLACEMENT_POLICIES}
+        self.assertEqual(faults["fifo"], 15)
+        self.assertEqual(faults["lru"], 12)
+        self.assertEqual(faults["opt"], 9)
+        self.assertEqual(faults["clock"], faults["second_chance"])
+        self.assertEqual(min(faults.values()), faults["opt"])
+        with self.assertRaises(ValueError):
+            MemoryManager(size=2, swap=SwapFile(2, 512), replacement="opt")
+
+
+class TestTLB(unittest.TestCase):
+    def test_hits_misses_and_lru_sets(self):
+        tlb = TLB(entries=4, ways=2)
+        for vpn in (0, 2):
+            self.assertIsNone(tlb.lookup(1, vpn))
+            tlb.insert(1, vpn, vpn + 10)
+        self.assertEqual(tlb.lookup(1, 0), 10)
+        # Pages 0, 2 and 4 share set 0; page 2 is the least recently used.
+        tlb.insert(1, 4, 14)
+        self.assertIsNone(tlb.lookup(1, 2))
+        self.assertEqual(tlb.lookup(1, 4), 14)
+        stats = tlb.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["evictions"]), (2, 3, 1))
+        self.assertEqual(stats["avg_cycles"], (5 + 3 * 20) / 5)
+        with self.assertRaises(ValueError):
+            TLB(entries=6, ways=4)
+
+    def test_random_replacement_keeps_sets_bounded(self):
+        tlb = TLB(entries=8, ways=8, replacement="random", seed=1)
+        for vpn in range(100):
+            tlb.insert(1, vpn, vpn)
+        self.assertEqual(sum(tlb.lookup(1, vpn) is not None for vpn in range(100)), 8)
+
+    def test_asid_and_flush_on_switch(self):
+        for asid in (True, False):
+            memory = MemoryManager(size=16, tlb=TLB(entries=8, ways=2, asid=asid))
+            memory.allocate(1, 2)
+            memory.allocate(2, 2)
+            for pid in (1, 2, 1):
+                memory.translate(pid, 0)
+            stats = memory.tlb_stats()
+            self.assertEqual(stats["switches"], 3)
+            self.assertEqual(stats["hits"], 1 if asid else 0)
+            self.assertEqual(stats["flushes"], 0 if asid else 2)
+
+    def test_invalidated_on_deallocate_and_eviction(self):
+        memory = MemoryManager(size=16, tlb=TLB(entries=8, ways=2))
+        memory.allocate(1, 2)
+        memory.translate(1, 0)
+        memory.deallocate(1)
+        with self.assertRaises(PageFault):
+            memory.translate(1, 0)
+        paged = MemoryManager(size=2, swap=SwapFile(4, MemoryManager.FRAME_SIZE), tlb=TLB(entries=4, ways=4))
+        paged.allocate(1, 2)
+        paged.write(1, 0, b"a")
+        paged.allocate(2, 2)
+        paged.write(2, 0, b"b")
+        paged.write(2, MemoryManager.FRAME_SIZE, b"c")
+        self.assertEqual(paged.read(1, 0, 1), b"a")
+        self.assertGreaterEqual(paged.tlb_stats()["invalidations"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
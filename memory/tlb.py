@@ -0,0 +1,114 @@
+import random
+from collections import OrderedDict
+
+__all__ = ["TLB"]
+
+
+class TLB:
+    """Set-associative translation lookaside buffer model.
+
+    ``entries`` translations are split into sets of ``ways`` entries
+    (``ways == entries`` is fully associative); a page number maps to set
+    ``vpn % sets`` and a full set evicts its least recently used entry or
+    a random one. With ``asid`` entries are tagged with their PID and
+    survive context switches; without it the whole TLB is flushed when
+    the running PID changes. ``avg_cycles`` in ``stats()`` prices a hit
+    at ``hit_cycles`` and a miss at ``hit_cycles + miss_cycles`` for the
+    page-table walk.
+    """
+
+    def __init__(self, entries: int = 64, ways: int = 4, replacement: str = "lru", asid: bool = True,
+                 hit_cycles: int = 1, miss_cycles: int = 20, seed: int | None = None):
+        if replacement not in ("lru", "random"):
+            raise ValueError(f"Unknown TLB replacement '{replacement}'.")
+        if ways <= 0 or entries % ways:
+            raise ValueError("TLB entries must be a positive multiple of its ways.")
+        self.entries = entries
+        self.ways = ways
+        self.replacement = replacement
+        self.asid = asid
+        self.hit_cycles = hit_cycles
+        self.miss_cycles = miss_cycles
+        self.num_sets = entries // ways
+        self._sets: list[OrderedDict] = [OrderedDict() for _ in range(self.num_sets)]
+        self._random = random.Random(seed)
+        self.context: int | None = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.invalidations = 0
+        self.switches = 0
+
+    def _tag(self, pid: int, vpn: int):
+        return (pid, vpn) if self.asid else vpn
+
+    def lookup(self, pid: int, vpn: int) -> int | None:
+        """Cached frame of page ``vpn`` of ``pid``, or None on a miss."""
+        entries = self._sets[vpn % self.num_sets]
+        tag = self._tag(pid, vpn)
+        frame = entries.get(tag)
+        if frame is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.replacement == "lru":
+            entries.move_to_end(tag)
+        return frame
+
+    def insert(self, pid: int, vpn: int, frame: int) -> None:
+        entries = self._sets[vpn % self.num_sets]
+        tag = self._tag(pid, vpn)
+        if tag not in entries and len(entries) >= self.ways:
+            if self.replacement == "lru":
+                entries.popitem(last=False)
+            else:
+                del entries[self._random.choice(list(entries))]
+            self.evictions += 1
+        entries[tag] = frame
+
+    def invalidate(self, pid: int, vpn: int) -> None:
+        """Drop the translation of one page, e.g. after it was evicted."""
+        if not self.asid and pid != self.context:
+            return
+        if self._sets[vpn % self.num_sets].pop(self._tag(pid, vpn), None) is not None:
+            self.invalidations += 1
+
+    def flush(self, pid: int | None = None) -> None:
+        """Drop every translation, or only those of ``pid``."""
+        if pid is not None and self.asid:
+            for entries in self._sets:
+                for tag in [tag for tag in entries if tag[0] == pid]:
+                    del entries[tag]
+                    self.invalidations += 1
+            return
+        if pid is not None and pid != self.context:
+            return
+        for entries in self._sets:
+            entries.clear()
+        self.flushes += 1
+
+    def switch(self, pid: int) -> None:
+        """Make ``pid`` the running context."""
+        if pid == self.context:
+            return
+        if not self.asid and self.context is not None:
+            self.flush()
+        self.context = pid
+        self.switches += 1
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": self.entries,
+            "ways": self.ways,
+            "asid": self.asid,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "flushes": self.flushes,
+            "invalidations": self.invalidations,
+            "switches": self.switches,
+            "avg_cycles": (lookups * self.hit_cycles + self.misses * self.miss_cycles) / lookups if lookups else 0.0,
+        }
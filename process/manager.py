@@ -6,9 +6,11 @@ ENERGY_USAGE = {
     "Music": 3,
 }
 class ProcessManager:
-    def __init__(self, scheduler, start_pid=1):
+    def __init__(self, scheduler, start_pid=1, memory=None):
         self.scheduler = scheduler
         self.pid_counter = start_pid
+        # Told about context switches so its TLB can flush or switch ASID.
+        self.memory = memory
 
     def create_process(self, app_name: str, priority=0) -> PCB:
         base_energy = ENERGY_USAGE.get(app_name, 5)
@@ -41,6 +43,8 @@ class ProcessManager:
         pcb = self.scheduler.next_process()
         if pcb:
             pcb.state = "RUNNING"
+            if self.memory is not None:
+                self.memory.context_switch(pcb.pid)
             print(f"Switched to: {pcb}")
             return pcb
         print("No process to switch to.")
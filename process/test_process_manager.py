@@ -41,6 +41,13 @@ class TestProcessManager(unittest.TestCase):
         self.assertIs(switched_pcb, pcb)
         self.assertEqual(switched_pcb.state, "RUNNING")
 
+    def test_switch_process_notifies_memory(self):
+        memory = MagicMock()
+        manager = ProcessManager(self.mock_scheduler, memory=memory)
+        self.mock_scheduler.next_process.return_value = PCB(pid=7, app_name="TestApp", state="READY", priority=0)
+        manager.switch_process()
+        memory.context_switch.assert_called_once_with(7)
+
     def test_switch_process_no_process(self):
         self.mock_scheduler.next_process.return_value = None
         switched_pcb = self.process_manager.switch_process()
@@ -1,7 +1,9 @@
+from memory.memory_manager import FREE
+
 def display_pcb(pcb):
     print(pcb)
 
 def display_memory(memory_manager):
     for i, page in enumerate(memory_manager.pages):
-        if page is not None:
+        if page != FREE:
             print(f"Page {i}: PID {page}")
@@ -6,8 +6,8 @@ from tkinter import ttk, messagebox
 from process.pcb import PCB
 from process.manager import ProcessManager
 from process.power_scheduler import PowerAwareScheduler
-from memory.memory_manager import MemoryManager
-from filesystem.mobile_fs import FileSystem
+from memory.memory_manager import FREE, MemoryManager
+from filesystem.mobile_fs import FileSystem, TEXT_EXTS, BINARY_EXTS
 from concurrency.background_tasks import CameraTask, MusicTask, SchedulerTask, PhotoConsumer
 import cv2
 from PIL import Image, ImageTk
@@ -15,10 +15,13 @@ import re
 import io
 import pygame
 import base64
+import posixpath
 from ui.themes import get_light_theme, get_dark_theme
 from ui.icons import ICONS
 
 class OSVisualizer(tk.Tk):
+    PREVIEW_BYTES = 64 * 1024
+
     def __init__(self):
         super().__init__()
         self.title("Mini Mobile OS - Single User")
@@ -31,6 +34,7 @@ class OSVisualizer(tk.Tk):
         self.process_manager = ProcessManager(self.scheduler)
         self.memory = MemoryManager()
         self.fs = FileSystem()
+        self.fs_events = self.fs.subscribe()
 
         self.bg_camera = CameraTask(self.fs, log_fn=self.log_message)
         self.bg_music = MusicTask(self.memory, pid=99)
@@ -45,6 +49,7 @@ class OSVisualizer(tk.Tk):
 
         self.setup_ui()
         self.refresh()
+        self.poll_fs_events()
 
         self.processed_count = 0
         self.photo_counter = 1
@@ -131,15 +136,13 @@ class OSVisualizer(tk.Tk):
             ttk.Label(stats_frame, text="Block storage not initialized").pack(pady=10)
             return
        
-        total_blocks = len(block_storage.blocks)
-        total_size = sum(len(block) for block in block_storage.blocks.values())
+        storage_stats = self.fs.storage_stats()
+        total_blocks = storage_stats['blocks']
+        total_size = storage_stats['physical_bytes']
         block_size = getattr(block_storage, 'BLOCK_SIZE', 512)
         
        
-        cache_hits = getattr(block_cache, 'hits', 0) if block_cache else 0
-        cache_misses = getattr(block_cache, 'misses', 0) if block_cache else 0
-        cache_size = len(block_cache.cache) if block_cache else 0
-        cache_capacity = getattr(block_cache, 'capacity', 0) if block_cache else 0
+        cache_stats = self.fs.cache_stats() if block_cache is not None else None
         
         # Display stats in a grid
         stats_grid = ttk.Frame(stats_frame)
@@ -150,13 +153,31 @@ class OSVisualizer(tk.Tk):
         ttk.Label(stats_grid, text=f"• Total Blocks: {total_blocks}").grid(row=0, column=1, sticky='w', padx=10)
         ttk.Label(stats_grid, text=f"• Used: {total_size} / {total_blocks * block_size} bytes").grid(row=0, column=2, sticky='w', padx=10)
         ttk.Label(stats_grid, text=f"• Block Size: {block_size} bytes").grid(row=0, column=3, sticky='w', padx=10)
+        ttk.Label(stats_grid, text=f"• Dedup Ratio: {storage_stats['dedup_ratio']:.2f}x").grid(row=0, column=4, sticky='w', padx=10)
         
         # Cache stats
-        if block_cache:
+        if block_cache is not None:
             ttk.Label(stats_grid, text="\nCache:", font=('Arial', 9, 'bold')).grid(row=1, column=0, sticky='w', pady=(10,0))
-            ttk.Label(stats_grid, text=f"• Size: {cache_size}/{cache_capacity} blocks").grid(row=1, column=1, sticky='w', padx=10)
-            hit_ratio = cache_hits / (cache_hits + cache_misses) if (cache_hits + cache_misses) > 0 else 0
-            ttk.Label(stats_grid, text=f"• Hit Ratio: {hit_ratio:.1%}").grid(row=1, column=2, sticky='w', padx=10)
+            ttk.Label(stats_grid, text=f"• Size: {cache_stats['used']}/{cache_stats['capacity']} bytes "
+                                       f"({cache_stats['entries']} blocks, {cache_stats['policy'].upper()})").grid(row=1, column=1, sticky='w', padx=10)
+            ttk.Label(stats_grid, text=f"• Hit Ratio: {cache_stats['hit_ratio']:.1%}").grid(row=1, column=2, sticky='w', padx=10)
+            ttk.Label(stats_grid, text=f"• Hits/Misses: {cache_stats['hits']}/{cache_stats['misses']}").grid(row=1, column=3, sticky='w', padx=10)
+            ttk.Label(stats_grid, text=f"• Evictions: {cache_stats['evictions']}").grid(row=1, column=4, sticky='w', padx=10)
+
+        readahead_stats = self.fs.readahead_stats()
+        if readahead_stats:
+            ttk.Label(stats_grid, text="\nRead-ahead:", font=('Arial', 9, 'bold')).grid(row=2, column=0, sticky='w', pady=(10,0))
+            ttk.Label(stats_grid, text=f"• Window: {readahead_stats['window']} blocks").grid(row=2, column=1, sticky='w', padx=10)
+            ttk.Label(stats_grid, text=f"• Prefetched/Used: {readahead_stats['issued']}/{readahead_stats['used']}").grid(row=2, column=2, sticky='w', padx=10)
+
+        compression_stats = self.fs.compression_stats()
+        if compression_stats:
+            ttk.Label(stats_grid, text="\nCompression:", font=('Arial', 9, 'bold')).grid(row=3, column=0, sticky='w', pady=(10,0))
+            ttk.Label(stats_grid, text=f"• Codec: {compression_stats['codec']}").grid(row=3, column=1, sticky='w', padx=10)
+            ttk.Label(stats_grid, text=f"• Ratio: {compression_stats['compression_ratio']:.2f}x").grid(row=3, column=2, sticky='w', padx=10)
+            ttk.Label(stats_grid, text=f"• Compressed/Raw: {compression_stats['compressed_blocks']}/"
+                                       f"{compression_stats['incompressible_blocks'] + compression_stats['skipped_blocks']}").grid(row=3, column=3, sticky='w', padx=10)
+            ttk.Label(stats_grid, text=f"• CPU: {compression_stats['compress_seconds'] * 1000:.1f} ms").grid(row=3, column=4, sticky='w', padx=10)
         
         # Block visualization frame
         vis_frame = ttk.LabelFrame(block_tab, text="Block Storage Map")
@@ -187,7 +208,7 @@ class OSVisualizer(tk.Tk):
                     file_path = f"{path}/{name}" if path else name
                     file_blocks[file_path] = {
                         'blocks': file.blocks,
-                        'encrypted': self.fs.is_encrypted(name) if hasattr(self.fs, 'is_encrypted') else False,
+                        'encrypted': self.fs.is_encrypted("/" + file_path) if hasattr(self.fs, 'is_encrypted') else False,
                         'size': getattr(file, 'size', 0)
                     }
             for name, subdir in directory.subdirectories.items():
@@ -216,16 +237,9 @@ class OSVisualizer(tk.Tk):
             header_frame.pack(fill='x')
             
             # Block ID (truncated) with copy button
-            short_id = f"{block_id[:6]}...{block_id[-2:]}"
+            short_id = f"#{block_id}"
             ttk.Label(header_frame, text=f"Block: {short_id}", font=('Arial', 8, 'bold')).pack(side='left')
             
-            # Cache indicator
-            in_cache = block_cache and block_id in block_cache.cache if block_cache else False
-            cache_icon = "✓" if in_cache else "✗"
-            cache_color = "green" if in_cache else "gray"
-            ttk.Label(header_frame, text=f"Cache: {cache_icon}", 
-                     foreground=cache_color, font=('Arial', 8)).pack(side='right', padx=5)
-            
             # Block info
             block_size = len(block)
             usage_ratio = min(block_size / block_size, 1.0)
@@ -236,7 +250,9 @@ class OSVisualizer(tk.Tk):
             if len(files_using) > 2:
                 files_text += f"\n• ...and {len(files_using)-2} more"
             
-            ttk.Label(block_frame, text=f"Size: {block_size} B", 
+            raw_size = block_storage.raw_sizes.get(block_id)
+            size_text = f"Size: {block_size} B" if raw_size is None else f"Size: {block_size} B (compressed from {raw_size} B)"
+            ttk.Label(block_frame, text=size_text, 
                      font=('Arial', 8)).pack(anchor='w')
             
             # Visual usage bar
@@ -305,17 +321,17 @@ class OSVisualizer(tk.Tk):
         tree.heading('encrypted', text='Encrypted', anchor='center')
         
        
-        def add_directory(directory, parent=''):
+        def add_directory(directory, parent='', path=''):
             dir_id = tree.insert(parent, 'end', text=directory.name, 
                               values=('Directory', '', directory.created_at, ''))
             
            
             for name, subdir in directory.subdirectories.items():
-                add_directory(subdir, dir_id)
+                add_directory(subdir, dir_id, f"{path}/{name}")
             
             # Add files
             for name, file in directory.files.items():
-                is_encrypted = self.fs.is_encrypted(name) if hasattr(self.fs, 'is_encrypted') else False
+                is_encrypted = self.fs.is_encrypted(f"{path}/{name}") if hasattr(self.fs, 'is_encrypted') else False
                 tree.insert(dir_id, 'end', text=name,
                            values=('File', f"{getattr(file, 'size', 0)} B", 
                                  getattr(file, 'created_at', ''), 
@@ -370,6 +386,9 @@ class OSVisualizer(tk.Tk):
         self.proc_status = ttk.Label(self.status_frame, text=f"{ICONS['process']} Processes: 0",
                                    font=status_font, relief="sunken", padding=5, foreground="#1976d2")
         self.proc_status.pack(side="left", padx=2)
+        self.fs_status = ttk.Label(self.status_frame, text=f"{ICONS['file']} Files: 0 (0 B)",
+                                 font=status_font, relief="sunken", padding=5, foreground="#6a1b9a")
+        self.fs_status.pack(side="left", padx=2)
         self.network_icon = ttk.Label(self.status_frame, text=ICONS['network'], font=icon_font, foreground="#0288d1")
         self.network_icon.pack(side="right", padx=(0,2))
         self.battery_icon = ttk.Label(self.status_frame, text=ICONS['battery'], font=icon_font, foreground="#fbc02d")
@@ -608,7 +627,7 @@ class OSVisualizer(tk.Tk):
             print("Error: Cannot open camera")
             self.log_message("Error: Cannot open camera")
             return
-        self.photo_counter = 1
+        self.photo_counter = self.get_next_photo_number()
         self.camera_running = True 
         print("Camera is open. Press SPACE to take a photo.")
         self.log_message("Camera is open. Press SPACE to take a photo.")
@@ -634,8 +653,7 @@ class OSVisualizer(tk.Tk):
             if event.keysym == "space":
                 ret, frame = self.cap.read()
                 if ret:
-                    photo_num = self.get_next_photo_number()
-                    filename = f"photo{photo_num}.jpg"
+                    filename = f"photo{self.photo_counter}.jpg"
                     cv2.imwrite(filename, frame)
                     print(f"Photo saved as {filename}")
                     self.log_message(f"Photo saved as {filename}")
@@ -717,25 +735,45 @@ class OSVisualizer(tk.Tk):
         self.bg_status.config(text=bg_text, 
                             foreground="green" if bg_running else "red")
         
-        used = sum(1 for p in self.memory.pages if p is not None)
-        total = len(self.memory.pages)
+        mem_stats = self.memory.stats()
+        used, total = mem_stats["used"], mem_stats["total"]
         self.mem_status.config(text=f"Memory: {used}/{total} KB")
         
         proc_count = sum(len(q) for q in self.scheduler.list_queues().values())
         self.proc_status.config(text=f"Processes: {proc_count}")
+
+        fs_stats = self.fs.stats()
+        self.fs_status.config(text=f"Files: {fs_stats['files']} ({fs_stats['bytes']} B)")
         
         self.time_status.config(text=f"System Time: {self.get_current_time()}")
     
     def refresh(self):
         self.update_process_display()
         self.update_memory_display()
-        self.update_file_display()
         self.update_status_bar()
         self.after(1000, self.refresh)
 
+    def poll_fs_events(self):
+        """Redraw the file list only when the filesystem reports a change
+        to what it shows."""
+        try:
+            events = self.fs_events.drain()
+            if events:
+                cwd = "/" + "/".join(d.name for d in self.fs.path_stack[1:])
+                if self.fs_search_var.get() or any(
+                        event.path == cwd or posixpath.dirname(event.path) == cwd or
+                        (event.src is not None and posixpath.dirname(event.src) == cwd) for event in events):
+                    self.update_file_display()
+        finally:
+            self.after(100, self.poll_fs_events)
+
     def update_process_display(self):
-        self.process_text.delete("1.0", tk.END)
         queues = self.scheduler.list_queues()
+        signature = [(name, [str(pcb) for pcb in q]) for name, q in queues.items()]
+        if signature == getattr(self, "_process_signature", None):
+            return
+        self._process_signature = signature
+        self.process_text.delete("1.0", tk.END)
         for name, q in queues.items():
             self.process_text.insert(tk.END, f"{name.capitalize()} Queue:\n")
             for pcb in q:
@@ -743,32 +781,42 @@ class OSVisualizer(tk.Tk):
             self.process_text.insert(tk.END, "\n")
 
     def update_memory_display(self):
-        self.memory_canvas.delete("all")
         width = self.memory_canvas.winfo_width()
         height = self.memory_canvas.winfo_height()
+        signature = (width, height, self.memory.version)
+        if signature == getattr(self, "_memory_signature", None):
+            return
+        self._memory_signature = signature
+        self.memory_canvas.delete("all")
         
-        cell_width = max(10, width / len(self.memory.pages))
-        for i, page in enumerate(self.memory.pages):
-            x1 = i * cell_width
-            x2 = (i + 1) * cell_width
-            
-            if page is None:
+        # One rectangle per run of frames with the same owner; runs past the
+        # right edge are not drawn.
+        cell_width = max(10, width / self.memory.total_frames)
+        for owner, start, length in self.memory.runs():
+            x1 = start * cell_width
+            if x1 > width:
+                break
+            x2 = (start + length) * cell_width
+
+            if owner == FREE:
                 color = "#f0f0f0"  # Free memory
             else:
                 import hashlib
-                color = f"#{hashlib.md5(str(page).encode()).hexdigest()[:6]}"
-            
-            self.memory_canvas.create_rectangle(x1, 10, x2, height-30, 
+                color = f"#{hashlib.md5(str(owner).encode()).hexdigest()[:6]}"
+
+            self.memory_canvas.create_rectangle(x1, 10, x2, height-30,
                                               fill=color, outline="#ccc")
-            if page is not None:
-                self.memory_canvas.create_text(x1 + cell_width/2, height-15, 
-                                             text=str(page), font=("Arial", 7))
-        
-        used = sum(1 for p in self.memory.pages if p is not None)
-        total = len(self.memory.pages)
+            if owner != FREE:
+                self.memory_canvas.create_text((x1 + min(x2, width)) / 2, height-15,
+                                             text=str(owner), font=("Arial", 7))
+
+        mem_stats = self.memory.stats()
+        used, total = mem_stats["used"], mem_stats["total"]
+        paging = self.memory.paging_stats()
+        swap_text = f" | Swapped: {paging['swapped']} | Faults: {paging['faults']}" if paging else ""
         self.mem_stats.config(
             text=f"Total: {total} KB | Used: {used} KB | Free: {total - used} KB | "
-                 f"Usage: {used/total*100:.1f}%" if total > 0 else "0%")
+                 f"Usage: {used/total*100:.1f}%{swap_text}" if total > 0 else "0%")
 
     def update_file_display(self):
         search_term = self.fs_search_var.get().lower()
@@ -780,13 +828,20 @@ class OSVisualizer(tk.Tk):
 
         self.fs_tree.delete(*self.fs_tree.get_children())
         
-        for file in self.fs.current_directory.files.values():
-            if not search_term or search_term in file.name.lower():
+        if search_term:
+            # Search the whole tree through the name index; absolute paths
+            # work with every handler below.
+            for path in self.fs.find(search_term, kind="file"):
+                prefix = "🔒 " if self.fs.is_encrypted(path) else "📄 "
+                self.fs_tree.insert('', 'end', text=prefix + path)
+            for path in self.fs.find(search_term, kind="dir"):
+                self.fs_tree.insert('', 'end', text="📁 " + path)
+        else:
+            for file in self.fs.current_directory.files.values():
                 prefix = "🔒 " if self.fs.is_encrypted(file.name) else "📄 "
                 self.fs_tree.insert('', 'end', text=prefix + file.name)
-        
-        for folder in self.fs.current_directory.subdirectories.values():
-            if not search_term or search_term in folder.name.lower():
+
+            for folder in self.fs.current_directory.subdirectories.values():
                 self.fs_tree.insert('', 'end', text="📁 " + folder.name)
 
         if selected_text:
@@ -885,6 +940,8 @@ class OSVisualizer(tk.Tk):
                 self.fs_detail.insert(tk.END,
                     f"Folder: {info['name']}\nCreated: {info['created_at']}\n"
                     f"Subfolders: {info['folders']}\nFiles: {info['files']}\n"
+                    f"Total: {info['total_files']} files, {info['total_folders']} folders, "
+                    f"{info['total_size']} bytes in {info['total_blocks']} blocks\n"
                 )
             else:
                 self.fs_detail.insert(tk.END, "Folder info not found.")
@@ -906,9 +963,9 @@ class OSVisualizer(tk.Tk):
         elif item_text.startswith("📄 ") or item_text.startswith("🔒 "):
             filename = item_text[2:].strip()
 
-            def open_viewer_with_content(content, encrypted):
+            def open_viewer_with_content(content, encrypted, complete=True):
                 popup = tk.Toplevel(self)
-                popup.title(f"{filename} - File Viewer")
+                popup.title(f"{filename} - File Viewer" if complete else f"{filename} - Preview")
 
                 text_widget = tk.Text(popup, width=60, height=20, state="normal")
                 text_widget.insert(tk.END, content)
@@ -960,6 +1017,8 @@ class OSVisualizer(tk.Tk):
 
                 btn_edit = ttk.Button(button_frame, text="Edit", command=enable_edit_mode)
                 btn_edit.pack(side="left", padx=5)
+                if not complete:
+                    btn_edit.config(state="disabled")
 
                 btn_save = ttk.Button(button_frame, text="Save", command=save, state="disabled")
                 btn_save.pack(side="left", padx=5)
@@ -981,19 +1040,27 @@ class OSVisualizer(tk.Tk):
                     pwd = pwd_entry.get()
                     if self.fs.check_password(filename, pwd):
                         pwd_popup.destroy()
-                        content = self.fs.read_file(filename, password=pwd)
-                        if isinstance(content, bytes):
-                            content = content.decode('utf-8', errors='ignore')
-                        open_viewer_with_content(content, encrypted=True)
+                        content, complete = self.read_preview(filename, password=pwd)
+                        open_viewer_with_content(content, encrypted=True, complete=complete)
                     else:
                         messagebox.showerror("Error", "Incorrect password!")
 
                 tk.Button(pwd_popup, text="Submit", command=check_password).pack(pady=10)
             else:
-                content = self.fs.read_file(filename)
-                if isinstance(content, bytes):
-                    content = content.decode('utf-8', errors='ignore')
-                open_viewer_with_content(content, encrypted=False)
+                content, complete = self.read_preview(filename)
+                open_viewer_with_content(content, encrypted=False, complete=complete)
+
+    def read_preview(self, filename, password=None):
+        """Read only the first PREVIEW_BYTES of a file; returns (text, complete)"""
+        ext = os.path.splitext(filename)[1].lower()
+        if ext not in TEXT_EXTS + BINARY_EXTS:
+            return "[Unsupported or binary file type.]", True
+        data = self.fs.read_file_range(filename, 0, self.PREVIEW_BYTES + 1, password=password)
+        complete = len(data) <= self.PREVIEW_BYTES
+        content = data[:self.PREVIEW_BYTES].decode('utf-8', errors='ignore')
+        if not complete:
+            content += f"\n\n[Preview: first {self.PREVIEW_BYTES} bytes]"
+        return content, complete
 
     def create_file_popup(self):
         popup = tk.Toplevel(self)
@@ -1005,7 +1072,11 @@ class OSVisualizer(tk.Tk):
         def create():
             filename = entry.get().strip()
             if filename:
-                self.fs.create_file(filename)
+                try:
+                    self.fs.create_file(filename)
+                except OSError as e:
+                    messagebox.showerror("Error", str(e))
+                    return
                 self._panel_flash(self.fs_tree)
                 self.update_file_display()
             popup.destroy()
@@ -1038,24 +1109,6 @@ class OSVisualizer(tk.Tk):
             self._panel_flash(self.fs_tree)
             self.update_file_display()
 
-    def show_block_storage(self):
-        window = tk.Toplevel(self)
-        window.title("Block Storage")
-        window.geometry("500x400")
-
-        text_widget = tk.Text(window, wrap="word")
-        text_widget.pack(fill="both", expand=True)
-
-        for i, (block_id, block) in enumerate(self.fs.storage.blocks.items()):
-            try:
-                display_block = block.decode('utf-8')
-            except UnicodeDecodeError:
-                display_block = str(block)
-            text_widget.insert("end", f"Block {i} (ID: {block_id}):\n{display_block}\n\n")
-
-
-
-
     def close_process_by_name(self, app_name):
         if app_name == "Camera" and not getattr(self, 'camera_running', False):
             return